@@ -0,0 +1,126 @@
+"""
+Vectorized carrier detection over whole buffers of power samples
+
+Thresholds are converted to linear power once, so a buffer is classified with
+array comparisons instead of a log10 per sample.
+"""
+
+import numpy as np
+
+
+def db_to_linear(level_db):
+    """Convert a dBFS power level to linear power"""
+    return 10.0 ** (level_db / 10.0)
+
+
+def linear_to_db(power):
+    """Convert linear power to dBFS, clamped at -100 like the original block"""
+    return 10 * np.log10(power) if power > 1e-10 else -100.0
+
+
+class ActivityDetector:
+    """
+    Hysteresis carrier detector with a minimum key-up duration
+
+    The carrier rises when power exceeds the attack threshold and falls when it
+    drops below the release threshold. A key-up is only reported once it has
+    lasted min_samples, and both edges are reported with absolute sample indices.
+    """
+
+    def __init__(self, attack_threshold=-30, release_threshold=None, min_samples=0):
+        self.min_samples = int(min_samples)
+        self.set_thresholds(attack_threshold, release_threshold)
+
+        self.nitems = 0            # samples processed so far
+        self.carrier = False       # raw hysteresis state at end of last buffer
+        self.active = False        # carrier confirmed (lasted min_samples)
+        self.run_start = 0         # absolute index where the current carrier rose
+        self.peak_power = 0.0      # peak linear power of the current/last key-up
+        self.runs = []             # (onset, offset, peak power) of key-ups ended in the last buffer
+
+    def set_thresholds(self, attack_threshold, release_threshold=None):
+        """Set attack/release levels in dBFS; release defaults to 3 dB below attack"""
+        if release_threshold is None:
+            release_threshold = attack_threshold - 3
+        if release_threshold > attack_threshold:
+            raise ValueError("release threshold must not exceed attack threshold")
+        self.attack_threshold = attack_threshold
+        self.release_threshold = release_threshold
+        # One assignment, so a buffer never sees a new attack level with the old release level
+        self._levels = (db_to_linear(attack_threshold), db_to_linear(release_threshold))
+
+    def process(self, power):
+        """
+        Classify a buffer of linear power samples
+
+        Returns a list of ('onset', index) and ('offset', index) events in
+        sample order, where index counts samples since the detector started.
+        """
+        n = len(power)
+        base = self.nitems
+        self.nitems += n
+        self.runs = []
+        if n == 0:
+            return []
+
+        attack, release = self._levels
+        above = power > attack
+        below = power < release
+
+        # Hold the last decisive sample's state through the hysteresis band
+        decisive = np.where(above | below, np.arange(n), -1)
+        np.maximum.accumulate(decisive, out=decisive)
+        state = np.where(decisive >= 0, above[np.maximum(decisive, 0)], self.carrier)
+
+        edges = np.flatnonzero(state[1:] != state[:-1]) + 1
+        if state[0] != self.carrier:
+            edges = np.concatenate(([0], edges))
+
+        events = []
+        segment_start = 0
+        for edge in edges.tolist():
+            if state[edge]:
+                self.run_start = base + edge
+                self.peak_power = 0.0
+            else:
+                self._track_peak(power, segment_start, edge)
+                self._end_run(base + edge, events)
+            segment_start = edge
+
+        self.carrier = bool(state[-1])
+        if self.carrier:
+            self._track_peak(power, segment_start, n)
+            if not self.active and self.nitems - self.run_start >= self.min_samples:
+                self.active = True
+                events.append(('onset', self.run_start))
+
+        return events
+
+    def skip(self, n):
+        """
+        Advance past n samples that were never seen, e.g. dropped by a squelch
+        gate as quiet; a carrier still up is taken to have fallen at the gap.
+        Returns events like process().
+        """
+        self.runs = []
+        events = []
+        if self.carrier:
+            self._end_run(self.nitems, events)
+            self.carrier = False
+        self.nitems += n
+        return events
+
+    def _track_peak(self, power, start, stop):
+        """Fold the peak of power[start:stop] into the current key-up"""
+        if stop > start:
+            self.peak_power = max(self.peak_power, float(power[start:stop].max()))
+
+    def _end_run(self, index, events):
+        """Close the carrier that fell at index, reporting it if long enough"""
+        if not self.active and index - self.run_start >= self.min_samples:
+            events.append(('onset', self.run_start))
+            self.active = True
+        if self.active:
+            events.append(('offset', index))
+            self.runs.append((self.run_start, index, self.peak_power))
+            self.active = False
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Fixed-size ring buffer of completed key-ups, with a query CLI
+
+Each event is one record of a NumPy structured array (onset and release
+as Unix times, peak power and channel index), so memory is fixed by the
+capacity however long the monitor runs. The oldest events are overwritten
+first. Events are kept in onset order, so each half of the ring is sorted
+and a time lookup is two binary searches.
+
+With a path, the ring is a memory-mapped .npy file that survives restarts.
+It can be queried from another process while the monitor is writing it:
+
+    python3 activity_log.py events.npy recent -n 20
+    python3 activity_log.py events.npy counts --since 24h --interval 1h
+"""
+
+import os
+import threading
+import time
+from argparse import ArgumentParser
+from datetime import datetime
+import numpy as np
+from activity_detector import linear_to_db
+
+EVENT_DTYPE = np.dtype([
+    ('onset', '<f8'),     # Unix time the carrier rose
+    ('release', '<f8'),   # Unix time the carrier fell
+    ('peak_db', '<f4'),   # peak smoothed power during the key-up, dBFS
+    ('channel', '<u2'),   # channel index (0 for the single-channel monitor)
+])
+
+
+class ActivityLog:
+    """
+    Ring buffer of activity events, optionally backed by a .npy file
+
+    An existing file is reopened with its own capacity; readonly opens it
+    for queries without taking part in writing.
+    """
+
+    def __init__(self, capacity=65536, path=None, readonly=False):
+        if path and (readonly or os.path.exists(path)):
+            self.events = np.lib.format.open_memmap(path, mode='r' if readonly else 'r+')
+            if self.events.dtype != EVENT_DTYPE or self.events.ndim != 1:
+                raise ValueError(f"{path} is not an activity log")
+        elif path:
+            self.events = np.lib.format.open_memmap(path, mode='w+', dtype=EVENT_DTYPE, shape=(capacity,))
+            self.events['onset'] = np.nan
+        else:
+            self.events = np.zeros(capacity, dtype=EVENT_DTYPE)
+            self.events['onset'] = np.nan
+        self.path = path
+        self.capacity = len(self.events)
+        self._lock = threading.Lock()
+        self._recover()
+
+    def _recover(self):
+        """Find the oldest event and the fill level from the stored records"""
+        onset = self.events['onset']
+        valid = ~np.isnan(onset)
+        self.count = int(valid.sum())
+        if self.count < self.capacity:
+            self.start = 0
+        else:
+            # A full ring is a rotated sorted array: the oldest event follows the newest
+            drops = np.flatnonzero(onset[1:] < onset[:-1])
+            self.start = int(drops[0]) + 1 if len(drops) else 0
+
+    def record(self, channel, onset, release, peak_db):
+        """Add one completed key-up, overwriting the oldest event when full"""
+        with self._lock:
+            if self.count == self.capacity:
+                self.start = (self.start + 1) % self.capacity
+                self.count -= 1
+
+            # Channels report within a buffer out of order, so an event may
+            # need to move back a few places to keep the ring sorted
+            position = self.count
+            if self.count and onset < self.events['onset'][(self.start + self.count - 1) % self.capacity]:
+                position = self._search(onset, 'right')
+                moved = (self.start + np.arange(position, self.count)) % self.capacity
+                self.events[(moved + 1) % self.capacity] = self.events[moved]
+
+            self.events[(self.start + position) % self.capacity] = (onset, release, peak_db, channel)
+            self.count += 1
+
+    def record_runs(self, channel, detector, rate, now=None):
+        """Record the key-ups an ActivityDetector closed in its last buffer"""
+        if now is None:
+            now = time.time()
+        for start, stop, peak in detector.runs:
+            self.record(channel, now - (detector.nitems - start) / rate,
+                        now - (detector.nitems - stop) / rate, linear_to_db(peak))
+
+    def _segments(self):
+        """The ring as (older, newer) sorted views, oldest event first"""
+        end = self.start + self.count
+        if end <= self.capacity:
+            return self.events[self.start:end], self.events[:0]
+        return self.events[self.start:], self.events[:end - self.capacity]
+
+    def _search(self, t, side='left'):
+        """Logical position of onset time t, by binary search of each sorted half"""
+        older, newer = self._segments()
+        position = int(np.searchsorted(older['onset'], t, side))
+        if position == len(older):
+            position += int(np.searchsorted(newer['onset'], t, side))
+        return position
+
+    def between(self, start, stop=None, channel=None):
+        """Copy of the events with onset in [start, stop), oldest first"""
+        with self._lock:
+            lo = self._search(start)
+            hi = self._search(stop) if stop is not None else self.count
+            older, newer = self._segments()
+            split = len(older)
+            events = np.concatenate((older[lo:min(hi, split)], newer[max(lo - split, 0):max(hi - split, 0)]))
+        if channel is not None:
+            events = events[events['channel'] == channel]
+        return events
+
+    def recent(self, n=20, channel=None):
+        """The last n events, oldest first"""
+        with self._lock:
+            older, newer = self._segments()
+            events = np.concatenate((older[-n:], newer[-n:]))
+        if channel is not None:
+            events = events[events['channel'] == channel]
+        return events[-n:]
+
+    def counts(self, start, stop, interval, channel=None):
+        """Key-ups and airtime seconds per interval, as (bin starts, counts, airtime)"""
+        edges = start + interval * np.arange(int(np.ceil((stop - start) / interval)) + 1)
+        events = self.between(edges[0], edges[-1], channel)
+        index = np.searchsorted(edges, events['onset'], 'right') - 1
+        counts = np.bincount(index, minlength=len(edges) - 1)
+        airtime = np.bincount(index, weights=events['release'] - events['onset'], minlength=len(edges) - 1)
+        return edges[:-1], counts, airtime
+
+    def flush(self):
+        """Write a file-backed ring to disk"""
+        if self.path:
+            self.events.flush()
+
+
+def parse_duration(text):
+    """Seconds from '90', '90s', '15m', '2h' or '7d'"""
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    if text[-1:] in units:
+        return float(text[:-1]) * units[text[-1]]
+    return float(text)
+
+
+def format_time(t):
+    return datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def argument_parser():
+    parser = ArgumentParser(description="Query a repeater activity log")
+    parser.add_argument("path", help="Activity log .npy file written by the monitor")
+    parser.add_argument("--channel", type=int, help="Only show this channel index")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    recent = commands.add_parser("recent", help="List the most recent key-ups")
+    recent.add_argument("-n", type=int, default=20, help="Number of events")
+
+    counts = commands.add_parser("counts", help="Key-ups and airtime per interval")
+    counts.add_argument("--since", type=parse_duration, default=86400.0, help="How far back, e.g. 24h")
+    counts.add_argument("--interval", type=parse_duration, default=3600.0, help="Bin width, e.g. 1h")
+    return parser
+
+
+def main():
+    options = argument_parser().parse_args()
+    log = ActivityLog(path=options.path, readonly=True)
+
+    if options.command == 'recent':
+        for event in log.recent(options.n, options.channel):
+            print(f"{format_time(event['onset'])}  channel {event['channel']:2d}  "
+                  f"{event['release'] - event['onset']:6.1f} s  peak {event['peak_db']:6.1f} dBFS")
+        return
+
+    now = time.time()
+    starts, counts, airtime = log.counts(now - options.since, now, options.interval, options.channel)
+    for start, count, seconds in zip(starts, counts, airtime):
+        print(f"{format_time(start)}  {count:5d} key-ups  {seconds:8.1f} s airtime")
+
+
+if __name__ == '__main__':
+    main()
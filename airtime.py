@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Airtime and duty-cycle statistics per channel, in fixed-size rollups
+
+The detectors already run-length encode the thresholded power stream of
+each buffer with NumPy (ActivityDetector.process); AirtimeStats takes their
+onset/offset edges from the blocks' listeners and accumulates key-ups,
+airtime and the longest transmission into three rings of buckets:
+
+    minute  the last 24 hours
+    hour    the last 31 days
+    day     the last year
+
+A transmission is split across every bucket it covers, so a carrier that
+stays up for an hour shows in sixty minute buckets. Memory is fixed by the
+number of channels however long the monitor runs. With a path, the rollups
+are a memory-mapped .npy file that survives restarts and can be exported
+from another process while the monitor is writing it. Rows belong to
+channel names, kept beside the file in <name>.names.json, so reordering
+channels keeps each one's history, and a row only passes to a new channel
+once its old channel is gone, cleared first:
+
+    python3 airtime.py airtime.npy --rollup hour --since 24h
+    python3 airtime.py airtime.npy --rollup day --format csv > airtime.csv
+"""
+
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+import numpy as np
+from activity_log import format_time, parse_duration
+import metrics
+
+BUCKET_DTYPE = np.dtype([
+    ('start', '<i8'),     # Unix time the bucket starts, -1 if unused
+    ('keyups', '<u4'),    # key-ups that began in the bucket
+    ('airtime', '<f8'),   # seconds with a confirmed carrier
+    ('longest', '<f4'),   # longest key-up that began in the bucket, seconds
+])
+
+# name, bucket length (s), buckets kept
+ROLLUPS = (
+    ('minute', 60, 1440),
+    ('hour', 3600, 744),
+    ('day', 86400, 366),
+)
+
+
+class AirtimeStats:
+    """
+    Streaming airtime accounting for channels named by names
+
+    Rows of the array belong to channel names (which also label the
+    metrics), columns are the buckets of every rollup back to back. Edges
+    arrive by channel name, so a monitor still running its old channel list
+    after set_names() never credits the wrong row; edges of a channel that is
+    no longer configured are ignored. An existing file is reopened as long as
+    it has room for every channel.
+    """
+
+    def __init__(self, names=(0,), path=None, readonly=False):
+        slots = sum(size for _, _, size in ROLLUPS)
+        if path and (readonly or os.path.exists(path)):
+            self.buckets = np.lib.format.open_memmap(path, mode='r' if readonly else 'r+')
+            if self.buckets.dtype != BUCKET_DTYPE or self.buckets.ndim != 2 or self.buckets.shape[1] != slots:
+                raise ValueError(f"{path} is not an airtime file")
+            if not readonly and self.buckets.shape[0] < len(names):
+                raise ValueError(f"{path} holds {self.buckets.shape[0]} channels but {len(names)} are "
+                                 "configured; move it aside to start a new one")
+        elif path:
+            self.buckets = np.lib.format.open_memmap(path, mode='w+', dtype=BUCKET_DTYPE,
+                                                     shape=(len(names), slots))
+            self.buckets['start'] = -1
+        else:
+            self.buckets = np.zeros((len(names), slots), dtype=BUCKET_DTYPE)
+            self.buckets['start'] = -1
+        self.path = path
+        self.names_path = os.path.splitext(path)[0] + '.names.json' if path else None
+        self.row_names = [None] * self.buckets.shape[0]   # channel name owning each row
+        if self.names_path and os.path.exists(self.names_path):
+            with open(self.names_path) as f:
+                saved = json.load(f)
+            self.row_names[:len(saved)] = saved[:len(self.row_names)]
+        elif path and os.path.exists(path) and not readonly:
+            # Written before rows had names: they are in the order of the configured channels
+            self.row_names[:len(names)] = [str(name) for name in names]
+        self.rollups = {}
+        offset = 0
+        for name, period, size in ROLLUPS:
+            self.rollups[name] = (offset, period, size)
+            offset += size
+
+        self.open = {}   # row -> [onset, accounted up to], for carriers still up
+        self._lock = threading.Lock()
+        if readonly:
+            self.names = [str(i) if name is None else name for i, name in enumerate(self.row_names)]
+            self.rows = {name: row for row, name in enumerate(self.names)}
+        else:
+            self.set_names(names)
+
+    def assign_rows(self, names):
+        """
+        The row each of names would use, without changing anything: its own
+        row if it has one, else a row whose channel is no longer configured.
+        Raises ValueError if there are not enough rows.
+        """
+        names = [str(name) for name in names]
+        if len(set(names)) != len(names):
+            raise ValueError("Channel names must be unique; airtime is kept per name")
+        owned = {name: row for row, name in enumerate(self.row_names) if name is not None}
+        free = [row for row, name in enumerate(self.row_names) if name not in names]
+        rows = []
+        for name in names:
+            if name in owned:
+                rows.append(owned[name])
+            elif free:
+                rows.append(free.pop(0))
+            else:
+                raise ValueError(f"The airtime file holds {self.buckets.shape[0]} channels but {len(names)} "
+                                 "are configured; restart with a new file")
+        return rows
+
+    def set_names(self, names):
+        """Give each configured channel name its row and bind the metrics, e.g. after a reload"""
+        rows = self.assign_rows(names)
+        names = [str(name) for name in names]
+        with self._lock:
+            for row in set(self.open) - set(rows):
+                del self.open[row]   # a removed channel's carrier is no longer accounted
+            for row, name in zip(rows, names):
+                if self.row_names[row] != name:
+                    # The row's previous channel is gone; its history must not carry over
+                    self.buckets[row] = 0
+                    self.buckets[row]['start'] = -1
+                    self.open.pop(row, None)
+                    self.row_names[row] = name
+            self.names = names
+            self.rows = dict(zip(names, rows))
+            self.airtime_metrics = {row: metrics.CHANNEL_AIRTIME.labels(name) for row, name in zip(rows, names)}
+            self.duty_metrics = {row: {window: metrics.CHANNEL_DUTY_CYCLE.labels(name, window)
+                                       for window in ('hour', 'day')} for row, name in zip(rows, names)}
+        if self.names_path:
+            tmp_path = self.names_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.row_names, f)
+            os.replace(tmp_path, self.names_path)
+
+    def listener(self, name=str):
+        """
+        A detector listener feeding key-up edges in, converted from stream time
+        to Unix time; name maps the monitor's channel index to the channel name
+        in the list it is running
+        """
+        def record_edge(channel, kind, edge_time, detected_time):
+            t = time.time() - (detected_time - edge_time)
+            if kind == 'onset':
+                self.onset(name(channel), t)
+            else:
+                self.offset(name(channel), t)
+
+        return record_edge
+
+    def onset(self, name, t):
+        with self._lock:
+            row = self.rows.get(str(name))
+            if row is not None:
+                self.open[row] = [t, t]
+
+    def offset(self, name, t):
+        with self._lock:
+            row = self.rows.get(str(name))
+            run = self.open.pop(row, None)
+            if run is None:
+                return  # began before a restart or reload
+            onset, accounted = run
+            self._add_airtime(row, accounted, t)
+            self._add_keyup(row, onset, t - onset)
+
+    def tick(self, now=None):
+        """Account carriers that are still up and refresh the duty-cycle gauges; call every few seconds"""
+        if now is None:
+            now = time.time()
+        with self._lock:
+            for row, run in self.open.items():
+                self._add_airtime(row, run[1], now)
+                run[1] = now
+            for row, duty in self.duty_metrics.items():
+                duty['hour'].set(self._recent_airtime(row, 'minute', now - 3600) / 3600)
+                duty['day'].set(self._recent_airtime(row, 'hour', now - 86400) / 86400)
+
+    def _rows(self, row, rollup):
+        offset, period, size = self.rollups[rollup]
+        return self.buckets[row, offset:offset + size], period, size
+
+    def _claim(self, rows, periods, period, size):
+        """
+        Ring slots for the given period numbers, clearing slots that hold an
+        older period; periods whose slot already holds a newer one are masked out
+        """
+        slots = periods % size
+        starts = periods * period
+        held = rows['start'][slots]
+        keep = held <= starts
+        stale = slots[keep & (held < starts)]
+        rows[stale] = 0
+        rows['start'][stale] = starts[keep & (held < starts)]
+        return slots, keep
+
+    def _add_airtime(self, row, start, stop):
+        """Spread the carrier time [start, stop) over every bucket of a row it covers"""
+        if stop <= start:
+            return
+        if row in self.airtime_metrics:
+            self.airtime_metrics[row].inc(stop - start)
+        for rollup in self.rollups:
+            rows, period, size = self._rows(row, rollup)
+            last = int(np.ceil(stop / period)) - 1   # a carrier ending on a boundary has no time after it
+            periods = np.arange(max(int(start // period), last - size + 1), last + 1)
+            seconds = np.minimum((periods + 1) * period, stop) - np.maximum(periods * period, start)
+            slots, keep = self._claim(rows, periods, period, size)
+            rows['airtime'][slots[keep]] += seconds[keep]
+
+    def _add_keyup(self, row, onset, duration):
+        """Count a finished key-up in the buckets where it began"""
+        for rollup in self.rollups:
+            rows, period, size = self._rows(row, rollup)
+            slots, keep = self._claim(rows, np.array([int(onset // period)]), period, size)
+            if keep[0]:
+                slot = slots[0]
+                rows['keyups'][slot] += 1
+                rows['longest'][slot] = max(rows['longest'][slot], duration)
+
+    def _recent_airtime(self, row, rollup, since):
+        rows, period, size = self._rows(row, rollup)
+        return float(rows['airtime'][rows['start'] >= since - period].sum())
+
+    def rollup(self, rollup='hour', channel=None, since=None):
+        """
+        The used buckets of one rollup as a structured array with a 'channel'
+        column, oldest first
+        """
+        channels = range(self.buckets.shape[0]) if channel is None else [channel]
+        with self._lock:
+            parts = []
+            for i in channels:
+                rows = self._rows(i, rollup)[0]
+                rows = rows[rows['start'] >= (since if since is not None else 0)]
+                part = np.zeros(len(rows), dtype=BUCKET_DTYPE.descr + [('channel', '<u2')])
+                for field in BUCKET_DTYPE.names:
+                    part[field] = rows[field]
+                part['channel'] = i
+                parts.append(part)
+        table = np.concatenate(parts) if parts else np.zeros(0, dtype=BUCKET_DTYPE.descr + [('channel', '<u2')])
+        return table[np.lexsort((table['channel'], table['start']))]
+
+    def records(self, rollup='hour', channel=None, since=None):
+        """The buckets of one rollup as plain dicts, for CSV and JSON export"""
+        period = self.rollups[rollup][1]
+        return [{
+            'start': format_time(row['start']),
+            'channel': self.row_names[row['channel']] or str(row['channel']),
+            'keyups': int(row['keyups']),
+            'airtime': round(float(row['airtime']), 1),
+            'duty_cycle': round(float(row['airtime']) / period, 4),
+            'longest': round(float(row['longest']), 1),
+        } for row in self.rollup(rollup, channel, since)]
+
+    def export_csv(self, file, rollup='hour', channel=None, since=None):
+        writer = csv.DictWriter(file, ['start', 'channel', 'keyups', 'airtime', 'duty_cycle', 'longest'])
+        writer.writeheader()
+        writer.writerows(self.records(rollup, channel, since))
+
+    def export_json(self, file, rollup='hour', channel=None, since=None):
+        json.dump({'rollup': rollup, 'period': self.rollups[rollup][1],
+                   'buckets': self.records(rollup, channel, since)}, file, indent=2)
+        file.write('\n')
+
+    def flush(self):
+        """Write a file-backed set of rollups to disk"""
+        if self.path:
+            self.buckets.flush()
+
+
+def argument_parser():
+    parser = ArgumentParser(description="Export repeater airtime rollups")
+    parser.add_argument("path", help="Airtime .npy file written by the monitor")
+    parser.add_argument("--rollup", choices=[name for name, _, _ in ROLLUPS], default='hour',
+                        help="Bucket size")
+    parser.add_argument("--channel", type=int, help="Only show this row of the file")
+    parser.add_argument("--since", type=parse_duration, help="How far back, e.g. 24h (default: everything kept)")
+    parser.add_argument("--format", choices=('table', 'csv', 'json'), default='table')
+    return parser
+
+
+def main():
+    options = argument_parser().parse_args()
+    stats = AirtimeStats(path=options.path, readonly=True)
+    since = time.time() - options.since if options.since is not None else None
+
+    if options.format == 'csv':
+        stats.export_csv(sys.stdout, options.rollup, options.channel, since)
+    elif options.format == 'json':
+        stats.export_json(sys.stdout, options.rollup, options.channel, since)
+    else:
+        for record in stats.records(options.rollup, options.channel, since):
+            print(f"{record['start']}  channel {record['channel']:>2}  {record['keyups']:5d} key-ups  "
+                  f"{record['airtime']:8.1f} s airtime  {record['duty_cycle'] * 100:5.1f}%  "
+                  f"longest {record['longest']:6.1f} s")
+
+
+if __name__ == '__main__':
+    main()
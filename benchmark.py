@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the repeater monitor DSP chain
+
+The CPU groups push a fixed number of quiet-channel noise samples (or a
+replayed SigMF recording) through the detection chain as fast as possible and
+report CPU time per second of signal, after subtracting the cost of the
+source itself.
+
+The detection group renders synthetic repeater traffic (see synthetic_iq.py)
+to a temporary recording, replays it through the single-channel chain or the
+channelizer at several buffer sizes and channel counts, and scores the
+detector's events against the ground-truth key-ups. Wanted key-ups are a few
+dB above the activity threshold, and a co-channel signal a few dB below it
+fills the gaps between them; detecting it counts as a false detection. The
+single-channel chain is also replayed behind the squelch gate, which must not
+miss key-ups, detect them later or add false detections compared with the
+ungated chain; the run exits with status 1 if it does.
+"""
+
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+import numpy as np
+from gnuradio import analog
+from gnuradio import blocks
+from gnuradio import gr
+from channelizer import fft_channelizer
+from front_end import FRONT_ENDS, channel_filter
+from iq_source import sigmf_replay
+from monitor_chain import single_channel_monitor
+from monitor_config import ChannelConfig
+from synthetic_iq import repeater_scene
+
+
+SAMP_RATE = 2048000
+NOISE_AMPLITUDE = 0.001  # about -60 dBFS, well below the activity threshold
+ONSET_TOLERANCE = 0.01   # an onset this early still counts for a key-up (IIR/FFT smearing)
+SCORING_MARGIN = 1.0     # key-ups and events in the final second are not scored
+SQUELCH_LATENCY_TOLERANCE = 0.005  # gated median onset latency may exceed ungated by this much
+THRESHOLD = -30      # default activity threshold of both chains, dBFS
+SIGNAL_MARGIN = 3.0  # wanted key-ups this many dB above the threshold
+WEAK_MARGIN = 4.0    # sub-threshold co-channel signal this many dB below it
+
+
+class benchmark_flowgraph(gr.top_block):
+    """Noise or recording -> head -> chain under test (or a null sink for the baseline)"""
+
+    def __init__(self, chain, nsamples, recording=None):
+        gr.top_block.__init__(self, "Repeater monitor benchmark")
+
+        if recording:
+            self.source = sigmf_replay(recording, realtime=False, repeat=True)
+        else:
+            self.source = analog.fastnoise_source_c(analog.GR_GAUSSIAN, NOISE_AMPLITUDE, 0, 8192)
+        self.head = blocks.head(gr.sizeof_gr_complex, nsamples)
+        self.chain = chain if chain is not None else blocks.null_sink(gr.sizeof_gr_complex)
+        self.connect(self.source, self.head, self.chain)
+
+
+def measure(chain, nsamples, recording=None, max_noutput_items=None):
+    """Run one flowgraph to completion and return (cpu seconds, wall seconds)"""
+    tb = benchmark_flowgraph(chain, nsamples, recording)
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    if max_noutput_items:
+        tb.run(max_noutput_items)
+    else:
+        tb.run()
+    return time.process_time() - cpu_start, time.perf_counter() - wall_start
+
+
+def demod_cases():
+    """WFM demodulator before (always on) and after (off / gated), and CTCSS verification, on a quiet channel"""
+    cases = {
+        f"demod={mode}": lambda mode=mode: single_channel_monitor(SAMP_RATE, demod=mode)
+        for mode in ('always', 'off', 'gated')
+    }
+    cases["ctcss=any"] = lambda: single_channel_monitor(SAMP_RATE, ctcss='any')
+    return cases
+
+
+def front_end_cases():
+    """Each channel filter alone, then the complete chain built on it"""
+    cases = {}
+    for front_end in FRONT_ENDS:
+        cases[f"filter={front_end}"] = lambda front_end=front_end: filter_only(front_end)
+    for front_end in FRONT_ENDS:
+        cases[f"chain front_end={front_end}"] = \
+            lambda front_end=front_end: single_channel_monitor(SAMP_RATE, front_end=front_end)
+    return cases
+
+
+class filter_only(gr.hier_block2):
+    """Channel filter terminated in a null sink"""
+
+    def __init__(self, front_end):
+        gr.hier_block2.__init__(self,
+            "filter_only",
+            gr.io_signature(1, 1, gr.sizeof_gr_complex),
+            gr.io_signature(0, 0, 0))
+
+        self.filter = channel_filter(front_end, SAMP_RATE)
+        self.sink = blocks.null_sink(gr.sizeof_gr_complex)
+        self.connect(self, self.filter, self.sink)
+
+
+def squelch_cases():
+    """Single-channel chain on a quiet channel without and behind the squelch gate"""
+    return {
+        "squelch=off": lambda: single_channel_monitor(SAMP_RATE),
+        "squelch=3dB": lambda: single_channel_monitor(SAMP_RATE, squelch=3.0),
+    }
+
+
+CASE_GROUPS = {
+    'demod': demod_cases,
+    'front-end': front_end_cases,
+    'squelch': squelch_cases,
+}
+
+
+def run(cases, seconds, recording=None):
+    """Measure every case and return one result dict per case"""
+    nsamples = int(seconds * SAMP_RATE)
+    baseline_cpu, _ = measure(None, nsamples, recording)
+
+    results = []
+    for name, build in cases.items():
+        cpu, wall = measure(build(), nsamples, recording)
+        chain_cpu = max(cpu - baseline_cpu, 0.0)
+        results.append({
+            'case': name,
+            'samples': nsamples,
+            'cpu_seconds': chain_cpu,
+            'cpu_percent': 100.0 * chain_cpu / seconds,
+            'samples_per_second': nsamples / wall,
+        })
+        print(f"{name:24s} {100.0 * chain_cpu / seconds:7.1f}% CPU "
+              f"{nsamples / wall / 1e6:8.2f} MS/s", flush=True)
+    return results
+
+
+def channel_offsets(count):
+    """Spread count channels evenly across the capture, clear of the band edges"""
+    if count == 1:
+        return [0.0]
+    span = SAMP_RATE / 2 - 150000
+    return [float(offset) for offset in np.round(np.linspace(-span, span, count), -3)]
+
+
+def detection_chain(offsets, events, squelch=None):
+    """
+    Chain for a detection run, appending every detector edge to events
+
+    One channel uses the single-channel chain (behind a squelch gate with
+    squelch set), more use the channelizer. Heartbeats are disabled with
+    empty push URLs.
+    """
+    def listener(channel, kind, edge_time, detected_time):
+        events.append((channel, kind, edge_time, detected_time))
+
+    if len(offsets) == 1:
+        chain = single_channel_monitor(SAMP_RATE, uptime_kuma_url='', squelch=squelch)
+        chain.epy_block_0.listeners.append(listener)
+    else:
+        channels = [ChannelConfig(i, offset, url='') for i, offset in enumerate(offsets)]
+        chain = fft_channelizer(channels, SAMP_RATE)
+        chain.monitor.listeners.append(listener)
+    return chain
+
+
+def score(truth, events, duration):
+    """
+    Match detected onsets to ground-truth key-ups
+
+    Each key-up is matched by the first unused onset between its start
+    (less ONSET_TOLERANCE) and its end; unmatched key-ups are missed and
+    unmatched onsets are false. Returns (key-ups, missed, false, latencies).
+    """
+    horizon = duration - SCORING_MARGIN
+    keyups = missed = false = 0
+    latencies = []
+    for channel, pattern in truth.items():
+        onsets = [(edge, detected) for ch, kind, edge, detected in events
+                  if ch == channel and kind == 'onset' and edge < horizon]
+        used = [False] * len(onsets)
+        for start, stop in pattern:
+            if start >= horizon:
+                continue
+            keyups += 1
+            for i, (edge, detected) in enumerate(onsets):
+                if not used[i] and start - ONSET_TOLERANCE <= edge <= stop:
+                    used[i] = True
+                    latencies.append(detected - start)
+                    break
+            else:
+                missed += 1
+        false += used.count(False)
+    return keyups, missed, false, latencies
+
+
+def run_detection(seconds, buffer_sizes, channel_counts, squelch_margins=(3.0,)):
+    """
+    Score detection and measure CPU for every channel count and buffer size,
+    and for the single-channel chain behind a squelch gate at each margin
+    """
+    nsamples = int(seconds * SAMP_RATE)
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for count in channel_counts:
+            offsets = channel_offsets(count)
+            # The single-channel filter is wider than a channelizer bin, so move its interferer out
+            scene = repeater_scene(offsets, seconds, THRESHOLD + SIGNAL_MARGIN,
+                                   adjacent_offset=150000 if count == 1 else 25000, samp_rate=SAMP_RATE,
+                                   seed=count, weak_db=THRESHOLD - WEAK_MARGIN)
+            recording = os.path.join(workdir, f"scene_{count}")
+            scene.save_sigmf(recording, seconds)
+
+            for buffer_size in buffer_sizes:
+                reference = None
+                for squelch in [None] + (list(squelch_margins) if count == 1 else []):
+                    events = []
+                    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                        baseline_cpu, _ = measure(None, nsamples, recording, buffer_size)
+                        cpu, wall = measure(detection_chain(offsets, events, squelch), nsamples, recording,
+                                            buffer_size)
+                    chain_cpu = max(cpu - baseline_cpu, 0.0)
+
+                    keyups, missed, false, latencies = score(scene.truth(), events, seconds)
+                    if latencies:
+                        p50, p90, p99 = np.percentile(latencies, [50, 90, 99]) * 1e3
+                    else:
+                        p50 = p90 = p99 = float('nan')
+
+                    name = f"detection channels={count} buffer={buffer_size}"
+                    if squelch is not None:
+                        name += f" squelch={squelch:g}dB"
+                    result = {
+                        'case': name,
+                        'channels': count,
+                        'buffer_size': buffer_size,
+                        'squelch': squelch,
+                        'samples': nsamples,
+                        'cpu_seconds': chain_cpu,
+                        'cpu_percent': 100.0 * chain_cpu / seconds,
+                        'cpu_percent_per_channel': 100.0 * chain_cpu / seconds / count,
+                        'samples_per_second': nsamples / wall,
+                        'keyups': keyups,
+                        'missed': missed,
+                        'false_detections': false,
+                        'latency_ms_p50': float(p50),
+                        'latency_ms_p90': float(p90),
+                        'latency_ms_p99': float(p99),
+                    }
+                    check = ""
+                    if squelch is None:
+                        reference = result
+                    else:
+                        # Gating must not cost detections, delay them or add false ones
+                        worse = (missed > reference['missed'] or
+                                 false > reference['false_detections'] or
+                                 p50 > reference['latency_ms_p50'] + SQUELCH_LATENCY_TOLERANCE * 1e3)
+                        result['squelch_check'] = 'worse' if worse else 'ok'
+                        check = f"  squelch check {result['squelch_check'].upper()}"
+                    results.append(result)
+                    print(f"{name:52s} {100.0 * chain_cpu / seconds:7.1f}% CPU "
+                          f"({100.0 * chain_cpu / seconds / count:.1f}%/ch) {nsamples / wall / 1e6:7.2f} MS/s  "
+                          f"missed {missed}/{keyups}  false {false}  "
+                          f"latency p50/p90/p99 {p50:.0f}/{p90:.0f}/{p99:.0f} ms{check}", flush=True)
+    return results
+
+
+def int_list(text):
+    """Parse a comma-separated list of integers"""
+    return [int(item) for item in text.split(',')]
+
+
+def float_list(text):
+    """Parse a comma-separated list of numbers"""
+    return [float(item) for item in text.split(',') if item]
+
+
+def argument_parser():
+    parser = ArgumentParser(description="Benchmark the repeater monitor DSP chain")
+    parser.add_argument(
+        "-s", "--seconds", type=float, default=10.0,
+        help="Seconds of 2.048 MS/s signal to process per case")
+    parser.add_argument(
+        "-g", "--group", action="append", choices=sorted(CASE_GROUPS) + ['detection'],
+        help="Benchmark group to run (repeatable; default: all)")
+    parser.add_argument(
+        "-r", "--recording",
+        help="Replay this 2.048 MS/s SigMF recording (looped) instead of synthetic noise")
+    parser.add_argument(
+        "-b", "--buffer-sizes", type=int_list, default=[1024, 8192, 65536],
+        help="Comma-separated scheduler buffer sizes (max_noutput_items) for the detection group")
+    parser.add_argument(
+        "-n", "--channels", type=int_list, default=[1, 4, 12],
+        help="Comma-separated channel counts for the detection group")
+    parser.add_argument(
+        "-q", "--squelch", type=float_list, default=[3.0],
+        help="Comma-separated squelch margins (dB) to check against the ungated single-channel chain")
+    parser.add_argument(
+        "-o", "--output",
+        help="Write machine-readable results to this JSON file")
+    return parser
+
+
+def main():
+    options = argument_parser().parse_args()
+    groups = options.group or sorted(CASE_GROUPS) + ['detection']
+
+    print(f"CPU per second of {SAMP_RATE / 1e6:.3f} MS/s signal (100% = one core in real time)")
+    print("-" * 50)
+    cases = {}
+    for group in groups:
+        if group in CASE_GROUPS:
+            cases.update(CASE_GROUPS[group]())
+    results = run(cases, options.seconds, options.recording) if cases else []
+    if 'detection' in groups:
+        results += run_detection(options.seconds, options.buffer_sizes, options.channels, options.squelch)
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump({'samp_rate': SAMP_RATE, 'time': time.time(), 'results': results}, f, indent=2)
+        print(f"Results written to {options.output}")
+    if any(result.get('squelch_check') == 'worse' for result in results):
+        print("The squelch gate missed, delayed or falsely detected key-ups compared with the ungated chain",
+              file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -122,6 +122,10 @@ a = Analysis(
         'PyQt5.QtWidgets',
         'numpy',
         'requests',
+        'activity_detector',
+        'heartbeat_dispatcher',
+        'metrics',
+        'noise_floor',
         'threading',
         'time',
         'sys',
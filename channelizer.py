@@ -0,0 +1,256 @@
+"""
+FFT-bin channelizer for monitoring many repeaters inside one capture
+
+One FFT of the full capture is shared by every channel; each channel only
+costs a sum over its bins and a detector update, so adding repeaters is
+almost free compared with one filter chain per repeater.
+"""
+
+import threading
+import numpy as np
+from gnuradio import gr
+from gnuradio import blocks
+from gnuradio import fft
+from gnuradio.fft import window
+from activity_detector import ActivityDetector, linear_to_db
+from heartbeat_dispatcher import HeartbeatDispatcher
+import latency
+from noise_floor import AdaptiveThreshold
+import metrics
+
+
+def channel_bins(channels, samp_rate, fft_size):
+    """Return [lo, hi) bin ranges of each channel in an fft-shifted spectrum"""
+    bin_width = samp_rate / fft_size
+    lo = np.empty(len(channels), dtype=np.int64)
+    hi = np.empty(len(channels), dtype=np.int64)
+    for i, channel in enumerate(channels):
+        lo[i] = np.ceil((channel.offset - channel.bandwidth / 2) / bin_width) + fft_size // 2
+        hi[i] = np.floor((channel.offset + channel.bandwidth / 2) / bin_width) + fft_size // 2 + 1
+    return np.clip(lo, 0, fft_size), np.clip(hi, 0, fft_size)
+
+
+class channel_power_monitor(gr.sync_block):
+    """
+    Per-channel activity detection on averaged FFT power frames
+    """
+    def __init__(self, channels, samp_rate=2048000, fft_size=1024, fft_average=8, scale=1.0, dispatcher=None,
+                 event_log=None):
+        gr.sync_block.__init__(self,
+            name="channel_power_monitor",
+            in_sig=[(np.float32, fft_size)],
+            out_sig=[])
+
+        self.channels = channels
+        self.samp_rate = samp_rate
+        self.fft_size = fft_size
+        self.scale = scale
+        self.lo, self.hi = channel_bins(channels, samp_rate, fft_size)
+
+        self.frame_rate = frame_rate = samp_rate / (fft_size * fft_average)
+        self.detectors = [ActivityDetector(channel.threshold, channel.release_threshold,
+                                           min_samples=channel.min_duration * frame_rate)
+                          for channel in channels]
+        self.noise_floors = [self._noise_floor(detector, channel)
+                             for detector, channel in zip(self.detectors, channels)]
+        self.activity_detected = [False] * len(channels)
+
+        # Callables notified of every edge as (channel, kind, edge_time, detected_time),
+        # with times in seconds of stream since the flowgraph started
+        self.listeners = []
+        self._bind_metrics()
+
+        # Optional activity_log.ActivityLog receiving every completed key-up
+        self.event_log = event_log
+
+        # One dispatcher serves every channel's push URL
+        self.dispatcher = dispatcher or HeartbeatDispatcher()
+        self.owns_dispatcher = dispatcher is None
+
+        # A channel list staged by update_channels(), adopted between buffers
+        self._pending = None
+        self._lock = threading.Lock()
+
+        print(f"Channelizer initialized: {len(channels)} channels, "
+              f"{fft_size}-point FFT, {frame_rate:.0f} frames/s")
+        for channel, lo, hi in zip(channels, self.lo, self.hi):
+            print(f"  {channel.name}: offset {channel.offset / 1e3:+.1f} kHz, bins {lo}-{hi - 1}, "
+                  f"threshold {channel.threshold} dBFS"
+                  f"{'' if channel.margin is None else f' (adaptive, +{channel.margin} dB)'}, "
+                  f"cooldown {channel.cooldown} s")
+
+    def work(self, input_items, output_items):
+        frames = input_items[0]
+
+        if self._pending is not None:
+            self._apply_pending()
+
+        # Channel power is a difference of cumulative bin sums: O(bins) per
+        # frame no matter how many channels are configured
+        cumulative = np.zeros((len(frames), frames.shape[1] + 1), dtype=np.float64)
+        np.cumsum(frames, axis=1, out=cumulative[:, 1:])
+        power = (cumulative[:, self.hi] - cumulative[:, self.lo]) * self.scale
+
+        end = (self.nitems_read(0) + len(frames)) / self.frame_rate
+        for i, detector in enumerate(self.detectors):
+            if self.noise_floors[i] is not None:
+                self.noise_floors[i].update(power[:, i])
+            for kind, index in detector.process(power[:, i]):
+                if kind == 'onset':
+                    self.activity_detected[i] = True
+                    # A detector added by a reload counts frames from then, not from the start
+                    self._send_heartbeat(i, latency.start_trace(end - (detector.nitems - index) / self.frame_rate))
+                    print(f"Activity detected on {self.channels[i].name}! "
+                          f"Power: {linear_to_db(detector.peak_power):.1f} dBFS")
+                else:
+                    self.activity_detected[i] = False
+                self.transition_metrics[i][kind].inc()
+                for listener in self.listeners:
+                    listener(i, kind, index / self.frame_rate, detector.nitems / self.frame_rate)
+            if self.event_log is not None and detector.runs:
+                self.event_log.record_runs(i, detector, self.frame_rate)
+
+        if len(frames):
+            for i, detector in enumerate(self.detectors):
+                self.power_metrics[i].set(linear_to_db(power[-1, i]))
+                self.carrier_metrics[i].set(int(detector.carrier))
+                self.threshold_metrics[i].set(detector.attack_threshold)
+                if self.noise_floors[i] is not None and self.noise_floors[i].floor is not None:
+                    self.floor_metrics[i].set(self.noise_floors[i].floor)
+
+        return len(frames)
+
+    def plan_channels(self, channels):
+        """
+        Build the detectors and noise floors of a new channel list without
+        staging it, so a bad setting raises ValueError before anything changes
+        """
+        current = self.channels
+        return current, self._plan(channels, current)
+
+    def update_channels(self, channels, plan=None):
+        """
+        Stage a new channel list; work() adopts it before its next buffer, so
+        every frame is judged entirely by the old list or entirely by the new one
+
+        New detectors and noise floors are built here (or by plan_channels()),
+        on the caller's thread, so a bad setting raises ValueError to the
+        caller and work() only swaps references.
+        """
+        while True:
+            current, staged = plan or self.plan_channels(channels)
+            plan = None
+            with self._lock:
+                # work() may have adopted an earlier list meanwhile; plan against that one
+                if self.channels is current:
+                    self._pending = staged
+                    return
+
+    def _plan(self, channels, current):
+        """
+        Match the new list against the current one: a channel with an
+        unchanged offset and bandwidth keeps its detector and noise floor, so
+        it needs no warm-up. Returns (channels, lo, hi, entries) with one
+        (channel, kept index or None, detector, noise floor) entry per channel.
+        """
+        previous = {(channel.offset, channel.bandwidth): i for i, channel in enumerate(current)}
+        entries = []
+        for channel in channels:
+            # Built for every channel, so invalid thresholds raise here rather than in work()
+            detector = ActivityDetector(channel.threshold, channel.release_threshold,
+                                        min_samples=channel.min_duration * self.frame_rate)
+            i = previous.pop((channel.offset, channel.bandwidth), None)
+            if i is None:
+                entries.append((channel, None, detector, self._noise_floor(detector, channel)))
+                continue
+            noise_floor = self.noise_floors[i]
+            if channel.margin is None:
+                noise_floor = None
+            elif noise_floor is None:
+                noise_floor = self._noise_floor(self.detectors[i], channel)
+            entries.append((channel, i, detector, noise_floor))
+        lo, hi = channel_bins(channels, self.samp_rate, self.fft_size)
+        return channels, lo, hi, entries
+
+    def _apply_pending(self):
+        """Adopt the staged channel list; nothing here can fail"""
+        with self._lock:
+            channels, lo, hi, entries = self._pending
+            self._pending = None
+            detectors, noise_floors, active = [], [], []
+            for channel, i, detector, noise_floor in entries:
+                if i is None:
+                    active.append(False)
+                else:
+                    # Keep the running detector's state; its new settings were checked by _plan()
+                    detector, checked = self.detectors[i], detector
+                    detector.set_thresholds(checked.attack_threshold, checked.release_threshold)
+                    detector.min_samples = checked.min_samples
+                    if noise_floor is not None:
+                        noise_floor.hysteresis = detector.attack_threshold - detector.release_threshold
+                        noise_floor.set_margin(channel.margin)
+                    active.append(self.activity_detected[i])
+                detectors.append(detector)
+                noise_floors.append(noise_floor)
+            for channel in self.channels:
+                for gauge in (metrics.CHANNEL_POWER, metrics.CHANNEL_CARRIER, metrics.CHANNEL_THRESHOLD,
+                              metrics.NOISE_FLOOR):
+                    gauge.remove(channel.name)
+            self.lo, self.hi = lo, hi
+            self.detectors = detectors
+            self.noise_floors = noise_floors
+            self.activity_detected = active
+            self.channels = channels
+            self._bind_metrics()
+
+    def _noise_floor(self, detector, channel):
+        """Adaptive threshold for a channel with a noise margin, else None"""
+        if channel.margin is None:
+            return None
+        return AdaptiveThreshold(detector, channel.margin, self.frame_rate)
+
+    def _bind_metrics(self):
+        """Look up each channel's metric series once, by channel name"""
+        self.power_metrics = [metrics.CHANNEL_POWER.labels(channel.name) for channel in self.channels]
+        self.carrier_metrics = [metrics.CHANNEL_CARRIER.labels(channel.name) for channel in self.channels]
+        self.threshold_metrics = [metrics.CHANNEL_THRESHOLD.labels(channel.name) for channel in self.channels]
+        self.floor_metrics = [metrics.NOISE_FLOOR.labels(channel.name) for channel in self.channels]
+        self.transition_metrics = [{kind: metrics.ACTIVITY_TRANSITIONS.labels(channel.name, kind)
+                                    for kind in ('onset', 'offset')} for channel in self.channels]
+
+    def _send_heartbeat(self, i, trace=None):
+        """Queue a heartbeat for one channel's Uptime Kuma monitor"""
+        channel = self.channels[i]
+        self.dispatcher.submit(channel.url, channel.cooldown, linear_to_db(self.detectors[i].peak_power), trace)
+
+    def stop(self):
+        # A shared dispatcher (e.g. the headless event bus) is stopped by its owner
+        if self.owns_dispatcher:
+            self.dispatcher.stop()
+        return True
+
+
+class fft_channelizer(gr.hier_block2):
+    """
+    Complex capture in, per-channel detection and heartbeats out
+
+    stream_to_vector -> windowed FFT -> |X|^2 -> average fft_average frames
+    -> channel_power_monitor. Power is normalized so a full-scale carrier
+    reads 0 dBFS, matching the single-channel power path.
+    """
+    def __init__(self, channels, samp_rate=2048000, fft_size=1024, fft_average=8, dispatcher=None, event_log=None):
+        gr.hier_block2.__init__(self,
+            "fft_channelizer",
+            gr.io_signature(1, 1, gr.sizeof_gr_complex),
+            gr.io_signature(0, 0, 0))
+
+        taps = window.blackmanharris(fft_size)
+        scale = 1.0 / (fft_size * float(np.sum(np.square(taps))) * fft_average)
+
+        self.stream_to_vector = blocks.stream_to_vector(gr.sizeof_gr_complex, fft_size)
+        self.fft = fft.fft_vcc(fft_size, True, taps, True, 1)
+        self.mag_squared = blocks.complex_to_mag_squared(fft_size)
+        self.average = blocks.integrate_ff(fft_average, fft_size)
+        self.monitor = channel_power_monitor(channels, samp_rate, fft_size, fft_average, scale, dispatcher, event_log)
+
+        self.connect(self, self.stream_to_vector, self.fft, self.mag_squared, self.average, self.monitor)
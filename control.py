@@ -0,0 +1,73 @@
+"""
+Local HTTP control API for the headless monitor
+
+Settings change on the running flowgraph, the same way as a SIGHUP reload:
+the SDR stays open and detectors keep their warm-up state.
+
+    GET  /config   the settings in use, as JSON
+    POST /config   a JSON object of settings to change; lists such as
+                   "channels" or "scan" replace the whole list
+    POST /reload   re-read the config file and command line, like SIGHUP
+
+    curl -s localhost:9300/config
+    curl -s -X POST localhost:9300/config -d '{"activity_threshold": -35, "rf_gain": 30}'
+
+Changes made here last until the next reload or restart. The API has no
+authentication, so it only listens on 127.0.0.1 by default.
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _ControlHandler(BaseHTTPRequestHandler):
+    monitor = None      # the running repeater_monitor_headless
+    reload = None       # callable re-reading the config file, for POST /reload
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/config':
+            self.send_error(404)
+            return
+        self._reply(200, self.monitor.config.to_dict())
+
+    def do_POST(self):
+        path = self.path.split('?')[0]
+        if path not in ('/config', '/reload'):
+            self.send_error(404)
+            return
+        try:
+            if path == '/reload':
+                self.reload()
+            else:
+                length = int(self.headers.get('Content-Length', 0))
+                changes = json.loads(self.rfile.read(length) or b'{}')
+                if not isinstance(changes, dict):
+                    raise ValueError("Expected a JSON object of settings")
+                self.monitor.apply(changes)
+        except (OSError, TypeError, ValueError) as e:
+            self._reply(400, {'error': str(e)})
+            return
+        print(f"Configuration changed through the control API ({path})", flush=True)
+        self._reply(200, self.monitor.config.to_dict())
+
+    def _reply(self, status, data):
+        body = json.dumps(data, indent=2).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_control_server(monitor, port, reload, addr='127.0.0.1'):
+    """Serve the control API from a daemon thread; returns the server (call shutdown() to stop)"""
+    handler = type('ControlHandler', (_ControlHandler,), {'monitor': monitor, 'reload': staticmethod(reload)})
+    server = ThreadingHTTPServer((addr, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="control-http", daemon=True).start()
+    print(f"Control API at http://{addr}:{server.server_address[1]}/config")
+    return server
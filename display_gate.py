@@ -0,0 +1,42 @@
+"""
+Pauses the GUI display sinks while the window cannot be seen
+
+The frequency and number sinks are fed through blocks.copy gates
+(display_gate_spectrum/display_gate_power in the flowgraph) controlled by
+the display_enabled variable. An event filter on the top-level window clears
+it when the window is hidden or minimized and sets it again when the window
+comes back, so display work never competes with detection on small hosts.
+"""
+
+from PyQt5 import Qt
+from PyQt5 import QtCore
+
+
+class visibility_filter(Qt.QObject):
+    """
+    Qt event filter calling set_enabled(visible) whenever the window's visibility changes
+    """
+    EVENTS = (QtCore.QEvent.Show, QtCore.QEvent.Hide, QtCore.QEvent.WindowStateChange)
+
+    def __init__(self, window, set_enabled):
+        Qt.QObject.__init__(self, window)
+
+        self.window = window
+        self.set_enabled = set_enabled
+        self.visible = True  # display_enabled starts out True
+        window.installEventFilter(self)
+
+    def eventFilter(self, obj, event):
+        if obj is self.window and event.type() in self.EVENTS:
+            visible = self.window.isVisible() and not self.window.isMinimized()
+            if visible != self.visible:
+                self.visible = visible
+                self.set_enabled(visible)
+                print(f"Display {'resumed' if visible else 'paused'}")
+        return False  # never swallow the event
+
+
+def pause_when_hidden(tb):
+    """Install the filter on a flowgraph window with a set_display_enabled() setter"""
+    tb.display_filter = visibility_filter(tb, tb.set_display_enabled)
+    return tb.display_filter
@@ -0,0 +1,421 @@
+"""
+Event bus fanning activity events out to pluggable sinks
+
+Detector blocks publish two kinds of events: 'activity' (a key-up onset or
+offset, from the blocks' listeners) and 'heartbeat' (a push the detector
+wants sent; the bus stands in for the heartbeat dispatcher). Each event is
+a plain dict:
+
+    {'type': 'activity', 'channel': '146.9400 MHz', 'kind': 'onset',
+     'time': 1760000000.0, 'power_db': -42.5}
+    {'type': 'activity', ..., 'kind': 'offset', 'duration': 12.3}
+    {'type': 'heartbeat', 'url': 'http://...', 'cooldown': 60, 'time': ..., 'power_db': -42.5,
+     'trace': {'rx': ..., 'detect': ...}}
+
+The optional trace holds the key-up's latency stamps so far (see latency.py).
+
+Every sink has its own bounded queue and worker thread, so a slow sink only
+backs up its own queue. What happens when that queue is full is the sink's
+back-pressure policy:
+
+    drop-oldest  discard the oldest queued event (the default; never blocks)
+    spool        hand the event to the sink's thread, which writes it to an
+                 SQLite file; it is sent once the queue drains. Events the
+                 sink fails to take are spooled too, and spooled events are
+                 retried with backoff and only deleted once sent
+    block        wait for space; this stalls the publisher, so only use it for
+                 offline replays where a lost event is worse than a slow run
+
+The publisher (usually the GNU Radio scheduler thread) never touches the
+database. stop() gives each sink until a deadline to send what is queued,
+then spools (or counts as dropped) whatever is left.
+
+Sinks implement send(event), may list the event types they want in types,
+and may implement close(). Sinks are built from config entries with
+make_sink(); MQTT needs the optional paho-mqtt package.
+"""
+
+import collections
+import json
+import socket
+import sqlite3
+import threading
+import time
+import requests
+import metrics
+
+POLICIES = ('drop-oldest', 'spool', 'block')
+
+
+class EventSpool:
+    """Overflow events of one sink, as JSON rows in an SQLite WAL database"""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY, event TEXT NOT NULL)")
+        self.count = self.db.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+
+    def append(self, event):
+        with self._lock:
+            self.db.execute("INSERT INTO events (event) VALUES (?)", (json.dumps(event),))
+            self.count += 1
+
+    def batch(self, size=100):
+        """The oldest events as (id, event) pairs"""
+        with self._lock:
+            rows = self.db.execute("SELECT id, event FROM events ORDER BY id LIMIT ?", (size,)).fetchall()
+        return [(row_id, json.loads(event)) for row_id, event in rows]
+
+    def delete(self, row_id):
+        with self._lock:
+            self.count -= self.db.execute("DELETE FROM events WHERE id = ?", (row_id,)).rowcount
+
+    def close(self):
+        with self._lock:
+            self.db.close()
+
+
+class SinkWorker:
+    """One sink's bounded queue, back-pressure policy and delivery thread"""
+
+    def __init__(self, sink, policy='drop-oldest', max_queue=1024, spool=None, max_overflow=4096,
+                 retry_base=1.0, retry_max=60.0):
+        if policy not in POLICIES:
+            raise ValueError(f"Sink policy must be one of {', '.join(POLICIES)}")
+        if policy == 'spool' and not spool:
+            raise ValueError(f"Sink {sink.name!r} uses the spool policy but has no 'spool' file")
+        self.sink = sink
+        self.policy = policy
+        self.max_queue = max_queue
+        self.max_overflow = max_overflow
+        self.spool = EventSpool(spool) if policy == 'spool' else None
+
+        self.queue = collections.deque()
+        self.overflow = collections.deque()   # spool policy: events for the worker thread to spool
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.retry_delay = 0.0
+        self.retry_at = 0.0                   # monotonic time spooled events may be tried again
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._deadline = None
+        self.delivered = metrics.SINK_EVENTS.labels(sink.name)
+        self.dropped = metrics.SINK_DROPPED.labels(sink.name)
+        self.errors = metrics.SINK_ERRORS.labels(sink.name)
+        self.depth = metrics.SINK_QUEUE.labels(sink.name)
+
+        self._thread = threading.Thread(target=self._run, name=f"sink-{sink.name}", daemon=True)
+        self._thread.start()
+
+    def put(self, event):
+        """Queue an event, applying the policy if the queue is full"""
+        with self._condition:
+            if self._stopping:
+                self.dropped.inc()
+                return
+            if len(self.queue) >= self.max_queue:
+                if self.policy == 'drop-oldest':
+                    self.queue.popleft()
+                    self.dropped.inc()
+                elif self.policy == 'spool':
+                    if len(self.overflow) >= self.max_overflow:
+                        self.dropped.inc()  # the worker is too far behind even to spool
+                    else:
+                        self.overflow.append(event)
+                        self._condition.notify_all()
+                    return
+                else:
+                    while len(self.queue) >= self.max_queue and not self._stopping:
+                        self._condition.wait()
+                    if self._stopping:
+                        self.dropped.inc()
+                        return
+            self.queue.append(event)
+            self.depth.set(len(self.queue))
+            self._condition.notify_all()
+
+    def stop(self, timeout=5):
+        """Send what is queued until timeout, spool or drop the rest, then close the sink"""
+        with self._condition:
+            if self._stopping:
+                return
+            self._stopping = True
+            self._deadline = time.monotonic() + timeout
+            self._condition.notify_all()
+        self._thread.join(timeout + 1)
+        close = getattr(self.sink, 'close', None)
+        if close is not None:
+            close()
+        if self.spool is not None and not self._thread.is_alive():
+            self.spool.close()
+
+    def _run(self):
+        """Worker loop: spool any overflow, send the queue, then retry spooled events"""
+        while True:
+            with self._condition:
+                while not (self.queue or self.overflow or self._stopping or self._retry_due()):
+                    self._condition.wait(self._retry_wait())
+                if self._stopping:
+                    break
+                overflow, self.overflow = self.overflow, collections.deque()
+                event = self.queue.popleft() if self.queue else None
+                self.depth.set(len(self.queue))
+                self._condition.notify_all()
+            for item in overflow:
+                self.spool.append(item)
+            if event is not None:
+                if self._send(event):
+                    self.retry_delay, self.retry_at = 0.0, 0.0  # the sink answers; retry the spool now
+                elif self.spool is not None:
+                    self.spool.append(event)
+                    self._back_off()
+            elif not overflow:
+                self._retry_spooled()
+        self._drain()
+
+    def _retry_due(self):
+        return self.spool is not None and self.spool.count > 0 and time.monotonic() >= self.retry_at
+
+    def _retry_wait(self):
+        if self.spool is None or not self.spool.count:
+            return 1
+        return min(1, max(0.01, self.retry_at - time.monotonic()))
+
+    def _back_off(self):
+        self.retry_delay = min(self.retry_max, max(self.retry_base, 2 * self.retry_delay))
+        self.retry_at = time.monotonic() + self.retry_delay
+
+    def _retry_spooled(self):
+        """Send spooled events oldest first, deleting each once sent; back off at the first failure"""
+        for row_id, event in self.spool.batch():
+            with self._condition:
+                if self._stopping or self.queue or self.overflow:
+                    return
+            if not self._send(event):
+                self._back_off()
+                return
+            self.spool.delete(row_id)
+        self.retry_delay = 0.0
+
+    def _drain(self):
+        """At stop: send what is still queued until the deadline, then spool (or drop) the rest"""
+        with self._condition:
+            pending = list(self.queue) + list(self.overflow)
+            self.queue.clear()
+            self.overflow.clear()
+            self.depth.set(0)
+            self._condition.notify_all()
+        sending = True
+        for event in pending:
+            if sending and time.monotonic() < self._deadline:
+                if self._send(event):
+                    continue
+                sending = False  # don't wait out the sink's timeout for every event
+            if self.spool is not None:
+                self.spool.append(event)
+            else:
+                self.dropped.inc()
+
+    def _send(self, event):
+        """Deliver one event; returns False if the sink failed"""
+        try:
+            self.sink.send(event)
+            self.delivered.inc()
+            return True
+        except Exception as e:
+            self.errors.inc()
+            print(f"✗ {self.sink.name} sink error: {e}")
+            return False
+
+
+class EventBus:
+    """
+    Publishes events to every sink's worker without waiting for delivery
+
+    submit() and stop() match HeartbeatDispatcher, so the bus can be passed
+    to the detector chains as their dispatcher; heartbeats then reach Kuma
+    through a KumaSink like any other event.
+    """
+
+    def __init__(self):
+        self.workers = []
+
+    def add_sink(self, sink, policy='drop-oldest', max_queue=1024, spool=None):
+        worker = SinkWorker(sink, policy, max_queue, spool)
+        self.workers.append(worker)
+        return worker
+
+    def publish(self, event):
+        for worker in self.workers:
+            types = getattr(worker.sink, 'types', None)
+            if types is None or event['type'] in types:
+                worker.put(event)
+
+    def submit(self, url, cooldown_time=None, power=None, trace=None):
+        if not url:
+            return False  # heartbeats disabled
+        event = {'type': 'heartbeat', 'url': url, 'cooldown': cooldown_time,
+                 'time': time.time(), 'power_db': power}
+        if trace is not None:
+            event['trace'] = trace  # stamped further by the dispatcher, see latency.py
+        self.publish(event)
+        return True
+
+    def listener(self, name_of, power_of):
+        """
+        A detector listener publishing activity events
+
+        name_of(i) and power_of(i) give channel i's name and current peak power
+        (dBFS); edge times are converted from stream time to Unix time.
+        """
+        onsets = {}
+
+        def publish_edge(channel, kind, edge_time, detected_time):
+            event = {'type': 'activity', 'channel': name_of(channel), 'kind': kind,
+                     'time': time.time() - (detected_time - edge_time), 'power_db': power_of(channel)}
+            if kind == 'onset':
+                onsets[channel] = edge_time
+            elif channel in onsets:
+                event['duration'] = edge_time - onsets.pop(channel)
+            self.publish(event)
+
+        return publish_edge
+
+    def stop(self, timeout=5):
+        """Drain every sink, with one shared deadline"""
+        deadline = time.monotonic() + timeout
+        for worker in self.workers:
+            worker.stop(max(0, deadline - time.monotonic()))
+
+
+class KumaSink:
+    """Heartbeat events to Uptime Kuma through a HeartbeatDispatcher"""
+
+    types = ('heartbeat',)
+
+    def __init__(self, dispatcher, name='kuma'):
+        self.name = name
+        self.dispatcher = dispatcher
+
+    def send(self, event):
+        # The dispatcher adds stamps; other sinks may be serialising the same event
+        trace = event.get('trace')
+        self.dispatcher.submit(event['url'], event['cooldown'], event['power_db'],
+                               dict(trace) if trace is not None else None)
+
+    def close(self):
+        self.dispatcher.stop()
+
+
+class WebhookSink:
+    """Every event POSTed as JSON to a URL, over one keep-alive session"""
+
+    def __init__(self, url, name='webhook', timeout=5, types=None):
+        self.name = name
+        self.url = url
+        self.timeout = timeout
+        self.types = types
+        self.session = requests.Session()
+
+    def send(self, event):
+        response = self.session.post(self.url, json=event, timeout=self.timeout)
+        response.raise_for_status()
+
+    def close(self):
+        self.session.close()
+
+
+class StatsDSink:
+    """
+    Activity as StatsD metrics over UDP
+
+    <prefix>.activity.<channel>:1|c per onset, <prefix>.power.<channel>
+    gauges, <prefix>.keyup.<channel> timings in ms per offset and
+    <prefix>.heartbeat:1|c per push.
+    """
+
+    def __init__(self, host='127.0.0.1', port=8125, prefix='repeater', name='statsd', types=None):
+        self.name = name
+        self.address = (host, port)
+        self.prefix = prefix
+        self.types = types
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, event):
+        if event['type'] == 'heartbeat':
+            lines = [f"{self.prefix}.heartbeat:1|c"]
+        else:
+            channel = ''.join(c if c.isalnum() else '_' for c in str(event['channel']))
+            lines = [f"{self.prefix}.power.{channel}:{event['power_db']:.1f}|g"]
+            if event['kind'] == 'onset':
+                lines.append(f"{self.prefix}.activity.{channel}:1|c")
+            elif 'duration' in event:
+                lines.append(f"{self.prefix}.keyup.{channel}:{event['duration'] * 1e3:.0f}|ms")
+        self.socket.sendto('\n'.join(lines).encode(), self.address)
+
+    def close(self):
+        self.socket.close()
+
+
+class MQTTSink:
+    """
+    Events as JSON on <topic>/activity/<channel> and <topic>/heartbeat (needs paho-mqtt)
+
+    paho's network loop runs in its own thread and reconnects on its own;
+    with qos > 0 each publish waits for the broker's acknowledgement.
+    """
+
+    def __init__(self, host='127.0.0.1', port=1883, topic='repeater', qos=0, client_id='', name='mqtt',
+                 timeout=5, types=None):
+        try:
+            import paho.mqtt.client as mqtt
+        except ImportError:
+            raise ValueError("The mqtt sink needs paho-mqtt: pip install paho-mqtt")
+        self.name = name
+        self.topic = topic
+        self.qos = qos
+        self.timeout = timeout
+        self.types = types
+        if hasattr(mqtt, 'CallbackAPIVersion'):
+            self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id)
+        else:
+            self.client = mqtt.Client(client_id=client_id)
+        self.client.connect_async(host, port)
+        self.client.loop_start()
+
+    def send(self, event):
+        if event['type'] == 'heartbeat':
+            topic = f"{self.topic}/heartbeat"
+        else:
+            topic = f"{self.topic}/activity/{event['channel']}"
+        info = self.client.publish(topic, json.dumps(event), qos=self.qos)
+        if self.qos:
+            info.wait_for_publish(self.timeout)
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+SINK_TYPES = {
+    'webhook': WebhookSink,
+    'statsd': StatsDSink,
+    'mqtt': MQTTSink,
+}
+
+
+def add_sinks(bus, specs):
+    """Add sinks from config entries: {'type': ..., 'policy': ..., 'max_queue': ..., 'spool': ..., **options}"""
+    for spec in specs:
+        spec = dict(spec)
+        kind = spec.pop('type', None)
+        if kind not in SINK_TYPES:
+            raise ValueError(f"Unknown sink type {kind!r}: expected one of {', '.join(SINK_TYPES)}")
+        policy = spec.pop('policy', 'drop-oldest')
+        max_queue = spec.pop('max_queue', 1024)
+        spool = spec.pop('spool', None)
+        spec.setdefault('name', kind)
+        bus.add_sink(SINK_TYPES[kind](**spec), policy, max_queue, spool)
@@ -0,0 +1,71 @@
+"""
+Channel-selection front ends: 2.048 MS/s capture in, 256 kS/s channel out
+
+All front ends keep the original response (62.5 kHz passband, 87.5 kHz
+stopband) and decimate by 8; they differ only in how much CPU that costs.
+
+  single      one Hamming FIR at the full input rate (the original filter)
+  multistage  a short, wide-transition FIR decimating by 4, then a sharp FIR
+              decimating by 2 at a quarter of the rate
+  fft         the original taps applied by FFT fast convolution
+"""
+
+from gnuradio import filter
+from gnuradio.filter import firdes
+from gnuradio import gr
+from gnuradio.fft import window
+
+FRONT_ENDS = ('single', 'multistage', 'fft')
+
+DECIMATION = 8
+CUTOFF = 75000
+TRANSITION = 25000
+
+
+def single_stage_taps(samp_rate):
+    """The flowgraph's original low-pass design"""
+    return firdes.low_pass(1, samp_rate, CUTOFF, TRANSITION, window.WIN_HAMMING, 6.76)
+
+
+class multistage_decimator(gr.hier_block2):
+    """
+    Two-stage decimating low-pass filter
+
+    The first stage only has to keep aliases out of the final band, so its
+    stopband can start at (rate/4 - stopband edge); with a transition that
+    wide it needs under 30 taps instead of the ~200 of the single-stage
+    filter, and the sharp second stage runs at a quarter of the rate.
+    """
+    def __init__(self, samp_rate=2048000, first_decimation=4):
+        gr.hier_block2.__init__(self,
+            "multistage_decimator",
+            gr.io_signature(1, 1, gr.sizeof_gr_complex),
+            gr.io_signature(1, 1, gr.sizeof_gr_complex))
+
+        passband = CUTOFF - TRANSITION / 2
+        stopband = CUTOFF + TRANSITION / 2
+        first_stopband = samp_rate / first_decimation - stopband
+
+        # Half the available transition keeps passband aliases below -38 dB
+        first_transition = (first_stopband - passband) / 2
+
+        self.first_taps = firdes.low_pass(
+            1, samp_rate, first_stopband - first_transition / 2, first_transition, window.WIN_HAMMING, 6.76)
+        self.second_taps = firdes.low_pass(
+            1, samp_rate / first_decimation, CUTOFF, TRANSITION, window.WIN_HAMMING, 6.76)
+
+        self.first_stage = filter.fir_filter_ccf(first_decimation, self.first_taps)
+        self.second_stage = filter.fir_filter_ccf(DECIMATION // first_decimation, self.second_taps)
+
+        self.connect(self, self.first_stage, self.second_stage, self)
+
+
+def channel_filter(front_end='multistage', samp_rate=2048000):
+    """Build the decimate-by-8 channel filter for one of FRONT_ENDS"""
+    if front_end == 'single':
+        return filter.fir_filter_ccf(DECIMATION, single_stage_taps(samp_rate))
+    if front_end == 'multistage':
+        return multistage_decimator(samp_rate)
+    if front_end == 'fft':
+        return filter.fft_filter_ccf(DECIMATION, single_stage_taps(samp_rate), 1)
+    raise ValueError(f"front_end must be one of {', '.join(FRONT_ENDS)}")
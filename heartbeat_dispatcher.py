@@ -0,0 +1,310 @@
+"""
+Background heartbeat dispatcher for Uptime Kuma push monitors
+
+Heartbeats are queued by the GNU Radio scheduler thread and delivered by
+worker threads, so a slow or unreachable Kuma server never blocks work().
+
+Many channels usually push to the same Kuma instance, so delivery is
+organised per host: each host has its own keep-alive session, queue and
+worker threads (its concurrency limit), and a token bucket that spreads out
+the burst when many repeaters key up together. A host that is slow or down
+only delays its own heartbeats. A push for a URL that is already waiting,
+or still inside its cooldown, is coalesced instead of queued.
+
+With a spool (see heartbeat_spool.py), heartbeats that fail every retry,
+overflow the queue or are still queued at shutdown are written to disk and
+replayed, within the same rate limits, once the host answers again. The
+scheduler thread never touches the database: an overflowing heartbeat is
+handed to a spool thread through a bounded queue, and submit() only ever
+does a put_nowait and a counter.
+"""
+
+import queue
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from heartbeat_spool import HeartbeatSpool
+import latency
+import metrics
+
+
+class TokenBucket:
+    """Allows rate requests per second on average, in bursts of up to burst"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token and return how many seconds to wait before using it"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class _Host:
+    """Session, queue, rate limit and worker threads for one scheme://host:port"""
+
+    def __init__(self, name, dispatcher):
+        self.name = name
+        self.queue = queue.Queue(maxsize=dispatcher.max_queue)
+        self.bucket = TokenBucket(dispatcher.rate, dispatcher.burst)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=dispatcher.concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.threads = [threading.Thread(target=dispatcher._run, args=(self,),
+                                         name=f"heartbeat-{name}-{i}", daemon=True)
+                        for i in range(dispatcher.concurrency)]
+        for thread in self.threads:
+            thread.start()
+
+
+class HeartbeatDispatcher:
+    """
+    Bounded, coalescing, rate-limited heartbeat client
+
+    With details=True each push carries msg (the key-up's peak power) and
+    ping (milliseconds from detection to sending, i.e. queueing delay) as
+    Uptime Kuma query parameters.
+
+    Each listener is called as listener(url, ok, status, latency) after every
+    request, from the worker thread that sent it. A heartbeat submitted with a
+    trace (see latency.py) is stamped when it is queued, sent and acknowledged.
+    """
+
+    def __init__(self, cooldown_time=60, max_queue=64, max_retries=3,
+                 backoff_base=1.0, backoff_max=30.0, timeout=5,
+                 concurrency=2, rate=1.0, burst=5, details=False,
+                 spool=None, replay_interval=30, replay_batch=100, spool_queue=1024):
+        self.cooldown_time = cooldown_time
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst
+        self.details = details
+        self.replay_interval = replay_interval
+        self.replay_batch = replay_batch
+
+        self.last_heartbeat_time = {}
+        self.dropped = 0
+        self.coalesced = 0
+        self.listeners = []
+
+        self.hosts = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+        self.spool = None
+        if spool:
+            self.spool = HeartbeatSpool(spool)
+            metrics.HEARTBEAT_SPOOL_DEPTH.set(self.spool.depth())
+            # Overflow from submit(), written to the spool off the scheduler thread
+            self._overflow = queue.Queue(maxsize=spool_queue)
+            self._spooler = threading.Thread(target=self._write_overflow, name="heartbeat-spool", daemon=True)
+            self._spooler.start()
+            self._replayer = threading.Thread(target=self._replay, name="heartbeat-replay", daemon=True)
+            self._replayer.start()
+
+    def submit(self, url, cooldown_time=None, power=None, trace=None):
+        """Queue a heartbeat without blocking; returns False if it was dropped"""
+        if not url:
+            return False  # heartbeats disabled
+        if cooldown_time is None:
+            cooldown_time = self.cooldown_time
+        now = time.time()
+
+        with self._lock:
+            if url in self._pending or now - self.last_heartbeat_time.get(url, 0) < cooldown_time:
+                self.coalesced += 1
+                metrics.HEARTBEAT_COALESCED.inc()
+                return True
+            host = self._host(url)
+            latency.stamp(trace, 'enqueue')
+            try:
+                host.queue.put_nowait((url, cooldown_time, now, power, trace))
+            except queue.Full:
+                self.dropped += 1
+            else:
+                self._pending.add(url)
+                return True
+        metrics.HEARTBEAT_DROPPED.inc()
+        if self.spool is not None:
+            try:
+                self._overflow.put_nowait((url, now, power))
+            except queue.Full:
+                pass  # the spool thread is behind too; the drop is already counted
+        return False
+
+    def stop(self, timeout=5):
+        """Deliver queued heartbeats until timeout, then stop the workers and spool (or abandon) the rest"""
+        with self._lock:
+            hosts = list(self.hosts.values())
+        deadline = time.monotonic() + timeout
+        # The sentinels go behind the queued heartbeats, so the workers send those first
+        for host in hosts:
+            for _ in host.threads:
+                try:
+                    host.queue.put(None, timeout=max(0.01, deadline - time.monotonic()))
+                except queue.Full:
+                    pass
+        for host in hosts:
+            for thread in host.threads:
+                thread.join(max(0, deadline - time.monotonic()))
+        # Out of time: cut short rate-limit waits and retries, which spool their heartbeat
+        self._stopping.set()
+        for host in hosts:
+            for _ in host.threads:
+                try:
+                    host.queue.put_nowait(None)
+                except queue.Full:
+                    pass
+            for thread in host.threads:
+                thread.join(1)
+            host.session.close()
+            while True:
+                try:
+                    event = host.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if event is not None:
+                    self._spool(event[0], event[2], event[3])
+        if self.spool is not None:
+            try:
+                self._overflow.put(None, timeout=max(0.1, deadline - time.monotonic()))
+            except queue.Full:
+                pass
+            self._spooler.join(max(0.1, deadline - time.monotonic()))
+            self._replayer.join(max(0, deadline - time.monotonic()))
+            self.spool.close()
+
+    def _host(self, url):
+        """The per-host state for url, created on first use (call with the lock held)"""
+        parts = urlsplit(url)
+        name = f"{parts.scheme}://{parts.netloc}"
+        host = self.hosts.get(name)
+        if host is None:
+            host = self.hosts[name] = _Host(name, self)
+        return host
+
+    def _run(self, host):
+        """Worker loop: deliver one host's queued heartbeats one at a time"""
+        while not self._stopping.is_set():
+            event = host.queue.get()
+            if event is None:
+                break
+            try:
+                self._deliver(host, *event)
+            finally:
+                with self._lock:
+                    self._pending.discard(event[0])
+
+    def _deliver(self, host, url, cooldown_time, event_time, power, trace=None):
+        """Send one heartbeat within the host's rate limit, retrying on failure"""
+        # Check cooldown
+        if event_time - self.last_heartbeat_time.get(url, 0) < cooldown_time:
+            return
+
+        for attempt in range(self.max_retries + 1):
+            if self._stopping.wait(host.bucket.reserve()):
+                break
+            if self._send(host, url, event_time, power, trace=trace):
+                return
+            if attempt < self.max_retries and self._stopping.wait(self._backoff(attempt)):
+                break
+        self._spool(url, event_time, power)
+
+    def _send(self, host, url, event_time, power, replayed=False, trace=None):
+        """One heartbeat request; returns True if Kuma accepted it"""
+        metrics.HEARTBEAT_ATTEMPTS.inc()
+        latency.stamp(trace, 'send')
+        start = time.perf_counter()
+        try:
+            response = host.session.get(url, params=self._params(event_time, power, replayed),
+                                        timeout=self.timeout)
+            metrics.HEARTBEAT_LATENCY.observe(time.perf_counter() - start)
+            self._notify(url, response.status_code == 200, str(response.status_code), time.perf_counter() - start)
+            if response.status_code == 200:
+                latency.stamp(trace, 'ack')
+                self.last_heartbeat_time[url] = max(event_time, self.last_heartbeat_time.get(url, 0))
+                metrics.HEARTBEAT_SUCCESSES.inc()
+                metrics.HEARTBEAT_LAST_SUCCESS.set(time.time())
+                print(f"✓ Heartbeat sent at {time.strftime('%H:%M:%S')}"
+                      f"{' (replayed from the spool)' if replayed else ''}")
+                return True
+            metrics.HEARTBEAT_FAILURES.labels(f"http_{response.status_code}").inc()
+            print(f"✗ Heartbeat failed: HTTP {response.status_code}")
+        except requests.RequestException as e:
+            self._notify(url, False, type(e).__name__, time.perf_counter() - start)
+            metrics.HEARTBEAT_FAILURES.labels(type(e).__name__).inc()
+            print(f"✗ Heartbeat error: {e}")
+        return False
+
+    def _notify(self, url, ok, status, elapsed):
+        for listener in self.listeners:
+            listener(url, ok, status, elapsed)
+
+    def _params(self, event_time, power, replayed=False):
+        """Uptime Kuma push query parameters, or None to send the URL unchanged"""
+        params = {}
+        if replayed:
+            params['msg'] = f"Activity at {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(event_time))}"
+        if self.details:
+            params['ping'] = f"{(time.time() - event_time) * 1e3:.0f}"
+            if power is not None:
+                params['msg'] = f"{params.get('msg', 'Activity')} {power:.1f} dBFS"
+        return params or None
+
+    def _spool(self, url, event_time, power):
+        """Keep an undelivered heartbeat for the replayer, if there is a spool"""
+        if self.spool is None:
+            return
+        self.spool.append(url, event_time, power)
+        metrics.HEARTBEAT_SPOOLED.inc()
+        metrics.HEARTBEAT_SPOOL_DEPTH.set(self.spool.depth())
+
+    def _write_overflow(self):
+        """Spool thread: write the heartbeats submit() could not queue"""
+        while True:
+            event = self._overflow.get()
+            if event is None:
+                break
+            self._spool(*event)
+
+    def _replay(self):
+        """Replayer loop: push the newest spooled event of each URL once its host answers"""
+        while not self._stopping.wait(self.replay_interval):
+            for last_id, url, event_time, power in self.spool.batch(self.replay_batch):
+                # A live heartbeat since the outage already marked the monitor up
+                if self.last_heartbeat_time.get(url, 0) < event_time:
+                    with self._lock:
+                        host = self._host(url)
+                    if self._stopping.wait(host.bucket.reserve()):
+                        return
+                    if not self._send(host, url, event_time, power, replayed=True):
+                        continue
+                    metrics.HEARTBEAT_REPLAYED.inc()
+                self.spool.delete(url, last_id)
+            if self.spool.needs_compact():
+                self.spool.compact()
+            metrics.HEARTBEAT_SPOOL_DEPTH.set(self.spool.depth())
+
+    def _backoff(self, attempt):
+        """Full-jitter exponential backoff delay for a retry attempt"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
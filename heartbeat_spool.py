@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Durable spool of heartbeats that could not be delivered
+
+When every retry of a heartbeat fails, the dispatcher appends the event to
+an SQLite database in WAL mode: one INSERT at the end of the rowid B-tree
+and no fsync per commit, so appending costs the same however long the
+outage. A replayer drains the spool in batches once Kuma answers again.
+
+Uptime Kuma's push API has no timestamp, so a replayed push marks the
+monitor up at the time it is delivered; the msg parameter notes when the
+activity really happened. A batch is therefore the newest event of each
+spooled URL, and the older events of a URL are deleted with it.
+
+compact() drops events past max_age or beyond the newest max_rows and
+returns the freed pages to the filesystem, so months of outages cannot
+grow the file without bound. append() never compacts by itself; the
+dispatcher's replayer thread calls compact() once needs_compact() says
+compact_every events have arrived. depth() is kept in memory, so the gauge
+costs no query. The spool can be inspected while the monitor runs:
+
+    python3 heartbeat_spool.py spool.db
+"""
+
+import sqlite3
+import threading
+import time
+from argparse import ArgumentParser
+from datetime import datetime
+
+
+class HeartbeatSpool:
+    """Undelivered heartbeat events in an SQLite WAL database"""
+
+    def __init__(self, path, max_rows=100000, max_age=30 * 86400, compact_every=1000):
+        self.path = path
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.compact_every = compact_every
+        self.appended = 0          # events appended since the last compact()
+
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # auto_vacuum only takes effect on a new database, before the first table
+        self.db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS events ("
+                        "id INTEGER PRIMARY KEY, url TEXT NOT NULL, event_time REAL NOT NULL, power REAL)")
+        self.count = self.db.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+
+    def append(self, url, event_time, power=None):
+        """Record one undelivered heartbeat"""
+        with self._lock:
+            self.db.execute("INSERT INTO events (url, event_time, power) VALUES (?, ?, ?)",
+                            (url, event_time, power))
+            self.appended += 1
+            self.count += 1
+
+    def needs_compact(self):
+        return self.appended >= self.compact_every
+
+    def batch(self, size=100):
+        """The newest event of up to size URLs, oldest first, as (id, url, event_time, power) rows"""
+        with self._lock:
+            return self.db.execute("SELECT id, url, event_time, power FROM events "
+                                   "WHERE id IN (SELECT MAX(id) FROM events GROUP BY url) ORDER BY id LIMIT ?",
+                                   (size,)).fetchall()
+
+    def delete(self, url, last_id):
+        """Remove url's events up to and including last_id, once delivered"""
+        with self._lock:
+            self.count -= self.db.execute("DELETE FROM events WHERE url = ? AND id <= ?", (url, last_id)).rowcount
+
+    def depth(self):
+        """Events in the spool, without a query"""
+        return self.count
+
+    def summary(self):
+        """(url, events, oldest, newest) for every URL with spooled events"""
+        with self._lock:
+            return self.db.execute("SELECT url, COUNT(*), MIN(event_time), MAX(event_time) "
+                                   "FROM events GROUP BY url ORDER BY MIN(event_time)").fetchall()
+
+    def compact(self, now=None):
+        """Drop expired and excess events and give the freed space back"""
+        if now is None:
+            now = time.time()
+        with self._lock:
+            self.count -= self.db.execute("DELETE FROM events WHERE event_time < ?",
+                                          (now - self.max_age,)).rowcount
+            self.count -= self.db.execute("DELETE FROM events WHERE id <= (SELECT MAX(id) FROM events) - ?",
+                                          (self.max_rows,)).rowcount
+            self.db.execute("PRAGMA incremental_vacuum")
+            self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self.appended = 0
+
+    def close(self):
+        with self._lock:
+            self.db.close()
+
+
+def format_time(t):
+    return datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def main():
+    parser = ArgumentParser(description="Show the heartbeats waiting in a spool")
+    parser.add_argument("path", help="Spool database written by the monitor")
+    parser.add_argument("--compact", action="store_true", help="Compact the spool first")
+    options = parser.parse_args()
+
+    spool = HeartbeatSpool(options.path)
+    if options.compact:
+        spool.compact()
+    for url, count, oldest, newest in spool.summary():
+        print(f"{count:6d} events  {format_time(oldest)} .. {format_time(newest)}  {url}")
+    spool.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,351 @@
+"""
+Pluggable IQ sources: live RTL-SDR, SigMF recording and SigMF replay
+
+Recordings are raw cf32_le samples plus a .sigmf-meta JSON file holding the
+frequency, sample rate, gain and start time, so field captures can be replayed
+through the same chain with no SDR attached. Replay memory-maps the data file
+and runs either at the recorded rate or as fast as the CPU allows.
+"""
+
+import json
+import os
+import re
+import time
+from datetime import datetime, timezone
+import numpy as np
+import pmt
+from gnuradio import blocks
+from gnuradio import gr
+import latency
+import metrics
+
+SIGMF_VERSION = "1.0.0"
+SIGMF_DATATYPE = "cf32_le"
+RX_TIME = pmt.intern('rx_time')
+
+# gr-osmosdr's RTL-SDR driver queue when device_args do not set buffers=/buflen=
+RTL_BUFFERS = 15
+RTL_BUFFER_LENGTH = 16 * 32 * 512   # bytes of 8-bit I/Q, two per sample
+# Largest GNU Radio buffer between the live source and its readers, in samples
+SOURCE_OUTPUT_BUFFER = 16384
+# Driver queue while scanning, unless device_args size it: 4 x 32768 samples, 64 ms at 2.048 MS/s
+SCAN_RTL_BUFFERS = "buffers=4,buflen=65536"
+
+
+def sigmf_paths(path):
+    """Return (meta, data) paths for a recording given either file or the base name"""
+    base, ext = os.path.splitext(path)
+    if ext not in ('.sigmf-meta', '.sigmf-data'):
+        base = path
+    return base + '.sigmf-meta', base + '.sigmf-data'
+
+
+def is_recording(spec):
+    """True if a --source value names a SigMF recording rather than a device"""
+    return spec.endswith(('.sigmf-meta', '.sigmf-data')) or os.path.exists(sigmf_paths(spec)[0])
+
+
+def read_sigmf_meta(path):
+    """Load a recording's metadata and check it is a format we can replay"""
+    meta_path, _ = sigmf_paths(path)
+    with open(meta_path) as f:
+        meta = json.load(f)
+    datatype = meta['global'].get('core:datatype')
+    if datatype != SIGMF_DATATYPE:
+        raise ValueError(f"{meta_path}: unsupported datatype {datatype!r}, expected {SIGMF_DATATYPE}")
+    return meta
+
+
+def write_sigmf_meta(path, samp_rate, captures, hw="RTL-SDR via gr-osmosdr", annotations=()):
+    """Write a recording's .sigmf-meta file"""
+    meta = {
+        'global': {
+            'core:datatype': SIGMF_DATATYPE,
+            'core:sample_rate': samp_rate,
+            'core:version': SIGMF_VERSION,
+            'core:recorder': "repeater-uptime",
+            'core:hw': hw,
+        },
+        'captures': list(captures),
+        'annotations': list(annotations),
+    }
+    with open(sigmf_paths(path)[0], 'w') as f:
+        json.dump(meta, f, indent=2)
+
+
+class rtlsdr_source(gr.hier_block2):
+    """
+    Live RTL-SDR through gr-osmosdr, configured like the GRC flowgraph
+
+    buffered_samples bounds how many samples captured before a retune can
+    still reach a reader after it: the driver's queue of USB buffers plus the
+    GNU Radio buffer behind the source.
+    """
+    tunable = True
+
+    def __init__(self, device_args="numchan=1", samp_rate=2048000, center_freq=146.52e6, rf_gain=20):
+        gr.hier_block2.__init__(self,
+            "rtlsdr_source",
+            gr.io_signature(0, 0, 0),
+            gr.io_signature(1, 1, gr.sizeof_gr_complex))
+
+        import osmosdr  # only needed for live capture, not for replay
+
+        self.osmosdr_source_0 = osmosdr.source(
+            args=device_args
+        )
+        self.osmosdr_source_0.set_time_unknown_pps(osmosdr.time_spec_t())
+        self.osmosdr_source_0.set_sample_rate(samp_rate)
+        self.osmosdr_source_0.set_center_freq(center_freq, 0)
+        self.osmosdr_source_0.set_freq_corr(0, 0)
+        self.osmosdr_source_0.set_dc_offset_mode(0, 0)
+        self.osmosdr_source_0.set_iq_balance_mode(0, 0)
+        self.osmosdr_source_0.set_gain_mode(False, 0)
+        self.osmosdr_source_0.set_gain(rf_gain, 0)
+        self.osmosdr_source_0.set_if_gain(20, 0)
+        self.osmosdr_source_0.set_bb_gain(20, 0)
+        self.osmosdr_source_0.set_antenna('', 0)
+        self.osmosdr_source_0.set_bandwidth(0, 0)
+        self.osmosdr_source_0.set_max_output_buffer(SOURCE_OUTPUT_BUFFER)
+
+        buffers = re.search(r'\bbuffers=(\d+)', device_args)
+        buflen = re.search(r'\bbuflen=(\d+)', device_args)
+        self.buffered_samples = ((int(buffers.group(1)) if buffers else RTL_BUFFERS) *
+                                 (int(buflen.group(1)) if buflen else RTL_BUFFER_LENGTH) // 2 + SOURCE_OUTPUT_BUFFER)
+
+        self.connect(self.osmosdr_source_0, self)
+
+    def set_center_freq(self, center_freq):
+        self.osmosdr_source_0.set_center_freq(center_freq, 0)
+
+    def set_gain(self, rf_gain):
+        self.osmosdr_source_0.set_gain(rf_gain, 0)
+
+
+class memmap_source(gr.sync_block):
+    """
+    Streams a memory-mapped cf32 file, tagging the first sample with rx_time/rx_freq
+    """
+    def __init__(self, data_path, center_freq=0.0, start_time=None, repeat=False):
+        gr.sync_block.__init__(self,
+            name="memmap_source",
+            in_sig=[],
+            out_sig=[np.complex64])
+
+        self.samples = np.memmap(data_path, dtype=np.complex64, mode='r')
+        self.center_freq = center_freq
+        self.start_time = start_time
+        self.repeat = repeat
+        self.position = 0
+
+    def work(self, input_items, output_items):
+        out = output_items[0]
+
+        if self.nitems_written(0) == 0:
+            self._tag_start()
+
+        if self.position >= len(self.samples):
+            if not self.repeat or len(self.samples) == 0:
+                return -1  # WORK_DONE
+            self.position = 0
+
+        n = min(len(out), len(self.samples) - self.position)
+        out[:n] = self.samples[self.position:self.position + n]
+        self.position += n
+        return n
+
+    def _tag_start(self):
+        """Mark the first sample with the recording's start time and frequency"""
+        self.add_item_tag(0, 0, pmt.intern('rx_freq'), pmt.from_double(self.center_freq))
+        if self.start_time is not None:
+            seconds = int(self.start_time)
+            self.add_item_tag(0, 0, RX_TIME,
+                              pmt.make_tuple(pmt.from_uint64(seconds), pmt.from_double(self.start_time - seconds)))
+
+
+class sigmf_replay(gr.hier_block2):
+    """
+    Replays a SigMF recording, throttled to its sample rate when realtime is set
+    """
+    tunable = False
+    buffered_samples = 0
+
+    def __init__(self, path, realtime=True, repeat=False):
+        gr.hier_block2.__init__(self,
+            "sigmf_replay",
+            gr.io_signature(0, 0, 0),
+            gr.io_signature(1, 1, gr.sizeof_gr_complex))
+
+        meta = read_sigmf_meta(path)
+        capture = meta['captures'][0]
+        self.samp_rate = meta['global']['core:sample_rate']
+        self.center_freq = capture.get('core:frequency', 0.0)
+        start_time = None
+        if 'core:datetime' in capture:
+            start_time = datetime.fromisoformat(capture['core:datetime'].replace('Z', '+00:00')).timestamp()
+
+        self.source = memmap_source(sigmf_paths(path)[1], self.center_freq, start_time, repeat)
+        if realtime:
+            self.throttle = blocks.throttle(gr.sizeof_gr_complex, self.samp_rate, True)
+            self.connect(self.source, self.throttle, self)
+        else:
+            self.connect(self.source, self)
+
+        print(f"Replaying {sigmf_paths(path)[1]}: {len(self.source.samples) / self.samp_rate:.1f} s "
+              f"at {self.center_freq / 1e6:.4f} MHz, {'real time' if realtime else 'as fast as possible'}")
+
+    def set_center_freq(self, center_freq):
+        """A recording cannot be retuned"""
+        pass
+
+    def set_gain(self, rf_gain):
+        """A recording's gain is fixed"""
+        pass
+
+
+class overrun_probe(gr.sync_block):
+    """
+    Sink that compares samples received with wall-clock time to spot overruns
+
+    rtl-sdr reports dropped USB transfers only as an "O" on stderr, so lost
+    samples are inferred instead: when delivery falls more than max_lag
+    seconds behind real time, the shortfall is counted as an overrun and the
+    reference clock restarts.
+    """
+    def __init__(self, samp_rate, max_lag=0.25):
+        gr.sync_block.__init__(self,
+            name="overrun_probe",
+            in_sig=[np.complex64],
+            out_sig=[])
+
+        self.samp_rate = samp_rate
+        self.max_lag = max_lag
+        self.start = None
+        self.received = 0
+
+    def work(self, input_items, output_items):
+        n = len(input_items[0])
+        now = time.monotonic()
+        if self.start is None:
+            self.start = now
+        else:
+            self.received += n
+            missing = (now - self.start) * self.samp_rate - self.received
+            if missing > self.max_lag * self.samp_rate:
+                metrics.SOURCE_OVERRUNS.inc()
+                metrics.SOURCE_DROPPED.inc(int(missing))
+                self.start = now
+                self.received = 0
+        return n
+
+
+class first_sample_probe(gr.sync_block):
+    """Sink that records when the first buffer arrives, for a StartupProfile"""
+    def __init__(self, profile):
+        gr.sync_block.__init__(self,
+            name="first_sample_probe",
+            in_sig=[np.complex64],
+            out_sig=[])
+
+        self.profile = profile
+
+    def work(self, input_items, output_items):
+        if self.profile.first_sample is None:
+            self.profile.first_sample = time.perf_counter()
+        return len(input_items[0])
+
+
+class stream_clock_probe(gr.sync_block):
+    """
+    Sink that keeps a latency.StreamClock in step with the source
+
+    The source's rx_time tags set the clock exactly; without them (rtl-sdr
+    has none, and a replayed recording's are its capture time) each buffer's
+    arrival anchors it to the host clock.
+    """
+    def __init__(self, samp_rate, clock=latency.CLOCK, rx_time=True):
+        gr.sync_block.__init__(self,
+            name="stream_clock_probe",
+            in_sig=[np.complex64],
+            out_sig=[])
+
+        self.samp_rate = samp_rate
+        self.clock = clock
+        self.rx_time = rx_time
+
+    def work(self, input_items, output_items):
+        n = len(input_items[0])
+        if self.rx_time:
+            for tag in self.get_tags_in_window(0, 0, n):
+                if pmt.eq(tag.key, RX_TIME):
+                    seconds = pmt.to_uint64(pmt.tuple_ref(tag.value, 0)) + pmt.to_double(pmt.tuple_ref(tag.value, 1))
+                    self.clock.set_rx_time(tag.offset / self.samp_rate, seconds)
+        self.clock.anchor((self.nitems_read(0) + n) / self.samp_rate, time.time())
+        return n
+
+
+class sigmf_recorder(gr.hier_block2):
+    """
+    Records raw IQ to <path>.sigmf-data with a matching <path>.sigmf-meta
+    """
+    def __init__(self, path, samp_rate, center_freq, rf_gain=None, hw="RTL-SDR via gr-osmosdr"):
+        gr.hier_block2.__init__(self,
+            "sigmf_recorder",
+            gr.io_signature(1, 1, gr.sizeof_gr_complex),
+            gr.io_signature(0, 0, 0))
+
+        self.path = path
+        self.samp_rate = samp_rate
+        self.hw = hw
+        self.data_path = sigmf_paths(path)[1]
+        self.captures = []
+        self.add_capture(center_freq, rf_gain, sample_start=0)
+
+        self.file_sink = blocks.file_sink(gr.sizeof_gr_complex, self.data_path, False)
+        self.file_sink.set_unbuffered(False)
+        self.connect(self, self.file_sink)
+
+    def add_capture(self, center_freq, rf_gain=None, sample_start=None):
+        """Start a new capture segment, e.g. after a retune or gain change"""
+        if sample_start is None:
+            sample_start = os.path.getsize(self.data_path) // gr.sizeof_gr_complex
+        capture = {
+            'core:sample_start': sample_start,
+            'core:frequency': center_freq,
+            'core:datetime': datetime.fromtimestamp(time.time(), timezone.utc).isoformat().replace('+00:00', 'Z'),
+        }
+        if rf_gain is not None:
+            capture['repeater_uptime:rf_gain'] = rf_gain
+        self.captures.append(capture)
+        write_sigmf_meta(self.path, self.samp_rate, self.captures, self.hw)
+
+
+def scan_device_args(device_args):
+    """device_args with a short driver queue, so less is discarded after every retune"""
+    if re.search(r'\bbuf(fers|len)=', device_args):
+        return device_args
+    tokens = device_args.split()
+    for i, token in enumerate(tokens):
+        if token.startswith('rtl='):
+            tokens[i] = f"{token},{SCAN_RTL_BUFFERS}"
+            return ' '.join(tokens)
+    return ' '.join(tokens + [f"rtl=0,{SCAN_RTL_BUFFERS}"])
+
+
+def make_source(spec, config, realtime=True):
+    """
+    Build the IQ source named by spec: 'rtlsdr' or a SigMF recording path
+
+    When replaying, config takes the recording's sample rate and centre
+    frequency, keeping each channel on its absolute frequency.
+    """
+    if spec in (None, '', 'rtlsdr'):
+        device_args = scan_device_args(config.device_args) if config.scan else config.device_args
+        return rtlsdr_source(device_args, config.samp_rate, config.center_freq, config.rf_gain)
+    if not is_recording(spec):
+        raise ValueError(f"Unknown source {spec!r}: expected 'rtlsdr' or a SigMF recording")
+
+    source = sigmf_replay(spec, realtime)
+    config.samp_rate = source.samp_rate
+    config.retune(source.center_freq)
+    return source
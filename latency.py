@@ -0,0 +1,94 @@
+"""
+End-to-end latency tracing, from the RF edge of a key-up to Kuma's acknowledgement
+
+Each key-up a detector confirms starts a trace, a dict of Unix timestamps
+that travels with its heartbeat through the event bus and the dispatcher:
+
+    rx       the edge sample, from the stream clock (missing until it is anchored)
+    detect   the detector's work() confirmed the key-up
+    enqueue  the heartbeat entered the dispatcher's queue for its host
+    send     the first HTTP request for it started
+    ack      Uptime Kuma answered 200
+
+Every stamp observes repeater_latency_seconds{stage=...} with the time since
+the stamp before it, and the acknowledgement also observes stage="total"
+from rx. 'detect' includes the detector's minimum key-up duration as well as
+the buffering between the SDR and the detector; 'send' includes the
+dispatcher's rate limit, and 'ack' its retries. Heartbeats that are coalesced
+into another or replayed from the spool are not traced.
+"""
+
+import time
+import metrics
+
+
+class StreamClock:
+    """
+    Unix time of stream time (seconds of samples since the flowgraph started)
+
+    Set exactly from the source's rx_time tags when it has them. rtl-sdr has
+    none, so its buffers are anchored to the host clock instead: a buffer can
+    only arrive after its last sample was taken, so the earliest-arriving one
+    is the best estimate. Estimates are kept per window, letting the clock
+    follow the dongle's crystal drift and recover after an overrun.
+    """
+
+    def __init__(self, window=10.0):
+        self.window = window
+        self.epoch = None        # Unix time of stream time 0
+        self.tagged = False      # epoch comes from an rx_time tag
+        self._best = None
+        self._previous = None
+        self._window_start = None
+
+    def set_rx_time(self, stream_time, unix_time):
+        """The source's own timestamp for a sample; overrides host anchors from then on"""
+        self.epoch = unix_time - stream_time
+        self.tagged = True
+
+    def anchor(self, stream_time, now):
+        """A buffer ending at stream_time arrived at Unix time now"""
+        if self.tagged:
+            return
+        candidate = now - stream_time
+        if self._window_start is None or now - self._window_start >= self.window:
+            self._previous, self._best = self._best, candidate
+            self._window_start = now
+        else:
+            self._best = min(self._best, candidate)
+        self.epoch = self._best if self._previous is None else min(self._best, self._previous)
+
+    def unix(self, stream_time):
+        """Unix time of a stream time, or None before the clock is anchored"""
+        if self.epoch is None:
+            return None
+        return self.epoch + stream_time
+
+
+CLOCK = StreamClock()
+
+# Each stamp is timed from the one before it
+PREVIOUS = {'detect': 'rx', 'enqueue': 'detect', 'send': 'enqueue', 'ack': 'send'}
+
+
+def start_trace(edge_time, clock=CLOCK):
+    """A new trace for a key-up whose edge was at stream time edge_time, stamped 'detect'"""
+    trace = {}
+    rx = clock.unix(edge_time)
+    if rx is not None:
+        trace['rx'] = rx
+    stamp(trace, 'detect')
+    return trace
+
+
+def stamp(trace, stage):
+    """Record that a traced heartbeat reached stage; a stage is only stamped once"""
+    if trace is None or stage in trace:
+        return
+    now = time.time()
+    trace[stage] = now
+    previous = trace.get(PREVIOUS[stage])
+    if previous is not None:
+        metrics.LATENCY.labels(stage).observe(max(0.0, now - previous))
+    if stage == 'ack' and 'rx' in trace:
+        metrics.LATENCY.labels('total').observe(max(0.0, now - trace['rx']))
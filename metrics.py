@@ -0,0 +1,337 @@
+"""
+Prometheus-style metrics for the monitor, served over plain HTTP
+
+Blocks update counters and gauges once per work() call (per buffer, never
+per sample). Some series are written from several threads (the heartbeat
+counters from every dispatcher worker and the spool replayer), and a float
++= is not atomic, so each series has its own lock. It is uncontended almost
+always and taken once per buffer, which costs far less than the work() call
+around it. Values that are already tracked elsewhere (per-block item counts,
+buffer fullness, time since the last heartbeat) are read only when /metrics
+is scraped.
+"""
+
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Series:
+    """One labelled value of a counter or gauge"""
+
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+
+class _HistogramSeries:
+    """One labelled histogram: cumulative bucket counts, sum and count"""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[bucket] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        """(counts, sum, count), consistent with each other"""
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+
+class Metric:
+    """
+    A named family of series, one per combination of label values
+
+    Look a series up once with labels() and keep it; inc()/set()/observe()
+    on the metric itself use the series with no labels.
+    """
+
+    def __init__(self, kind, name, help, labelnames=(), buckets=None):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) if buckets else None
+        self.function = None
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        key = tuple(str(value) for value in values)
+        series = self._series.get(key)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(
+                    key, _HistogramSeries(self.buckets) if self.buckets else _Series())
+        return series
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def set_function(self, function):
+        """Compute this (unlabelled) gauge at scrape time instead of storing it"""
+        self.function = function
+
+    def remove(self, *values):
+        """Drop one series, e.g. for a channel that no longer exists"""
+        with self._lock:
+            self._series.pop(tuple(str(value) for value in values), None)
+
+    def snapshot(self):
+        """Plain-data copy of every series, as {label values: value}, for another process"""
+        if self.function is not None:
+            value = self.function()
+            return {} if value is None else {(): value}
+        if self.buckets:
+            return {key: series.snapshot() for key, series in list(self._series.items())}
+        return {key: series.value for key, series in list(self._series.items())}
+
+    def render(self, remote=()):
+        """
+        Exposition lines for this metric, followed by the series of any
+        snapshots in remote, given as (label name, label value, series)
+        """
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._series_lines(self.labelnames, self.snapshot()))
+        for labelname, labelvalue, series in remote:
+            key_prefix = (labelvalue,)
+            lines.extend(self._series_lines((labelname,) + self.labelnames,
+                                            {key_prefix + tuple(key): value for key, value in series.items()}))
+        return lines
+
+    def _series_lines(self, labelnames, series):
+        lines = []
+        for key, value in series.items():
+            labels = ','.join(f'{name}="{_escape(label)}"' for name, label in zip(labelnames, key))
+            if self.buckets:
+                counts, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    le = '+Inf' if bound == float('inf') else repr(float(bound))
+                    bucket_labels = _join(labels, 'le="' + le + '"')
+                    lines.append(f"{self.name}_bucket{{{bucket_labels}}} {cumulative}")
+                lines.append(f"{self.name}_sum{_braces(labels)} {total}")
+                lines.append(f"{self.name}_count{_braces(labels)} {count}")
+            else:
+                lines.append(f"{self.name}{_braces(labels)} {value}")
+        return lines
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _join(*parts):
+    return ','.join(part for part in parts if part)
+
+
+def _braces(labels):
+    return f"{{{labels}}}" if labels else ""
+
+
+class MetricsRegistry:
+    """
+    All metrics of one process, plus flowgraph blocks read at scrape time
+
+    Snapshots from other processes (see supervisor.py) can be attached with
+    set_remote(); they are rendered with an extra label naming their source.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.blocks = {}
+        self.remote = {}
+        self._lock = threading.Lock()
+
+    def _add(self, kind, name, help, labelnames=(), buckets=None):
+        with self._lock:
+            if name not in self.metrics:
+                self.metrics[name] = Metric(kind, name, help, labelnames, buckets)
+            return self.metrics[name]
+
+    def counter(self, name, help, labelnames=()):
+        return self._add('counter', name, help, labelnames)
+
+    def gauge(self, name, help, labelnames=()):
+        return self._add('gauge', name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)):
+        return self._add('histogram', name, help, labelnames, buckets)
+
+    def watch_block(self, name, block):
+        """Report a basic block's item count and buffer fullness at each scrape"""
+        self.blocks[name] = block
+
+    def snapshot(self):
+        """Every series of every metric as plain data that can be pickled"""
+        self._read_blocks()
+        return {name: metric.snapshot() for name, metric in list(self.metrics.items())}
+
+    def set_remote(self, labelname, labelvalue, snapshot):
+        """Export another process's snapshot under labelname=labelvalue, replacing its last one"""
+        self.remote[(labelname, labelvalue)] = snapshot
+
+    def remove_remote(self, labelname, labelvalue):
+        self.remote.pop((labelname, labelvalue), None)
+
+    def render(self):
+        self._read_blocks()
+        remote = list(self.remote.items())
+        lines = []
+        for name, metric in list(self.metrics.items()):
+            lines.extend(metric.render([(labelname, labelvalue, snapshot[name])
+                                        for (labelname, labelvalue), snapshot in remote if snapshot.get(name)]))
+        return '\n'.join(lines) + '\n'
+
+    def _read_blocks(self):
+        """Copy the scheduler's own per-block counters into the block metrics"""
+        for name, block in list(self.blocks.items()):
+            try:
+                items = block.nitems_read(0) if block.input_signature().max_streams() else block.nitems_written(0)
+            except (AttributeError, RuntimeError, IndexError):
+                continue
+            BLOCK_ITEMS.labels(name).set(items)
+            # Only meaningful with [PerfCounters] on = True in the GNU Radio config
+            try:
+                if block.input_signature().max_streams():
+                    BLOCK_INPUT_FULL.labels(name).set(block.pc_input_buffers_full(0))
+                if block.output_signature().max_streams():
+                    BLOCK_OUTPUT_FULL.labels(name).set(block.pc_output_buffers_full(0))
+            except (AttributeError, RuntimeError, IndexError):
+                pass
+
+
+REGISTRY = MetricsRegistry()
+
+BLOCK_ITEMS = REGISTRY.gauge(
+    'repeater_block_items', "Items processed by a flowgraph block since start", ['block'])
+BLOCK_INPUT_FULL = REGISTRY.gauge(
+    'repeater_block_input_buffer_fullness', "Average input buffer fullness (0-1, needs perf counters)", ['block'])
+BLOCK_OUTPUT_FULL = REGISTRY.gauge(
+    'repeater_block_output_buffer_fullness', "Average output buffer fullness (0-1, needs perf counters)", ['block'])
+SOURCE_OVERRUNS = REGISTRY.counter(
+    'repeater_source_overruns_total', "Times the SDR fell behind real time and samples were lost")
+SOURCE_DROPPED = REGISTRY.counter(
+    'repeater_source_dropped_samples_total', "Estimated samples lost to source overruns")
+
+CHANNEL_POWER = REGISTRY.gauge(
+    'repeater_channel_power_dbfs', "Smoothed channel power at the end of the last buffer", ['channel'])
+CHANNEL_CARRIER = REGISTRY.gauge(
+    'repeater_channel_carrier', "1 while a key-up is in progress", ['channel'])
+CHANNEL_THRESHOLD = REGISTRY.gauge(
+    'repeater_channel_threshold_dbfs', "Current attack threshold", ['channel'])
+NOISE_FLOOR = REGISTRY.gauge(
+    'repeater_noise_floor_dbfs', "Estimated noise floor of channels with an adaptive threshold", ['channel'])
+ACTIVITY_TRANSITIONS = REGISTRY.counter(
+    'repeater_activity_transitions_total', "Key-up onsets and offsets", ['channel', 'kind'])
+CHANNEL_AIRTIME = REGISTRY.counter(
+    'repeater_airtime_seconds_total', "Seconds with a confirmed carrier", ['channel'])
+CHANNEL_DUTY_CYCLE = REGISTRY.gauge(
+    'repeater_duty_cycle', "Fraction of the last hour or day with a confirmed carrier", ['channel', 'window'])
+TONE_REJECTED = REGISTRY.counter(
+    'repeater_ctcss_rejected_total', "Key-ups long enough to verify that ended without the required CTCSS tone",
+    ['channel'])
+TONE_UNVERIFIED = REGISTRY.counter(
+    'repeater_ctcss_unverified_total', "Key-ups shorter than the CTCSS window, ended without a heartbeat",
+    ['channel'])
+SCAN_REVISIT = REGISTRY.gauge(
+    'repeater_scan_revisit_seconds', "Interval between the last two dwells on a scanned channel", ['channel'])
+SCAN_REVISIT_MAX = REGISTRY.gauge(
+    'repeater_scan_revisit_max_seconds', "Longest interval between dwells on a scanned channel", ['channel'])
+
+HEARTBEAT_ATTEMPTS = REGISTRY.counter(
+    'repeater_heartbeat_attempts_total', "Heartbeat HTTP requests sent, including retries")
+HEARTBEAT_SUCCESSES = REGISTRY.counter(
+    'repeater_heartbeat_successes_total', "Heartbeats accepted with HTTP 200")
+HEARTBEAT_FAILURES = REGISTRY.counter(
+    'repeater_heartbeat_failures_total', "Heartbeat requests that failed or returned an error", ['reason'])
+HEARTBEAT_COALESCED = REGISTRY.counter(
+    'repeater_heartbeat_coalesced_total', "Heartbeats merged into one already queued or inside the cooldown")
+HEARTBEAT_SPOOLED = REGISTRY.counter(
+    'repeater_heartbeat_spooled_total', "Undelivered heartbeats written to the spool")
+HEARTBEAT_REPLAYED = REGISTRY.counter(
+    'repeater_heartbeat_replayed_total', "Spooled heartbeats delivered by the replayer")
+HEARTBEAT_SPOOL_DEPTH = REGISTRY.gauge(
+    'repeater_heartbeat_spool_events', "Undelivered heartbeat events waiting in the spool")
+HEARTBEAT_DROPPED = REGISTRY.counter(
+    'repeater_heartbeat_dropped_total', "Heartbeats dropped because the dispatcher queue was full")
+HEARTBEAT_LATENCY = REGISTRY.histogram(
+    'repeater_heartbeat_latency_seconds', "Heartbeat HTTP request duration")
+LATENCY = REGISTRY.histogram(
+    'repeater_latency_seconds', "Time a traced key-up spent reaching each stage from the one before it "
+    "(rx, detect, enqueue, send, ack), and from the RF edge to Kuma's acknowledgement (total)", ['stage'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+HEARTBEAT_LAST_SUCCESS = REGISTRY.gauge(
+    'repeater_heartbeat_last_success_timestamp_seconds', "Unix time of the last accepted heartbeat")
+HEARTBEAT_SINCE_SUCCESS = REGISTRY.gauge(
+    'repeater_heartbeat_seconds_since_success', "Seconds since the last accepted heartbeat")
+HEARTBEAT_SINCE_SUCCESS.set_function(
+    lambda: time.time() - HEARTBEAT_LAST_SUCCESS.labels().value if HEARTBEAT_LAST_SUCCESS.labels().value else None)
+
+SINK_EVENTS = REGISTRY.counter(
+    'repeater_sink_events_total', "Events delivered by an event bus sink", ['sink'])
+SINK_DROPPED = REGISTRY.counter(
+    'repeater_sink_dropped_total', "Events discarded because a sink's queue was full", ['sink'])
+SINK_ERRORS = REGISTRY.counter(
+    'repeater_sink_errors_total', "Events a sink failed to deliver", ['sink'])
+SINK_QUEUE = REGISTRY.gauge(
+    'repeater_sink_queue_events', "Events waiting in a sink's queue", ['sink'])
+
+WORKER_RESTARTS = REGISTRY.counter(
+    'repeater_worker_restarts_total', "Times a supervised worker process exited and was restarted", ['worker'])
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes are too frequent to print
+
+
+def start_http_server(port, addr='127.0.0.1', registry=REGISTRY):
+    """Serve /metrics from a daemon thread; returns the server (call shutdown() to stop)"""
+    handler = type('MetricsHandler', (_MetricsHandler,), {'registry': registry})
+    server = ThreadingHTTPServer((addr, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"Metrics available at http://{addr}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,105 @@
+"""
+Single-channel detection chain shared by the headless daemon and benchmarks
+
+channel filter/decimate -> [squelch gate] -> |x|^2 power -> IIR smoothing -> repeater_uptime_monitor,
+with an optional WFM demodulator that is either gated by the detector or always on.
+"""
+
+from gnuradio import analog
+from gnuradio import blocks
+from gnuradio import filter
+from gnuradio import gr
+import repeater_monitor_epy_block_0 as epy_block_0  # embedded python block
+from front_end import channel_filter
+
+DEMOD_MODES = ('off', 'gated', 'always')
+
+
+class single_channel_monitor(gr.hier_block2):
+    """
+    Complex capture in, carrier detection and heartbeats out
+
+    demod='gated' runs the WFM receiver only while the detector reports a
+    carrier, through a blocks.copy driven by the detector's 'activity' port;
+    demod='always' is the original ungated path, kept for comparison.
+    front_end selects the channel filter implementation (see front_end.py),
+    and completed key-ups are recorded in event_log when one is given.
+
+    ctcss (a tone in Hz, or 'any') makes each heartbeat wait for the PL tone
+    to be verified on the demodulated audio; it turns demod 'off' into 'gated'.
+    A shared dispatcher, if given, replaces the detector's own.
+
+    squelch (dB below the release threshold) puts a squelch_gate after the
+    channel filter, so the power path only sees keepalive bursts while the
+    channel is quiet; the demodulator still taps the ungated filter output.
+    """
+    def __init__(self, samp_rate=2048000, activity_threshold=-30, cooldown_time=60,
+                 uptime_kuma_url="http://localhost:3001/api/push/example", demod='off', audio_decimation=4,
+                 front_end='multistage', event_log=None, noise_margin=None, ctcss=None, dispatcher=None,
+                 squelch=None):
+        gr.hier_block2.__init__(self,
+            "single_channel_monitor",
+            gr.io_signature(1, 1, gr.sizeof_gr_complex),
+            gr.io_signature(0, 0, 0))
+
+        if demod not in DEMOD_MODES:
+            raise ValueError(f"demod must be one of {', '.join(DEMOD_MODES)}")
+        if ctcss is not None and demod == 'off':
+            demod = 'gated'
+
+        self.low_pass_filter_0 = channel_filter(front_end, samp_rate)
+        self.blocks_complex_to_mag_squared_0 = blocks.complex_to_mag_squared(1)
+        self.single_pole_iir_filter_xx_0 = filter.single_pole_iir_filter_ff(0.01, 1)
+        self.epy_block_0 = epy_block_0.repeater_uptime_monitor(
+            activity_threshold=activity_threshold,
+            cooldown_time=cooldown_time,
+            uptime_kuma_url=uptime_kuma_url,
+            samp_rate=samp_rate//8,
+            noise_margin=noise_margin)
+        self.epy_block_0.event_log = event_log
+        if dispatcher is not None:
+            self.epy_block_0.dispatcher.stop()
+            self.epy_block_0.dispatcher = dispatcher
+            self.epy_block_0.owns_dispatcher = False
+
+        self.connect((self, 0), (self.low_pass_filter_0, 0))
+        if squelch is None:
+            self.connect((self.low_pass_filter_0, 0), (self.blocks_complex_to_mag_squared_0, 0))
+        else:
+            from squelch import squelch_gate
+            self.squelch_0 = squelch_gate(self.epy_block_0.detector, samp_rate//8, squelch)
+            self.connect((self.low_pass_filter_0, 0), (self.squelch_0, 0))
+            self.connect((self.squelch_0, 0), (self.blocks_complex_to_mag_squared_0, 0))
+        self.connect((self.blocks_complex_to_mag_squared_0, 0), (self.single_pole_iir_filter_xx_0, 0))
+        self.connect((self.single_pole_iir_filter_xx_0, 0), (self.epy_block_0, 0))
+
+        if demod == 'off':
+            return
+
+        self.analog_wfm_rcv_0 = analog.wfm_rcv(
+            quad_rate=(samp_rate//8),
+            audio_decimation=audio_decimation,
+        )
+        self.blocks_null_sink_0 = blocks.null_sink(gr.sizeof_float*1)
+        self.connect((self.analog_wfm_rcv_0, 0), (self.blocks_null_sink_0, 0))
+
+        if ctcss is not None:
+            from ctcss import ctcss_verifier
+            self.ctcss_0 = ctcss_verifier((samp_rate//8) / audio_decimation, ctcss)
+            self.connect((self.analog_wfm_rcv_0, 0), (self.ctcss_0, 0))
+            self.msg_connect((self.epy_block_0, 'activity'), (self.ctcss_0, 'activity'))
+            self.msg_connect((self.ctcss_0, 'tone'), (self.epy_block_0, 'tone'))
+            self.epy_block_0.require_tone = True
+            self.epy_block_0.tone_window = self.ctcss_0.detector.window
+
+        if demod == 'always':
+            self.connect((self.low_pass_filter_0, 0), (self.analog_wfm_rcv_0, 0))
+            return
+
+        # Closed gate drops samples without copying them, leaving the
+        # demodulator idle until the detector reports a carrier
+        self.blocks_copy_0 = blocks.copy(gr.sizeof_gr_complex*1)
+        self.blocks_copy_0.set_enabled(False)
+        self.connect((self.low_pass_filter_0, 0), (self.blocks_copy_0, 0))
+        self.connect((self.blocks_copy_0, 0), (self.analog_wfm_rcv_0, 0))
+        self.msg_connect((self.epy_block_0, 'activity'), (self.blocks_copy_0, 'en'))
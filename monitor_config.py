@@ -0,0 +1,209 @@
+"""
+Monitor configuration loaded from a JSON file
+
+A configuration describes one SDR capture and either a single repeater at the
+centre frequency or a list of repeater channels monitored inside the capture.
+See monitor_config.example.json for the format.
+"""
+
+import json
+
+
+class ChannelConfig:
+    """
+    One monitored repeater inside the capture bandwidth
+
+    With a margin (dB), the threshold tracks the channel's noise floor plus
+    the margin, and threshold is only used until the floor is measured.
+    """
+
+    def __init__(self, name, offset, bandwidth=12500, threshold=-30, release_threshold=None,
+                 min_duration=0.1, cooldown=60, url="http://localhost:3001/api/push/example", margin=None):
+        self.name = name
+        self.offset = float(offset)
+        self.bandwidth = float(bandwidth)
+        self.threshold = threshold
+        self.release_threshold = release_threshold
+        self.min_duration = min_duration
+        self.cooldown = cooldown
+        self.url = url
+        self.margin = margin
+
+    @classmethod
+    def from_dict(cls, data, center_freq):
+        """Build a channel from its config entry; 'freq' is converted to an offset"""
+        data = dict(data)
+        if 'freq' in data:
+            data['offset'] = float(data.pop('freq')) - center_freq
+        if 'offset' not in data:
+            raise ValueError(f"Channel {data.get('name', '?')!r} needs an 'offset' or 'freq'")
+        data.setdefault('name', f"{(center_freq + data['offset']) / 1e6:.4f} MHz")
+        return cls(**data)
+
+    def to_dict(self, center_freq):
+        """The channel as a config entry, with its absolute 'freq' rather than the offset"""
+        data = dict(vars(self))
+        data['freq'] = center_freq + data.pop('offset')
+        return data
+
+    def validate(self):
+        """Check the detector settings, so a reload never stages a detector that cannot be built"""
+        if self.release_threshold is not None and self.release_threshold > self.threshold:
+            raise ValueError(f"Channel {self.name!r} release_threshold {self.release_threshold} dBFS "
+                             f"is above its threshold {self.threshold} dBFS")
+        if self.bandwidth <= 0:
+            raise ValueError(f"Channel {self.name!r} bandwidth must be positive")
+        if self.min_duration < 0 or self.cooldown < 0:
+            raise ValueError(f"Channel {self.name!r} min_duration and cooldown must not be negative")
+        if self.margin is not None and self.margin < 0:
+            raise ValueError(f"Channel {self.name!r} margin must not be negative")
+
+
+class ScanChannel(ChannelConfig):
+    """
+    One repeater visited by the scanner, at its own frequency
+
+    The SDR is retuned to freq for each dwell (seconds); a channel with
+    priority p is visited p times per scan cycle.
+    """
+
+    def __init__(self, name, freq, dwell=1.0, priority=1, **kwargs):
+        ChannelConfig.__init__(self, name, 0, **kwargs)
+        self.freq = float(freq)
+        self.dwell = dwell
+        self.priority = int(priority)
+
+    @classmethod
+    def from_dict(cls, data):
+        data = dict(data)
+        if 'freq' not in data:
+            raise ValueError(f"Scan channel {data.get('name', '?')!r} needs a 'freq'")
+        data.setdefault('name', f"{float(data['freq']) / 1e6:.4f} MHz")
+        return cls(**data)
+
+    def to_dict(self, center_freq=None):
+        data = dict(vars(self))
+        del data['offset']
+        return data
+
+    def validate(self):
+        ChannelConfig.validate(self)
+        if self.dwell <= self.min_duration:
+            raise ValueError(f"Scan channel {self.name!r} dwell of {self.dwell} s "
+                             f"is not longer than its {self.min_duration} s minimum key-up")
+        if self.priority < 1:
+            raise ValueError(f"Scan channel {self.name!r} priority must be at least 1")
+
+
+class MonitorConfig:
+    """
+    SDR capture settings and the channels monitored within it
+
+    With no channel list the monitor runs the single-channel chain tuned to
+    center_freq, using the top-level threshold, cooldown and URL. With a scan
+    list instead, the SDR is retuned from channel to channel.
+    """
+
+    def __init__(self, center_freq=146.52e6, samp_rate=2048000, rf_gain=20, device_args="numchan=1",
+                 activity_threshold=-30, cooldown_time=60, uptime_kuma_url="http://localhost:3001/api/push/example",
+                 demod='off', front_end='multistage', fft_size=1024, fft_average=8, metrics_port=None,
+                 control_port=None, squelch=None,
+                 event_log=None, event_log_capacity=65536, airtime=None, waterfall=None, waterfall_resolution=1.0,
+                 waterfall_days=1, waterfall_bins=256, noise_margin=None, noise_floor_file=None,
+                 ctcss=None, scan_settle=0.15, heartbeat_concurrency=2, heartbeat_rate=1.0, heartbeat_burst=5,
+                 heartbeat_details=False, heartbeat_spool=None, sinks=None, telemetry=None, telemetry_interval=0.25,
+                 channels=None, scan=None):
+        self.center_freq = float(center_freq)
+        self.samp_rate = samp_rate
+        self.rf_gain = rf_gain
+        self.device_args = device_args
+        self.activity_threshold = activity_threshold
+        self.cooldown_time = cooldown_time
+        self.uptime_kuma_url = uptime_kuma_url
+        self.demod = demod
+        self.front_end = front_end
+        self.fft_size = fft_size
+        self.fft_average = fft_average
+        self.metrics_port = metrics_port
+        self.control_port = control_port
+        self.squelch = squelch
+        self.event_log = event_log
+        self.event_log_capacity = event_log_capacity
+        self.airtime = airtime
+        self.waterfall = waterfall
+        self.waterfall_resolution = waterfall_resolution
+        self.waterfall_days = waterfall_days
+        self.waterfall_bins = waterfall_bins
+        self.noise_margin = noise_margin
+        self.noise_floor_file = noise_floor_file
+        self.ctcss = ctcss
+        self.scan_settle = scan_settle
+        self.heartbeat_concurrency = heartbeat_concurrency
+        self.heartbeat_rate = heartbeat_rate
+        self.heartbeat_burst = heartbeat_burst
+        self.heartbeat_details = heartbeat_details
+        self.heartbeat_spool = heartbeat_spool
+        self.sinks = sinks or []
+        self.telemetry = telemetry
+        self.telemetry_interval = telemetry_interval
+        self.channels = channels or []
+        self.scan = scan or []
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build and validate a configuration from parsed JSON"""
+        data = dict(data)
+        entries = data.pop('channels', [])
+        scan_entries = data.pop('scan', [])
+        config = cls(**data)
+        config.channels = [ChannelConfig.from_dict({'margin': config.noise_margin, **entry}, config.center_freq)
+                           for entry in entries]
+        config.scan = [ScanChannel.from_dict({'margin': config.noise_margin, **entry}) for entry in scan_entries]
+        config.validate()
+        return config
+
+    def to_dict(self):
+        """JSON-ready data that from_dict() turns back into the same configuration"""
+        data = dict(vars(self))
+        data['channels'] = [channel.to_dict(self.center_freq) for channel in self.channels]
+        data['scan'] = [channel.to_dict() for channel in self.scan]
+        return data
+
+    def retune(self, center_freq):
+        """Move the capture centre, keeping every channel on its absolute frequency"""
+        for channel in self.channels:
+            channel.offset -= center_freq - self.center_freq
+        self.center_freq = float(center_freq)
+
+    def validate(self):
+        """Check that every channel lies inside the captured bandwidth and every dwell can detect a key-up"""
+        if self.ctcss is not None and self.channels:
+            raise ValueError("CTCSS verification needs the single-channel chain; remove 'ctcss' or 'channels'")
+        if self.scan and (self.channels or self.ctcss is not None):
+            raise ValueError("Scan mode cannot be combined with 'channels' or 'ctcss'")
+        if self.squelch is not None and (self.channels or self.scan):
+            raise ValueError("The squelch gate needs the single-channel chain; remove 'squelch'")
+        if self.waterfall and self.scan:
+            raise ValueError("The waterfall needs a fixed centre frequency; remove 'waterfall' or 'scan'")
+        if self.waterfall_resolution <= 0 or self.waterfall_days <= 0:
+            raise ValueError("'waterfall_resolution' and 'waterfall_days' must be positive")
+        if self.cooldown_time < 0:
+            raise ValueError("'cooldown_time' must not be negative")
+        if self.noise_margin is not None and self.noise_margin < 0:
+            raise ValueError("'noise_margin' must not be negative")
+        for channel in self.channels + self.scan:
+            channel.validate()
+        names = [channel.name for channel in self.channels + self.scan]
+        if len(set(names)) != len(names):
+            raise ValueError("Channel names must be unique; metrics and airtime are kept per name")
+        nyquist = self.samp_rate / 2
+        for channel in self.channels:
+            if abs(channel.offset) + channel.bandwidth / 2 > nyquist:
+                raise ValueError(f"Channel {channel.name!r} at offset {channel.offset:.0f} Hz "
+                                 f"is outside the {self.samp_rate / 1e6:.3f} MS/s capture")
+
+
+def load_config(path):
+    """Load a MonitorConfig from a JSON file"""
+    with open(path) as f:
+        return MonitorConfig.from_dict(json.load(f))
@@ -0,0 +1,128 @@
+"""
+Adaptive detection thresholds that follow each channel's noise floor
+
+The floor is a low quantile of channel power, estimated from a histogram of
+power in fixed-width dB bins with exponential forgetting. Memory is constant,
+the update is one bincount per buffer, and a time constant of minutes rides
+out temperature and site noise drift while a key-up barely moves it. The attack
+threshold is the floor plus a margin; the release threshold keeps its
+configured distance below the attack threshold.
+
+Histogram state can be saved and restored, so a restarted monitor detects
+from the first buffer instead of waiting through a warm-up.
+"""
+
+import json
+import os
+import numpy as np
+from activity_detector import db_to_linear
+
+FLOOR_DB = -120.0    # lowest tracked power level
+CEILING_DB = 0.0     # full scale
+BIN_DB = 0.25        # histogram resolution
+
+
+class AdaptiveThreshold:
+    """
+    Noise-floor quantile tracker driving an ActivityDetector's thresholds
+
+    rate is the power sample rate; one sample in every decimation is used,
+    since smoothed power is highly correlated from sample to sample. Until
+    warmup seconds of samples have been seen the detector keeps its
+    configured static thresholds.
+    """
+
+    def __init__(self, detector, margin, rate, quantile=0.2, time_constant=300.0, warmup=30.0,
+                 decimation=1, step=0.5):
+        self.detector = detector
+        self.margin = margin
+        self.quantile = quantile
+        self.decimation = max(1, int(decimation))
+        self.step = step
+        self.hysteresis = detector.attack_threshold - detector.release_threshold
+
+        self.rate = rate / self.decimation
+        self.time_constant = time_constant
+        self.warmup_weight = warmup * self.rate
+        self.edges = db_to_linear(np.arange(FLOOR_DB, CEILING_DB + BIN_DB, BIN_DB))
+        self.histogram = np.zeros(len(self.edges) + 1)
+        self.phase = 0
+        self.floor = None
+
+    def update(self, power):
+        """Fold one buffer of linear power into the estimate and retune the detector"""
+        samples = power[self.phase::self.decimation]
+        self.phase = (self.phase - len(power)) % self.decimation
+        if len(samples) == 0:
+            return
+
+        # Bin in the linear domain against precomputed edges: no log10 per sample
+        self.histogram *= np.exp(-len(samples) / (self.time_constant * self.rate))
+        self.histogram += np.bincount(np.searchsorted(self.edges, samples), minlength=len(self.histogram))
+        self._estimate()
+
+    def skip(self, n):
+        """
+        Account for n power samples that were never seen (dropped by a squelch
+        gate), assuming they looked like the ones already counted
+        """
+        total = self.histogram.sum()
+        if total <= 0:
+            return
+        n /= self.decimation
+        self.histogram *= np.exp(-n / (self.time_constant * self.rate)) + n / total
+        self._estimate()
+
+    def _estimate(self):
+        """Read the quantile off the histogram once it holds enough samples"""
+        total = self.histogram.sum()
+        if total < self.warmup_weight:
+            return
+        index = int(np.searchsorted(np.cumsum(self.histogram), self.quantile * total))
+        self.floor = FLOOR_DB + (min(max(index, 1), len(self.edges)) - 0.5) * BIN_DB
+
+        threshold = self.floor + self.margin
+        if abs(threshold - self.detector.attack_threshold) >= self.step:
+            self.detector.set_thresholds(threshold, threshold - self.hysteresis)
+
+    def set_margin(self, margin):
+        self.margin = margin
+        if self.floor is not None:
+            self.detector.set_thresholds(self.floor + margin, self.floor + margin - self.hysteresis)
+
+    def reset(self):
+        """Forget the estimate, e.g. after a gain or frequency change"""
+        self.histogram[:] = 0
+        self.floor = None
+
+    def state(self):
+        """JSON-serializable estimator state"""
+        return {'histogram': self.histogram.tolist(), 'floor': self.floor}
+
+    def restore(self, state):
+        """Resume from a saved state, retuning the detector at once"""
+        histogram = np.asarray(state.get('histogram', ()), dtype=np.float64)
+        if histogram.shape != self.histogram.shape:
+            return  # saved with a different bin layout
+        if histogram.sum() <= 0:
+            return
+        # Count a restored estimate as warm however long ago it was saved
+        self.histogram = histogram * max(1.0, self.warmup_weight / histogram.sum())
+        self._estimate()
+
+
+def load_noise_floors(path):
+    """Saved estimator states by channel name; empty if there is no file yet"""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_noise_floors(path, trackers):
+    """Atomically write the state of a {channel name: AdaptiveThreshold} dict"""
+    states = {str(name): tracker.state() for name, tracker in trackers.items()}
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(states, f)
+    os.replace(tmp_path, path)
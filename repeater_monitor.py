@@ -12,7 +12,6 @@
 from PyQt5 import Qt
 from gnuradio import qtgui
 from PyQt5 import QtCore
-from gnuradio import analog
 from gnuradio import blocks
 from gnuradio import eng_notation
 from gnuradio import filter
@@ -30,10 +29,25 @@ import repeater_monitor_epy_block_0 as epy_block_0  # embedded python block
 import sip
 
 
+def snipfcn_snippet_0(self):
+    import display_gate
+    display_gate.pause_when_hidden(self)
+
+
+def snipfcn_snippet_1(self):
+    from iq_source import stream_clock_probe
+    self.stream_clock_probe_0 = stream_clock_probe(self.samp_rate, rx_time=False)
+    self.connect((self.osmosdr_source_0, 0), (self.stream_clock_probe_0, 0))
+
+
+def snippets_main_after_init(tb):
+    snipfcn_snippet_0(tb)
+    snipfcn_snippet_1(tb)
+
 
 class repeater_monitor(gr.top_block, Qt.QWidget):
 
-    def __init__(self):
+    def __init__(self, display_update_time=0.10):
         gr.top_block.__init__(self, "FM Repeater Uptime Monitor", catch_exceptions=True)
         Qt.QWidget.__init__(self)
         self.setWindowTitle("FM Repeater Uptime Monitor")
@@ -63,12 +77,19 @@ class repeater_monitor(gr.top_block, Qt.QWidget):
         except BaseException as exc:
             print(f"Qt GUI: Could not restore geometry: {str(exc)}", file=sys.stderr)
 
+        ##################################################
+        # Parameters
+        ##################################################
+        self.display_update_time = display_update_time
+
         ##################################################
         # Variables
         ##################################################
         self.uptime_kuma_url = uptime_kuma_url = 'http://localhost:3001/api/push/example'
         self.samp_rate = samp_rate = 2048000
         self.rf_gain = rf_gain = 20
+        self.display_enabled = display_enabled = True
+        self.display_decimation = display_decimation = max(1, int(samp_rate // 8 * display_update_time / 1024))
         self.cooldown_time = cooldown_time = 60
         self.center_freq = center_freq = 146.52e6
         self.audio_decimation = audio_decimation = 4
@@ -129,7 +150,7 @@ class repeater_monitor(gr.top_block, Qt.QWidget):
             1,
             None # parent
         )
-        self.qtgui_number_sink_0.set_update_time(0.10)
+        self.qtgui_number_sink_0.set_update_time(display_update_time)
         self.qtgui_number_sink_0.set_title('Signal Strength')
 
         labels = ['Power Level (dB)', '', '', '', '',
@@ -168,7 +189,7 @@ class repeater_monitor(gr.top_block, Qt.QWidget):
             1,
             None # parent
         )
-        self.qtgui_freq_sink_x_0.set_update_time(0.10)
+        self.qtgui_freq_sink_x_0.set_update_time(display_update_time)
         self.qtgui_freq_sink_x_0.set_y_axis((-140), 10)
         self.qtgui_freq_sink_x_0.set_y_label('Relative Gain', 'dB')
         self.qtgui_freq_sink_x_0.set_trigger_mode(qtgui.TRIG_MODE_FREE, 0.0, 0, "")
@@ -229,32 +250,38 @@ class repeater_monitor(gr.top_block, Qt.QWidget):
                 25000,
                 window.WIN_HAMMING,
                 6.76))
-        self.epy_block_0 = epy_block_0.repeater_uptime_monitor(activity_threshold=self.activity_threshold, cooldown_time=self.cooldown_time, uptime_kuma_url=self.uptime_kuma_url)
+        self.epy_block_0 = epy_block_0.repeater_uptime_monitor(activity_threshold=self.activity_threshold, cooldown_time=self.cooldown_time, uptime_kuma_url=self.uptime_kuma_url, release_threshold=None, min_duration=0.1, samp_rate=samp_rate//8, noise_margin=None)
+        self.blocks_vector_to_stream_0 = blocks.vector_to_stream(gr.sizeof_gr_complex*1, 1024)
+        self.blocks_stream_to_vector_0 = blocks.stream_to_vector(gr.sizeof_gr_complex*1, 1024)
         self.blocks_probe_signal_x_0 = blocks.probe_signal_f()
         self.blocks_probe_signal_x_0.set_block_alias("power_probe")
-        self.blocks_null_sink_0 = blocks.null_sink(gr.sizeof_float*1)
-        self.blocks_multiply_xx_0 = blocks.multiply_vff(1)
-        self.blocks_complex_to_mag_0 = blocks.complex_to_mag(1)
-        self.analog_wfm_rcv_0 = analog.wfm_rcv(
-        	quad_rate=(samp_rate//8),
-        	audio_decimation=audio_decimation,
-        )
+        self.blocks_keep_one_in_n_1 = blocks.keep_one_in_n(gr.sizeof_float*1, (1024 * display_decimation))
+        self.blocks_keep_one_in_n_0 = blocks.keep_one_in_n(gr.sizeof_gr_complex*1024, display_decimation)
+        self.blocks_copy_2 = blocks.copy(gr.sizeof_float*1)
+        self.blocks_copy_2.set_block_alias("display_gate_power")
+        self.blocks_copy_2.set_enabled(display_enabled)
+        self.blocks_copy_1 = blocks.copy(gr.sizeof_gr_complex*1)
+        self.blocks_copy_1.set_block_alias("display_gate_spectrum")
+        self.blocks_copy_1.set_enabled(display_enabled)
+        self.blocks_complex_to_mag_squared_0 = blocks.complex_to_mag_squared(1)
 
 
         ##################################################
         # Connections
         ##################################################
-        self.connect((self.analog_wfm_rcv_0, 0), (self.blocks_null_sink_0, 0))
-        self.connect((self.blocks_complex_to_mag_0, 0), (self.blocks_multiply_xx_0, 1))
-        self.connect((self.blocks_complex_to_mag_0, 0), (self.blocks_multiply_xx_0, 0))
-        self.connect((self.blocks_multiply_xx_0, 0), (self.single_pole_iir_filter_xx_0, 0))
-        self.connect((self.low_pass_filter_0, 0), (self.analog_wfm_rcv_0, 0))
-        self.connect((self.low_pass_filter_0, 0), (self.blocks_complex_to_mag_0, 0))
-        self.connect((self.low_pass_filter_0, 0), (self.qtgui_freq_sink_x_0, 0))
+        self.connect((self.blocks_complex_to_mag_squared_0, 0), (self.single_pole_iir_filter_xx_0, 0))
+        self.connect((self.blocks_copy_1, 0), (self.blocks_stream_to_vector_0, 0))
+        self.connect((self.blocks_copy_2, 0), (self.blocks_keep_one_in_n_1, 0))
+        self.connect((self.blocks_keep_one_in_n_0, 0), (self.blocks_vector_to_stream_0, 0))
+        self.connect((self.blocks_keep_one_in_n_1, 0), (self.qtgui_number_sink_0, 0))
+        self.connect((self.blocks_stream_to_vector_0, 0), (self.blocks_keep_one_in_n_0, 0))
+        self.connect((self.blocks_vector_to_stream_0, 0), (self.qtgui_freq_sink_x_0, 0))
+        self.connect((self.low_pass_filter_0, 0), (self.blocks_complex_to_mag_squared_0, 0))
+        self.connect((self.low_pass_filter_0, 0), (self.blocks_copy_1, 0))
         self.connect((self.osmosdr_source_0, 0), (self.low_pass_filter_0, 0))
+        self.connect((self.single_pole_iir_filter_xx_0, 0), (self.blocks_copy_2, 0))
         self.connect((self.single_pole_iir_filter_xx_0, 0), (self.blocks_probe_signal_x_0, 0))
         self.connect((self.single_pole_iir_filter_xx_0, 0), (self.epy_block_0, 0))
-        self.connect((self.single_pole_iir_filter_xx_0, 0), (self.qtgui_number_sink_0, 0))
 
 
     def closeEvent(self, event):
@@ -265,18 +292,29 @@ class repeater_monitor(gr.top_block, Qt.QWidget):
 
         event.accept()
 
+    def get_display_update_time(self):
+        return self.display_update_time
+
+    def set_display_update_time(self, display_update_time):
+        self.display_update_time = display_update_time
+        self.set_display_decimation(max(1, int(self.samp_rate // 8 * self.display_update_time / 1024)))
+        self.qtgui_freq_sink_x_0.set_update_time(self.display_update_time)
+        self.qtgui_number_sink_0.set_update_time(self.display_update_time)
+
     def get_uptime_kuma_url(self):
         return self.uptime_kuma_url
 
     def set_uptime_kuma_url(self, uptime_kuma_url):
         self.uptime_kuma_url = uptime_kuma_url
         Qt.QMetaObject.invokeMethod(self._uptime_kuma_url_line_edit, "setText", Qt.Q_ARG("QString", str(self.uptime_kuma_url)))
+        self.epy_block_0.uptime_kuma_url = self.uptime_kuma_url
 
     def get_samp_rate(self):
         return self.samp_rate
 
     def set_samp_rate(self, samp_rate):
         self.samp_rate = samp_rate
+        self.set_display_decimation(max(1, int(self.samp_rate // 8 * self.display_update_time / 1024)))
         self.low_pass_filter_0.set_taps(firdes.low_pass(1, self.samp_rate, 75000, 25000, window.WIN_HAMMING, 6.76))
         self.osmosdr_source_0.set_sample_rate(self.samp_rate)
         self.qtgui_freq_sink_x_0.set_frequency_range(self.center_freq, self.samp_rate)
@@ -288,11 +326,28 @@ class repeater_monitor(gr.top_block, Qt.QWidget):
         self.rf_gain = rf_gain
         self.osmosdr_source_0.set_gain(self.rf_gain, 0)
 
+    def get_display_enabled(self):
+        return self.display_enabled
+
+    def set_display_enabled(self, display_enabled):
+        self.display_enabled = display_enabled
+        self.blocks_copy_1.set_enabled(self.display_enabled)
+        self.blocks_copy_2.set_enabled(self.display_enabled)
+
+    def get_display_decimation(self):
+        return self.display_decimation
+
+    def set_display_decimation(self, display_decimation):
+        self.display_decimation = display_decimation
+        self.blocks_keep_one_in_n_0.set_n(self.display_decimation)
+        self.blocks_keep_one_in_n_1.set_n((1024 * self.display_decimation))
+
     def get_cooldown_time(self):
         return self.cooldown_time
 
     def set_cooldown_time(self, cooldown_time):
         self.cooldown_time = cooldown_time
+        self.epy_block_0.cooldown_time = self.cooldown_time
 
     def get_center_freq(self):
         return self.center_freq
@@ -314,16 +369,27 @@ class repeater_monitor(gr.top_block, Qt.QWidget):
 
     def set_activity_threshold(self, activity_threshold):
         self.activity_threshold = activity_threshold
+        self.epy_block_0.activity_threshold = self.activity_threshold
+
 
 
 
+def argument_parser():
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--display-update-time", dest="display_update_time", type=eng_float, default=eng_notation.num_to_str(float(0.10)),
+        help="Set Display update time (s) [default=%(default)r]")
+    return parser
+
 
 def main(top_block_cls=repeater_monitor, options=None):
+    if options is None:
+        options = argument_parser().parse_args()
 
     qapp = Qt.QApplication(sys.argv)
 
-    tb = top_block_cls()
-
+    tb = top_block_cls(display_update_time=options.display_update_time)
+    snippets_main_after_init(tb)
     tb.start()
 
     tb.show()
@@ -1,80 +1,215 @@
-import numpy as np
-import time
 import threading
-import requests
+import numpy as np
+import pmt
 from gnuradio import gr
+from activity_detector import ActivityDetector, linear_to_db
+from heartbeat_dispatcher import HeartbeatDispatcher
+import latency
+from noise_floor import AdaptiveThreshold
+import metrics
+
+# Tag a squelch gate (squelch.py) puts after each run of dropped samples
+SQUELCH_GAP = pmt.intern('squelch_gap')
 
 class repeater_uptime_monitor(gr.sync_block):
     """
     Activity detection and Uptime Kuma heartbeat block
+
+    Publishes True/False on the 'activity' message port at each carrier edge,
+    which can drive a blocks.copy 'en' port to gate downstream demodulation.
+    With noise_margin set, the threshold follows the channel's noise floor
+    plus that many dB once the floor estimate has warmed up.
+
+    With require_tone set, the heartbeat for a key-up is held back until a
+    message arrives on the 'tone' port (from ctcss.ctcss_verifier), so
+    intermod and birdies without the repeater's PL tone are ignored. A key-up
+    shorter than tone_window (the verifier's analysis window) can never be
+    verified; it is counted as unverified rather than rejected.
+
+    Behind a squelch gate, samples dropped as quiet are skipped as the
+    'squelch_gap' tags say, keeping sample indices in stream time.
     """
-    def __init__(self, activity_threshold=-30, cooldown_time=60, uptime_kuma_url="http://localhost:3001/api/push/example"):
+    def __init__(self, activity_threshold=-30, cooldown_time=60, uptime_kuma_url="http://localhost:3001/api/push/example",
+                 release_threshold=None, min_duration=0.1, samp_rate=256000, noise_margin=None):
         gr.sync_block.__init__(self,
             name="repeater_uptime_monitor",
             in_sig=[np.float32],
             out_sig=[])
 
-        self.activity_threshold = activity_threshold
+        self._activity_threshold = activity_threshold
         self.cooldown_time = cooldown_time
         self.uptime_kuma_url = uptime_kuma_url
-        self.last_heartbeat_time = 0
+        self.release_threshold = release_threshold
+        self.samp_rate = samp_rate
+        self._noise_margin = noise_margin
         self.activity_detected = False
 
-        # Start monitoring thread
-        self.monitoring = True
-        self.monitor_thread = threading.Thread(target=self._monitor_loop, daemon=True)
-        self.monitor_thread.start()
+        # Callables notified of every edge as (channel, kind, edge_time, detected_time),
+        # with times in seconds of stream since the flowgraph started
+        self.listeners = []
+
+        # Optional activity_log.ActivityLog receiving every completed key-up
+        self.event_log = None
+
+        self.require_tone = False
+        self.tone_window = 1.0  # seconds of audio the verifier needs, set by monitor_chain
+        # Key-up state shared with _handle_tone, which runs on the message thread
+        self._tone_lock = threading.Lock()
+        self.heartbeat_pending = False
+        self.onset = 0     # sample index of the current key-up's onset
+        self.trace = None  # latency trace of the current key-up
+        self.message_port_register_out(pmt.intern('activity'))
+        self.message_port_register_in(pmt.intern('tone'))
+        self.set_msg_handler(pmt.intern('tone'), self._handle_tone)
+
+        # Metric series are looked up once; work() only updates them per buffer
+        self.power_metric = metrics.CHANNEL_POWER.labels(0)
+        self.carrier_metric = metrics.CHANNEL_CARRIER.labels(0)
+        self.threshold_metric = metrics.CHANNEL_THRESHOLD.labels(0)
+        self.floor_metric = metrics.NOISE_FLOOR.labels(0)
+        self.transition_metrics = {kind: metrics.ACTIVITY_TRANSITIONS.labels(0, kind) for kind in ('onset', 'offset')}
+        self.rejected_metric = metrics.TONE_REJECTED.labels(0)
+        self.unverified_metric = metrics.TONE_UNVERIFIED.labels(0)
+
+        # Whole-buffer hysteresis detector on linear power
+        self.detector = ActivityDetector(activity_threshold, release_threshold,
+                                         min_samples=min_duration * samp_rate)
+        self.noise_floor = None
+        if noise_margin is not None:
+            # Smoothed power barely changes between samples; 4k samples/s is plenty
+            self.noise_floor = AdaptiveThreshold(self.detector, noise_margin, samp_rate, decimation=64)
+
+        # Heartbeats are delivered off the scheduler thread
+        self.dispatcher = HeartbeatDispatcher(cooldown_time=cooldown_time)
+        self.owns_dispatcher = True
 
         print(f"Uptime Kuma Monitor initialized:")
-        print(f"  Threshold: {activity_threshold} dBFS")
+        print(f"  Threshold: {activity_threshold} dBFS (release {self.detector.release_threshold} dBFS)")
+        if noise_margin is not None:
+            print(f"  Adaptive: {noise_margin} dB above the noise floor once it is measured")
+        print(f"  Minimum key-up: {min_duration} seconds")
         print(f"  Cooldown: {cooldown_time} seconds")
         print(f"  URL: {uptime_kuma_url}")
 
     def work(self, input_items, output_items):
-        # Get power level and convert to dB
-        power_level = input_items[0][-1] if len(input_items[0]) > 0 else 0
-
-        if power_level > 1e-10:
-            power_db = 10 * np.log10(power_level)
-        else:
-            power_db = -100
-
-        # Check for activity
-        if power_db > self.activity_threshold:
-            if not self.activity_detected:
-                self.activity_detected = True
-                self._send_heartbeat()
-                print(f"Activity detected! Power: {power_db:.1f} dBFS")
-        else:
-            self.activity_detected = False
+        power = input_items[0]
+        start = self.nitems_read(0)
 
-        return len(input_items[0])
+        # Read once: set_noise_margin() may replace it from another thread
+        noise_floor = self.noise_floor
+        position = 0
+        for tag in self.get_tags_in_window(0, 0, len(power)):
+            if pmt.eq(tag.key, SQUELCH_GAP):
+                index = tag.offset - start
+                self._process(power[position:index], noise_floor)
+                gap = pmt.to_long(tag.value)
+                if noise_floor is not None:
+                    noise_floor.skip(gap)
+                self._handle_events(self.detector.skip(gap))
+                position = index
+        self._process(power[position:], noise_floor)
 
-    def _monitor_loop(self):
-        """Background monitoring loop"""
-        while self.monitoring:
-            try:
-                time.sleep(1)  # Check every second
-            except:
-                break
+        if len(power):
+            self.power_metric.set(linear_to_db(power[-1]))
+            self.carrier_metric.set(int(self.detector.carrier))
+            self.threshold_metric.set(self.detector.attack_threshold)
+            if noise_floor is not None and noise_floor.floor is not None:
+                self.floor_metric.set(noise_floor.floor)
 
-    def _send_heartbeat(self):
-        """Send heartbeat to Uptime Kuma"""
-        current_time = time.time()
+        return len(power)
 
-        # Check cooldown
-        if current_time - self.last_heartbeat_time < self.cooldown_time:
+    def _process(self, power, noise_floor):
+        """Run a stretch of contiguous power samples through the detector"""
+        if len(power) == 0:
             return
+        if noise_floor is not None:
+            noise_floor.update(power)
+        self._handle_events(self.detector.process(power))
 
-        try:
-            response = requests.get(self.uptime_kuma_url, timeout=5)
-            if response.status_code == 200:
-                self.last_heartbeat_time = current_time
-                print(f"✓ Heartbeat sent at {time.strftime('%H:%M:%S')}")
+    def _handle_events(self, events):
+        for kind, index in events:
+            if kind == 'onset':
+                trace = latency.start_trace(index / self.samp_rate)
+                with self._tone_lock:
+                    self.activity_detected = True
+                    self.onset = index
+                    self.trace = trace
+                    self.heartbeat_pending = self.require_tone
+                if not self.require_tone:
+                    self._send_heartbeat(trace)
+                print(f"Activity detected at sample {index}! Power: {linear_to_db(self.detector.peak_power):.1f} dBFS")
             else:
-                print(f"✗ Heartbeat failed: HTTP {response.status_code}")
-        except Exception as e:
-            print(f"✗ Heartbeat error: {e}")
+                with self._tone_lock:
+                    self.activity_detected = False
+                    pending, self.heartbeat_pending = self.heartbeat_pending, False
+                if pending and (index - self.onset) / self.samp_rate < self.tone_window:
+                    self.unverified_metric.inc()
+                    print("Key-up too short to verify its CTCSS tone; no heartbeat sent")
+                elif pending:
+                    self.rejected_metric.inc()
+                    print("Key-up ended without the expected CTCSS tone; no heartbeat sent")
+            self.transition_metrics[kind].inc()
+            self.message_port_pub(pmt.intern('activity'), pmt.from_bool(self.activity_detected))
+            for listener in self.listeners:
+                listener(0, kind, index / self.samp_rate, self.detector.nitems / self.samp_rate)
+        if self.event_log is not None and self.detector.runs:
+            self.event_log.record_runs(0, self.detector, self.samp_rate)
+
+    # GRC callbacks assign parameters as attributes (epy_block_0.activity_threshold = ...);
+    # these two must also reach the detector, so they are properties over the setters
+    @property
+    def activity_threshold(self):
+        return self._activity_threshold
+
+    @activity_threshold.setter
+    def activity_threshold(self, activity_threshold):
+        self.set_activity_threshold(activity_threshold)
+
+    @property
+    def noise_margin(self):
+        return self._noise_margin
+
+    @noise_margin.setter
+    def noise_margin(self, noise_margin):
+        self.set_noise_margin(noise_margin)
+
+    def set_activity_threshold(self, activity_threshold):
+        self._activity_threshold = activity_threshold
+        self.detector.set_thresholds(activity_threshold, self.release_threshold)
+
+    def set_noise_margin(self, noise_margin):
+        self._noise_margin = noise_margin
+        if noise_margin is None:
+            self.noise_floor = None
+            self.detector.set_thresholds(self.activity_threshold, self.release_threshold)
+        elif self.noise_floor is None:
+            self.noise_floor = AdaptiveThreshold(self.detector, noise_margin, self.samp_rate, decimation=64)
+        else:
+            self.noise_floor.set_margin(noise_margin)
+
+    def set_cooldown_time(self, cooldown_time):
+        self.cooldown_time = cooldown_time
+
+    def set_uptime_kuma_url(self, uptime_kuma_url):
+        self.uptime_kuma_url = uptime_kuma_url
+
+    def _handle_tone(self, msg):
+        """The CTCSS verifier heard the expected tone during this key-up"""
+        with self._tone_lock:
+            if not (self.heartbeat_pending and self.activity_detected):
+                return
+            self.heartbeat_pending = False
+            trace = self.trace
+        print(f"CTCSS {pmt.to_double(msg):.1f} Hz verified")
+        self._send_heartbeat(trace)
+
+    def _send_heartbeat(self, trace):
+        """Queue a heartbeat for Uptime Kuma; never blocks the scheduler"""
+        self.dispatcher.submit(self.uptime_kuma_url, self.cooldown_time, linear_to_db(self.detector.peak_power),
+                               trace)
 
     def stop(self):
-        self.monitoring = False
+        # A shared dispatcher (e.g. the headless event bus) is stopped by its owner
+        if self.owns_dispatcher:
+            self.dispatcher.stop()
+        return True
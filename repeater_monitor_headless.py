@@ -0,0 +1,530 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# SPDX-License-Identifier: GPL-3.0
+#
+# FM Repeater Uptime Monitor - headless daemon
+#
+# Runs the same source, filter and detector chain as repeater_monitor.py
+# without importing Qt, for displayless hosts and systemd. With a channel
+# list in the config, every listed repeater in the capture is monitored
+# through the FFT channelizer instead; with a scan list, the dongle is
+# retuned from repeater to repeater.
+#
+# Start-up is ordered for a fast cold start: modules only some modes or
+# options need (channelizer, scanner, CTCSS, squelch, event log, airtime,
+# waterfall, telemetry, extra sinks and the control API) are imported when
+# their setting is on, the device is opened and the flowgraph started before
+# anything non-essential, and --profile-startup reports where the time went.
+#
+
+from startup_profile import StartupProfile  # first, so it can time the imports below
+from gnuradio import gr
+import sys
+import signal
+import threading
+import time
+from argparse import ArgumentParser
+from gnuradio.eng_arg import eng_float
+from activity_detector import ActivityDetector, linear_to_db
+from front_end import FRONT_ENDS
+from event_bus import EventBus, KumaSink
+from heartbeat_dispatcher import HeartbeatDispatcher
+from iq_source import first_sample_probe, make_source, overrun_probe, sigmf_recorder, stream_clock_probe
+import metrics
+from monitor_chain import DEMOD_MODES, single_channel_monitor
+from monitor_config import MonitorConfig, load_config
+from noise_floor import load_noise_floors, save_noise_floors
+
+NOISE_FLOOR_SAVE_INTERVAL = 60  # seconds
+
+STARTUP = StartupProfile()
+STARTUP.mark('imports')
+
+
+class repeater_monitor_headless(gr.top_block):
+
+    def __init__(self, config, options, dispatcher=None, profile=None):
+        gr.top_block.__init__(self, "FM Repeater Uptime Monitor (headless)", catch_exceptions=True)
+
+        self.config = config
+        self.profile = profile
+        self._reload_lock = threading.Lock()   # SIGHUP and the control API may reload at once
+        if dispatcher is None:
+            # One client, with one keep-alive pool and rate limit per Kuma host, for every channel
+            dispatcher = HeartbeatDispatcher(
+                concurrency=config.heartbeat_concurrency,
+                rate=config.heartbeat_rate,
+                burst=config.heartbeat_burst,
+                details=config.heartbeat_details,
+                spool=config.heartbeat_spool)
+        # Detectors publish to the bus, which fans out to Kuma and any configured sinks
+        self.bus = EventBus()
+        self.bus.add_sink(KumaSink(dispatcher))
+        if config.sinks:
+            from event_bus import add_sinks
+            add_sinks(self.bus, config.sinks)
+        self.telemetry = None
+        if config.telemetry:
+            from telemetry import TelemetrySink
+            self.telemetry = self.bus.add_sink(TelemetrySink(config.telemetry), max_queue=64)
+            if hasattr(dispatcher, 'listeners'):
+                dispatcher.listeners.append(self.publish_result)
+        self.event_log = None
+        if config.event_log:
+            from activity_log import ActivityLog
+            self.event_log = ActivityLog(config.event_log_capacity, config.event_log)
+        self.airtime = None
+        if config.airtime:
+            from airtime import AirtimeStats
+            self.airtime = AirtimeStats(self.channel_names(config), config.airtime)
+        self.waterfall = None
+        if config.waterfall:
+            from waterfall import Waterfall
+            rows = int(config.waterfall_days * 86400 / config.waterfall_resolution)
+            self.waterfall = Waterfall(config.waterfall, config.waterfall_bins, rows)
+
+        self._mark('setup')
+
+        ##################################################
+        # Blocks
+        ##################################################
+        self.source_0 = make_source(options.source, config, realtime=not options.fast)
+        self._mark('open device')
+        if profile is not None and profile.enabled:
+            self.first_sample_probe_0 = first_sample_probe(profile)
+            self.connect((self.source_0, 0), (self.first_sample_probe_0, 0))
+        self.recorder_0 = None
+        if options.record:
+            self.recorder_0 = sigmf_recorder(options.record, config.samp_rate, config.center_freq, config.rf_gain)
+            self.connect((self.source_0, 0), (self.recorder_0, 0))
+        if self.source_0.tunable:
+            self.overrun_probe_0 = overrun_probe(config.samp_rate)
+            self.connect((self.source_0, 0), (self.overrun_probe_0, 0))
+            metrics.REGISTRY.watch_block('source', self.overrun_probe_0)
+        else:
+            metrics.REGISTRY.watch_block('source', self.source_0.source)
+        if not options.fast:
+            # Stream time to Unix time for latency traces; a recording's rx_time is when it was captured
+            self.stream_clock_probe_0 = stream_clock_probe(config.samp_rate, rx_time=self.source_0.tunable)
+            self.connect((self.source_0, 0), (self.stream_clock_probe_0, 0))
+        self.waterfall_0 = None
+        if self.waterfall is not None:
+            from waterfall_recorder import spectrum_recorder
+            self.waterfall_0 = spectrum_recorder(self.waterfall, config.samp_rate, config.center_freq,
+                                                 config.waterfall_resolution)
+            self.connect((self.source_0, 0), (self.waterfall_0, 0))
+            metrics.REGISTRY.watch_block('waterfall', self.waterfall_0.sink)
+
+        if config.scan:
+            if not self.source_0.tunable or self.recorder_0 is not None:
+                raise ValueError("Scan mode needs a live SDR and cannot record; the capture hops between frequencies")
+            from scanner import scan_chain
+            self.scanner_0 = scan_chain(
+                config.scan,
+                config.samp_rate,
+                config.scan_settle,
+                self.source_0.set_center_freq,
+                config.front_end,
+                self.bus,
+                event_log=self.event_log,
+                upstream=self.source_0.buffered_samples)
+            self._mark('design filters')
+            self.connect((self.source_0, 0), (self.scanner_0, 0))
+            self.publish_activity(self.scanner_0.monitor)
+            if self.airtime is not None:
+                monitor = self.scanner_0.monitor
+                monitor.listeners.append(self.airtime.listener(lambda i: monitor.channels[i].name))
+            for name in ('scheduler', 'mag_squared', 'smoothing', 'monitor'):
+                metrics.REGISTRY.watch_block(name, getattr(self.scanner_0, name))
+            self.restore_noise_floors()
+            return
+
+        if config.channels:
+            from channelizer import fft_channelizer
+            self.channelizer_0 = fft_channelizer(
+                config.channels,
+                config.samp_rate,
+                config.fft_size,
+                config.fft_average,
+                self.bus,
+                event_log=self.event_log)
+            self._mark('design filters')
+            self.connect((self.source_0, 0), (self.channelizer_0, 0))
+            self.publish_activity(self.channelizer_0.monitor)
+            if self.airtime is not None:
+                monitor = self.channelizer_0.monitor
+                monitor.listeners.append(self.airtime.listener(lambda i: monitor.channels[i].name))
+            for name in ('stream_to_vector', 'fft', 'mag_squared', 'average', 'monitor'):
+                metrics.REGISTRY.watch_block(name, getattr(self.channelizer_0, name))
+            self.restore_noise_floors()
+            return
+
+        self.monitor_0 = single_channel_monitor(
+            config.samp_rate,
+            config.activity_threshold,
+            config.cooldown_time,
+            config.uptime_kuma_url,
+            config.demod,
+            front_end=config.front_end,
+            event_log=self.event_log,
+            noise_margin=config.noise_margin,
+            ctcss=config.ctcss,
+            dispatcher=self.bus,
+            squelch=config.squelch)
+        self._mark('design filters')
+
+        ##################################################
+        # Connections
+        ##################################################
+        self.connect((self.source_0, 0), (self.monitor_0, 0))
+        if config.sinks or config.telemetry:
+            detector = self.monitor_0.epy_block_0.detector
+            self.monitor_0.epy_block_0.listeners.append(self.bus.listener(
+                lambda i: f"{self.config.center_freq / 1e6:.4f} MHz",
+                lambda i: linear_to_db(detector.peak_power)))
+        if self.airtime is not None:
+            self.monitor_0.epy_block_0.listeners.append(self.airtime.listener())
+
+        filters = self.monitor_0.low_pass_filter_0
+        if hasattr(filters, 'first_stage'):
+            metrics.REGISTRY.watch_block('filter_stage_1', filters.first_stage)
+            metrics.REGISTRY.watch_block('filter_stage_2', filters.second_stage)
+        else:
+            metrics.REGISTRY.watch_block('filter', filters)
+        metrics.REGISTRY.watch_block('mag_squared', self.monitor_0.blocks_complex_to_mag_squared_0)
+        metrics.REGISTRY.watch_block('smoothing', self.monitor_0.single_pole_iir_filter_xx_0)
+        metrics.REGISTRY.watch_block('detector', self.monitor_0.epy_block_0)
+        self.restore_noise_floors()
+
+    def _mark(self, name):
+        if self.profile is not None:
+            self.profile.mark(name)
+
+    @staticmethod
+    def channel_names(config):
+        """Metric labels of the monitored channels, in detector order"""
+        if config.scan or config.channels:
+            return [channel.name for channel in config.scan or config.channels]
+        return [0]
+
+    def publish_activity(self, monitor):
+        """Publish a multi-channel monitor's key-ups on the bus, if any sink wants them"""
+        if self.config.sinks or self.config.telemetry:
+            monitor.listeners.append(self.bus.listener(
+                lambda i: monitor.channels[i].name,
+                lambda i: linear_to_db(monitor.detectors[i].peak_power)))
+
+    def publish_result(self, url, ok, status, latency):
+        """Dispatcher listener sending each heartbeat's outcome to telemetry subscribers"""
+        self.telemetry.put({'type': 'result', 'url': url, 'ok': ok, 'status': status,
+                            'latency': round(latency, 3), 'time': time.time()})
+
+    def publish_power(self, stopping):
+        """Send every channel's power and carrier state to telemetry subscribers until stopping is set"""
+        from telemetry import power_event
+        while not stopping.wait(self.config.telemetry_interval):
+            names = None
+            if not (self.config.channels or self.config.scan):
+                names = {'0': f"{self.config.center_freq / 1e6:.4f} MHz"}
+            self.telemetry.put(power_event(names))
+
+    def noise_floors(self):
+        """Adaptive thresholds in use, by channel name"""
+        if self.config.channels or self.config.scan:
+            monitor = self.channelizer_0.monitor if self.config.channels else self.scanner_0.monitor
+            return {channel.name: noise_floor for channel, noise_floor in zip(monitor.channels, monitor.noise_floors)
+                    if noise_floor is not None}
+        noise_floor = self.monitor_0.epy_block_0.noise_floor
+        return {0: noise_floor} if noise_floor is not None else {}
+
+    def restore_noise_floors(self):
+        """Start from the noise floors saved by the last run, skipping the warm-up"""
+        states = load_noise_floors(self.config.noise_floor_file)
+        for name, noise_floor in self.noise_floors().items():
+            if str(name) in states:
+                noise_floor.restore(states[str(name)])
+
+    def save_noise_floors(self):
+        if self.config.noise_floor_file:
+            save_noise_floors(self.config.noise_floor_file, self.noise_floors())
+
+    def apply(self, changes):
+        """Merge a dict of settings into the config in use and apply the result"""
+        with self._reload_lock:
+            config = MonitorConfig.from_dict({**self.config.to_dict(), **changes})
+            config.ctcss = parse_tone(config.ctcss)
+            self._reload(config)
+
+    def reload(self, config):
+        """
+        Apply a re-read config to the running flowgraph without reopening the SDR
+
+        Everything is checked and built before anything changes, so a rejected
+        config leaves the flowgraph as it was. Detector changes are picked up
+        between buffers; only a retune interrupts the samples.
+        """
+        with self._reload_lock:
+            self._reload(config)
+
+    def _reload(self, config):
+        if not self.source_0.tunable:
+            config.samp_rate = self.config.samp_rate
+            config.retune(self.config.center_freq)
+        if bool(config.channels) != bool(self.config.channels):
+            raise ValueError("Switching between single- and multi-channel mode requires a restart")
+        if bool(config.scan) != bool(self.config.scan):
+            raise ValueError("Turning scan mode on or off requires a restart")
+        if config.scan:
+            # The scheduler owns the tuning; only detection settings and gain can change
+            config.center_freq = self.config.center_freq
+        if config.telemetry != self.config.telemetry:
+            raise ValueError("Changing the telemetry address requires a restart")
+        if (config.ctcss is None) != (self.config.ctcss is None):
+            raise ValueError("Turning CTCSS verification on or off requires a restart")
+        if (config.squelch is None) != (self.config.squelch is None):
+            raise ValueError("Turning the squelch gate on or off requires a restart")
+        if config.waterfall != self.config.waterfall:
+            raise ValueError("Changing the waterfall file requires a restart")
+        # The centre frequency may have been forced back above
+        config.validate()
+        if self.airtime is not None:
+            self.airtime.assign_rows(self.channel_names(config))
+
+        # Build the new detectors now, so nothing below can be rejected
+        plan = None
+        if config.scan:
+            plan = self.scanner_0.plan_channels(config.scan)
+        elif config.channels:
+            plan = self.channelizer_0.monitor.plan_channels(config.channels)
+        else:
+            ActivityDetector(config.activity_threshold, self.monitor_0.epy_block_0.release_threshold)
+
+        # The hardware is the only step that can still fail; undo the gain if the retune does
+        retuned = (config.rf_gain, config.center_freq) != (self.config.rf_gain, self.config.center_freq)
+        if config.rf_gain != self.config.rf_gain:
+            self.source_0.set_gain(config.rf_gain)
+        if config.center_freq != self.config.center_freq:
+            try:
+                self.source_0.set_center_freq(config.center_freq)
+            except Exception:
+                if config.rf_gain != self.config.rf_gain:
+                    self.source_0.set_gain(self.config.rf_gain)
+                raise
+
+        if self.airtime is not None:
+            self.airtime.set_names(self.channel_names(config))
+        if retuned:
+            # The old floor no longer applies; fall back to static thresholds until re-measured
+            for noise_floor in self.noise_floors().values():
+                noise_floor.reset()
+        if config.scan:
+            self.scanner_0.update_channels(config.scan, plan)
+        elif config.channels:
+            self.channelizer_0.monitor.update_channels(config.channels, plan)
+        else:
+            self.monitor_0.epy_block_0.set_activity_threshold(config.activity_threshold)
+            self.monitor_0.epy_block_0.set_cooldown_time(config.cooldown_time)
+            self.monitor_0.epy_block_0.set_uptime_kuma_url(config.uptime_kuma_url)
+            self.monitor_0.epy_block_0.set_noise_margin(config.noise_margin)
+            if config.ctcss is not None:
+                self.monitor_0.ctcss_0.detector.set_tone(config.ctcss)
+            if config.squelch is not None:
+                self.monitor_0.squelch_0.set_margin(config.squelch)
+        if self.waterfall_0 is not None and config.center_freq != self.config.center_freq:
+            self.waterfall_0.set_center_freq(config.center_freq)
+        if self.recorder_0 is not None and retuned:
+            self.recorder_0.add_capture(config.center_freq, config.rf_gain)
+        self.config = config
+
+
+def parse_tone(value):
+    """ctcss.parse_tone, importing the CTCSS module only when a tone is configured"""
+    if value is None:
+        return None
+    from ctcss import parse_tone
+    return parse_tone(value)
+
+
+def argument_parser():
+    parser = ArgumentParser(description="Headless FM repeater uptime monitor")
+    parser.add_argument(
+        "-c", "--config",
+        help="JSON configuration file; re-read on SIGHUP")
+    parser.add_argument(
+        "-f", "--center-freq", dest="center_freq", type=eng_float,
+        help="Repeater output frequency in Hz")
+    parser.add_argument(
+        "-g", "--rf-gain", dest="rf_gain", type=eng_float,
+        help="RTL-SDR RF gain")
+    parser.add_argument(
+        "-t", "--activity-threshold", dest="activity_threshold", type=eng_float,
+        help="Activity threshold in dBFS")
+    parser.add_argument(
+        "--cooldown-time", dest="cooldown_time", type=eng_float,
+        help="Minimum seconds between heartbeats")
+    parser.add_argument(
+        "-u", "--uptime-kuma-url", dest="uptime_kuma_url",
+        help="Uptime Kuma push monitor URL")
+    parser.add_argument(
+        "--demod", dest="demod", choices=DEMOD_MODES,
+        help="WFM demodulation: off, gated by carrier detection, or always on")
+    parser.add_argument(
+        "--front-end", dest="front_end", choices=FRONT_ENDS,
+        help="Channel filter: single-stage FIR, multistage decimator or FFT filter")
+    parser.add_argument(
+        "--device-args", dest="device_args",
+        help="osmosdr device arguments, e.g. rtl=0")
+    parser.add_argument(
+        "-s", "--source", default="rtlsdr",
+        help="'rtlsdr' or a SigMF recording to replay instead of a live dongle")
+    parser.add_argument(
+        "--fast", action="store_true",
+        help="Replay recordings as fast as possible instead of in real time")
+    parser.add_argument(
+        "-r", "--record", metavar="PATH",
+        help="Also record raw IQ to PATH.sigmf-data with SigMF metadata")
+    parser.add_argument(
+        "-m", "--metrics-port", dest="metrics_port", type=int,
+        help="Serve Prometheus metrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument(
+        "--control-port", dest="control_port", type=int,
+        help="Serve the settings control API on http://127.0.0.1:PORT/config")
+    parser.add_argument(
+        "-e", "--event-log", dest="event_log", metavar="PATH",
+        help="Keep a ring buffer of key-ups in PATH (.npy), queried with activity_log.py")
+    parser.add_argument(
+        "--airtime", dest="airtime", metavar="PATH",
+        help="Keep minute, hour and day airtime rollups in PATH (.npy), exported with airtime.py")
+    parser.add_argument(
+        "--waterfall", dest="waterfall", metavar="PATH",
+        help="Record a spectrum history in PATH (.npy), viewed with waterfall.py")
+    parser.add_argument(
+        "--waterfall-resolution", dest="waterfall_resolution", type=eng_float, metavar="SECONDS",
+        help="Seconds averaged into each waterfall row (default: 1)")
+    parser.add_argument(
+        "--waterfall-days", dest="waterfall_days", type=eng_float, metavar="DAYS",
+        help="Days of history a new waterfall file holds (default: 1)")
+    parser.add_argument(
+        "--noise-margin", dest="noise_margin", type=eng_float,
+        help="Track the noise floor and detect this many dB above it instead of a fixed threshold")
+    parser.add_argument(
+        "--noise-floor-file", dest="noise_floor_file", metavar="PATH",
+        help="Save noise floor estimates to PATH and restore them at startup")
+    parser.add_argument(
+        "--ctcss", dest="ctcss", metavar="TONE",
+        help="Only send heartbeats for key-ups carrying this CTCSS tone in Hz, or 'any' tone")
+    parser.add_argument(
+        "--squelch", dest="squelch", type=eng_float, metavar="DB",
+        help="Gate the single-channel power path while quiet, opening DB below the release threshold")
+    parser.add_argument(
+        "--heartbeat-details", dest="heartbeat_details", action="store_const", const=True,
+        help="Send peak power (msg) and detection-to-push delay (ping) with each heartbeat")
+    parser.add_argument(
+        "--heartbeat-spool", dest="heartbeat_spool", metavar="PATH",
+        help="Keep undelivered heartbeats in an SQLite spool at PATH and replay them later")
+    parser.add_argument(
+        "--telemetry", dest="telemetry", metavar="ADDRESS",
+        help="Publish live telemetry for dashboards on a ZeroMQ PUB socket, e.g. tcp://127.0.0.1:5557")
+    parser.add_argument(
+        "--profile-startup", action="store_true",
+        help="Print how long imports, opening the SDR, filter design and the first sample took")
+    return parser
+
+
+def build_config(options):
+    """Load the config file, if any, and apply command line overrides"""
+    config = load_config(options.config) if options.config else MonitorConfig()
+    for name in ('center_freq', 'rf_gain', 'activity_threshold', 'cooldown_time',
+                 'uptime_kuma_url', 'demod', 'front_end', 'device_args', 'metrics_port', 'control_port',
+                 'event_log', 'airtime', 'waterfall', 'waterfall_resolution', 'waterfall_days',
+                 'noise_margin', 'noise_floor_file', 'ctcss', 'squelch',
+                 'heartbeat_details', 'heartbeat_spool', 'telemetry'):
+        value = getattr(options, name)
+        if value is not None:
+            setattr(config, name, value)
+    if options.noise_margin is not None:
+        for channel in config.channels:
+            channel.margin = options.noise_margin
+    config.ctcss = parse_tone(config.ctcss)
+    config.validate()
+    return config
+
+
+def main(top_block_cls=repeater_monitor_headless, options=None, serve_metrics=True):
+    if options is None:
+        options = argument_parser().parse_args()
+
+    STARTUP.enabled = STARTUP.enabled or options.profile_startup
+    config = build_config(options)
+    STARTUP.mark('config')
+    tb = top_block_cls(config, options, profile=STARTUP)
+
+    stopping = threading.Event()
+    reload_requested = threading.Event()
+
+    def sig_handler(sig=None, frame=None):
+        stopping.set()
+
+    def hup_handler(sig=None, frame=None):
+        reload_requested.set()
+
+    signal.signal(signal.SIGINT, sig_handler)
+    signal.signal(signal.SIGTERM, sig_handler)
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, hup_handler)
+
+    tb.start()
+    STARTUP.mark('start flowgraph')
+    print("Monitor running", flush=True)
+
+    # Detection is running; everything from here on can take its time
+    if config.metrics_port and serve_metrics:
+        metrics.start_http_server(config.metrics_port)
+    if config.control_port:
+        from control import start_control_server
+        start_control_server(tb, config.control_port, reload=lambda: tb.reload(build_config(options)))
+    if tb.telemetry is not None:
+        threading.Thread(target=tb.publish_power, args=(stopping,), daemon=True).start()
+    if STARTUP.enabled:
+        threading.Thread(target=lambda: (STARTUP.wait_first_sample(), STARTUP.report()), daemon=True).start()
+
+    # A replayed recording ends the flowgraph on its own
+    threading.Thread(target=lambda: (tb.wait(), stopping.set()), daemon=True).start()
+
+    last_save = time.monotonic()
+    while not stopping.wait(1):
+        if tb.airtime is not None:
+            tb.airtime.tick()
+        if time.monotonic() - last_save >= NOISE_FLOOR_SAVE_INTERVAL:
+            tb.save_noise_floors()
+            if tb.airtime is not None:
+                tb.airtime.flush()
+            if tb.waterfall is not None:
+                tb.waterfall.flush()
+            last_save = time.monotonic()
+        if reload_requested.is_set():
+            reload_requested.clear()
+            try:
+                tb.reload(build_config(options))
+                print("Configuration reloaded", flush=True)
+            except (OSError, ValueError) as e:
+                print(f"Configuration reload failed: {e}", file=sys.stderr, flush=True)
+
+    tb.stop()
+    tb.wait()
+    # The detectors have stopped publishing; send or spool what the sinks and Kuma still hold
+    tb.bus.stop()
+    tb.save_noise_floors()
+    if tb.event_log is not None:
+        tb.event_log.flush()
+    if tb.airtime is not None:
+        tb.airtime.tick()
+        tb.airtime.flush()
+    if tb.waterfall is not None:
+        tb.waterfall.flush()
+
+
+if __name__ == '__main__':
+    main()
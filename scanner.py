@@ -0,0 +1,438 @@
+"""
+Scan mode: one SDR time-shared across repeaters too far apart for one capture
+
+A fixed visiting order is built from the channel priorities (a channel with
+priority p is visited p times per cycle, spread evenly), so the worst-case
+revisit interval of every channel is known before the scan starts.
+
+scan_scheduler passes samples straight through and retunes the source at
+the end of each dwell, counting dwells in samples rather than sleeping. It
+tags the sample where the retune was issued ('scan_settle') and the first
+sample that is certain to be on the new frequency and past the PLL settle
+time ('scan_dwell'). Tags follow the samples through the channel filter, so
+scan_monitor can drop everything in between and hand each dwell to the
+detector of the channel it belongs to.
+
+An RTL-SDR cannot timestamp a retune, so the new frequency's first sample
+is bounded rather than marked: when the retune is issued, at most one
+scheduler buffer plus the source's buffered_samples (driver queue and
+GNU Radio buffer, see iq_source.py) were captured before it and not yet
+seen. Those are discarded along with the settle time.
+
+A new scan list takes effect at the next dwell boundary: the scheduler tags
+the first sample of the new layout ('scan_layout') and the monitor switches
+its channels on exactly that sample.
+"""
+
+import threading
+import numpy as np
+import pmt
+from gnuradio import blocks
+from gnuradio import filter
+from gnuradio import gr
+from activity_detector import ActivityDetector, linear_to_db
+from front_end import DECIMATION, channel_filter
+from heartbeat_dispatcher import HeartbeatDispatcher
+import latency
+from noise_floor import AdaptiveThreshold
+import metrics
+
+SETTLE_TAG = pmt.intern('scan_settle')
+DWELL_TAG = pmt.intern('scan_dwell')
+LAYOUT_TAG = pmt.intern('scan_layout')
+
+
+def scan_schedule(channels):
+    """Smooth weighted round-robin visiting order, as channel indices"""
+    weights = [max(1, int(channel.priority)) for channel in channels]
+    total = sum(weights)
+    current = [0] * len(channels)
+    order = []
+    for _ in range(total):
+        for i, weight in enumerate(weights):
+            current[i] += weight
+        best = current.index(max(current))
+        current[best] -= total
+        order.append(best)
+    return order
+
+
+def revisit_bounds(channels, order, settle):
+    """Longest interval between the starts of consecutive visits to each channel, in seconds"""
+    starts = np.cumsum([0.0] + [settle + channels[i].dwell for i in order])
+    cycle = starts[-1]
+    bounds = []
+    for i in range(len(channels)):
+        visits = starts[:-1][np.array(order) == i]
+        gaps = np.diff(np.append(visits, visits[0] + cycle))
+        bounds.append(float(gaps.max()))
+    return bounds
+
+
+class scan_scheduler(gr.sync_block):
+    """
+    Pass-through that retunes the source between dwells and tags the stream
+
+    retune is called with each new frequency from the scheduler thread.
+    upstream is how many samples the source may hold when it is called;
+    those, the rest of the scheduler's own buffer (at most batch samples)
+    and settle seconds are discarded after every retune.
+    """
+    def __init__(self, channels, samp_rate, settle=0.15, retune=None, upstream=0):
+        gr.sync_block.__init__(self,
+            name="scan_scheduler",
+            in_sig=[np.complex64],
+            out_sig=[np.complex64])
+
+        self.samp_rate = samp_rate
+        self.batch = max(1024, int(settle * samp_rate) // 4)
+        self.settle_samples = int(settle * samp_rate) + self.batch + int(upstream)
+        self.retune = retune
+        self._adopt(self._layout(channels))
+        self._pending = None
+        self._lock = threading.Lock()
+
+        self.step = -1
+        self.settling = False
+        self.next_boundary = 0
+        self.set_max_noutput_items(self.batch)
+
+    def work(self, input_items, output_items):
+        n = len(input_items[0])
+        output_items[0][:] = input_items[0]
+
+        end = self.nitems_written(0) + n
+        while self.next_boundary < end:
+            if self.settling:
+                channel = self.order[self.step]
+                self.add_item_tag(0, self.next_boundary, DWELL_TAG, pmt.from_long(channel))
+                self.settling = False
+                self.next_boundary += self.dwell_samples[channel]
+            else:
+                if self._pending is not None:
+                    with self._lock:
+                        layout, self._pending = self._pending, None
+                    self._adopt(layout)
+                    self.add_item_tag(0, self.next_boundary, LAYOUT_TAG, pmt.from_long(len(self.channels)))
+                self.step = (self.step + 1) % len(self.order)
+                channel = self.order[self.step]
+                if self.retune is not None:
+                    self.retune(self.channels[channel].freq)
+                self.add_item_tag(0, self.next_boundary, SETTLE_TAG, pmt.from_long(channel))
+                self.settling = True
+                self.next_boundary += self.settle_samples
+
+        return n
+
+    def update_channels(self, channels, layout=None):
+        """Switch to a new scan list when the current dwell ends; the schedule is built here, not in work()"""
+        if layout is None:
+            layout = self._layout(channels)
+        with self._lock:
+            self._pending = layout
+
+    def _layout(self, channels):
+        """The scan list, its visiting order and dwells in samples; raises ValueError for a dwell nothing is left of"""
+        dwell_samples = [int(channel.dwell * self.samp_rate) for channel in channels]
+        discard = self.settle_samples / self.samp_rate
+        for channel, samples in zip(channels, dwell_samples):
+            if samples <= self.settle_samples:
+                raise ValueError(f"Scan channel {channel.name!r} dwell of {channel.dwell} s is not longer than "
+                                 f"the {discard:.2f} s discarded after each retune; lengthen the dwell or "
+                                 "shrink the osmosdr buffers")
+            if samples < 2 * self.settle_samples:
+                print(f"Warning: scan channel {channel.name!r} loses over half of its {channel.dwell} s dwell "
+                      f"to the {discard:.2f} s discarded after each retune")
+        return channels, scan_schedule(channels), dwell_samples
+
+    def _adopt(self, layout):
+        """Start a new visiting order from its beginning"""
+        self.channels, self.order, self.dwell_samples = layout
+        self.step = -1
+
+
+class scan_monitor(gr.sync_block):
+    """
+    Per-channel activity detection on the dwells of a scanned power stream
+
+    Each channel's detector only ever sees that channel's dwell samples, so
+    a key-up still present on the next visit continues the same run.
+    """
+    def __init__(self, channels, samp_rate=256000, dispatcher=None, event_log=None):
+        gr.sync_block.__init__(self,
+            name="scan_monitor",
+            in_sig=[np.float32],
+            out_sig=[])
+
+        self.channels = channels
+        self.samp_rate = samp_rate
+        self.detectors = [ActivityDetector(channel.threshold, channel.release_threshold,
+                                           min_samples=channel.min_duration * samp_rate)
+                          for channel in channels]
+        self.noise_floors = [self._noise_floor(detector, channel)
+                             for detector, channel in zip(self.detectors, channels)]
+        self.activity_detected = [False] * len(channels)
+        self.current = None
+
+        # Stream time of each channel's last dwell, and its revisit intervals
+        self.last_visit = [None] * len(channels)
+        self.revisit_max = [0.0] * len(channels)
+
+        # Callables notified of every edge as (channel, kind, edge_time, detected_time),
+        # with times in seconds of that channel's dwell samples. Event log times are
+        # only exact for key-ups that start and end within one dwell.
+        self.listeners = []
+        self.event_log = event_log
+        self._bind_metrics()
+
+        # A staged channel list: applied at the next buffer, or at the scheduler's
+        # layout tag when frequencies, dwells or priorities changed
+        self._pending = None
+        self._pending_layout = False
+        self._lock = threading.Lock()
+
+        self.dispatcher = dispatcher or HeartbeatDispatcher()
+        self.owns_dispatcher = dispatcher is None
+
+    def work(self, input_items, output_items):
+        power = input_items[0]
+        start = self.nitems_read(0)
+
+        if self._pending is not None and not self._pending_layout:
+            self._apply_pending()
+        tags = [tag for tag in self.get_tags_in_window(0, 0, len(power))
+                if pmt.eq(tag.key, SETTLE_TAG) or pmt.eq(tag.key, DWELL_TAG) or pmt.eq(tag.key, LAYOUT_TAG)]
+        position = 0
+        # A layout tag shares its offset with a settle tag and must come first
+        for tag in sorted(tags, key=lambda tag: (tag.offset, not pmt.eq(tag.key, LAYOUT_TAG))):
+            index = tag.offset - start
+            self._feed(power[position:index], tag.offset)
+            position = index
+            if pmt.eq(tag.key, DWELL_TAG):
+                self._visit(pmt.to_long(tag.value), tag.offset / self.samp_rate)
+            elif pmt.eq(tag.key, LAYOUT_TAG):
+                self.current = None
+                if self._pending is not None:
+                    self._apply_pending()
+            else:
+                self.current = None
+        self._feed(power[position:], start + len(power))
+
+        return len(power)
+
+    def _visit(self, i, t):
+        """Start a dwell on channel i at stream time t"""
+        self.current = i
+        if self.last_visit[i] is not None:
+            interval = t - self.last_visit[i]
+            self.revisit_max[i] = max(self.revisit_max[i], interval)
+            self.revisit_metrics[i].set(interval)
+            self.revisit_max_metrics[i].set(self.revisit_max[i])
+        self.last_visit[i] = t
+
+    def _feed(self, power, end):
+        """Run one piece of the current dwell, ending at stream sample end, through its channel's detector"""
+        i = self.current
+        if i is None or len(power) == 0:
+            return
+        detector = self.detectors[i]
+
+        if self.noise_floors[i] is not None:
+            self.noise_floors[i].update(power)
+        for kind, index in detector.process(power):
+            if kind == 'onset':
+                self.activity_detected[i] = True
+                # Exact when the carrier rose within this dwell, like the event log
+                self._send_heartbeat(i, latency.start_trace((end - (detector.nitems - index)) / self.samp_rate))
+                print(f"Activity detected on {self.channels[i].name}! "
+                      f"Power: {linear_to_db(detector.peak_power):.1f} dBFS")
+            else:
+                self.activity_detected[i] = False
+            self.transition_metrics[i][kind].inc()
+            for listener in self.listeners:
+                listener(i, kind, index / self.samp_rate, detector.nitems / self.samp_rate)
+        if self.event_log is not None and detector.runs:
+            self.event_log.record_runs(i, detector, self.samp_rate)
+
+        self.power_metrics[i].set(linear_to_db(power[-1]))
+        self.carrier_metrics[i].set(int(detector.carrier))
+        self.threshold_metrics[i].set(detector.attack_threshold)
+        if self.noise_floors[i] is not None and self.noise_floors[i].floor is not None:
+            self.floor_metrics[i].set(self.noise_floors[i].floor)
+
+    def plan_channels(self, channels):
+        """
+        Build the detectors and noise floors of a new channel list without
+        staging it, so a bad setting raises ValueError before anything changes
+        """
+        current = self.channels
+        return current, self._plan(channels, current)
+
+    def update_channels(self, channels, layout_changed=False, plan=None):
+        """
+        Stage a new channel list, applied between buffers by work()
+
+        With layout_changed the switch waits for the scheduler's layout tag,
+        so no sample is judged against the wrong channel's detector. New
+        detectors and noise floors are built here (or by plan_channels()), on
+        the caller's thread, so a bad setting raises ValueError to the caller
+        and work() only swaps references.
+        """
+        while True:
+            current, staged = plan or self.plan_channels(channels)
+            plan = None
+            with self._lock:
+                # work() may have adopted an earlier list meanwhile; plan against that one
+                if self.channels is current:
+                    # A layout change still waiting for its tag must keep waiting
+                    self._pending_layout = layout_changed or (self._pending is not None and self._pending_layout)
+                    self._pending = staged
+                    return
+
+    def _plan(self, channels, current):
+        """
+        Match the new list against the current one: a channel at an unchanged
+        frequency keeps its detector, noise floor and revisit statistics.
+        Returns (channels, entries) with one (channel, kept index or None,
+        detector, noise floor) entry per channel.
+        """
+        previous = {channel.freq: i for i, channel in enumerate(current)}
+        entries = []
+        for channel in channels:
+            # Built for every channel, so invalid thresholds raise here rather than in work()
+            detector = ActivityDetector(channel.threshold, channel.release_threshold,
+                                        min_samples=channel.min_duration * self.samp_rate)
+            i = previous.pop(channel.freq, None)
+            if i is None:
+                entries.append((channel, None, detector, self._noise_floor(detector, channel)))
+                continue
+            noise_floor = self.noise_floors[i]
+            if channel.margin is None:
+                noise_floor = None
+            elif noise_floor is None:
+                noise_floor = self._noise_floor(self.detectors[i], channel)
+            entries.append((channel, i, detector, noise_floor))
+        return channels, entries
+
+    def _apply_pending(self):
+        """Adopt the staged channel list; nothing here can fail"""
+        with self._lock:
+            channels, entries = self._pending
+            self._pending = None
+            detectors, noise_floors, active, last_visit, revisit_max = [], [], [], [], []
+            for channel, i, detector, noise_floor in entries:
+                if i is None:
+                    active.append(False)
+                    last_visit.append(None)
+                    revisit_max.append(0.0)
+                else:
+                    # Keep the running detector's state; its new settings were checked by _plan()
+                    detector, checked = self.detectors[i], detector
+                    detector.set_thresholds(checked.attack_threshold, checked.release_threshold)
+                    detector.min_samples = checked.min_samples
+                    if noise_floor is not None:
+                        noise_floor.hysteresis = detector.attack_threshold - detector.release_threshold
+                        noise_floor.set_margin(channel.margin)
+                    active.append(self.activity_detected[i])
+                    last_visit.append(self.last_visit[i])
+                    revisit_max.append(self.revisit_max[i])
+                detectors.append(detector)
+                noise_floors.append(noise_floor)
+            for channel in self.channels:
+                for gauge in (metrics.CHANNEL_POWER, metrics.CHANNEL_CARRIER, metrics.CHANNEL_THRESHOLD,
+                              metrics.NOISE_FLOOR, metrics.SCAN_REVISIT, metrics.SCAN_REVISIT_MAX):
+                    gauge.remove(channel.name)
+            self.detectors = detectors
+            self.noise_floors = noise_floors
+            self.activity_detected = active
+            self.last_visit = last_visit
+            self.revisit_max = revisit_max
+            self.channels = channels
+            self._bind_metrics()
+
+    def _noise_floor(self, detector, channel):
+        """Adaptive threshold for a channel with a noise margin, else None"""
+        if channel.margin is None:
+            return None
+        return AdaptiveThreshold(detector, channel.margin, self.samp_rate, decimation=64)
+
+    def _bind_metrics(self):
+        """Look up each channel's metric series once, by channel name"""
+        self.power_metrics = [metrics.CHANNEL_POWER.labels(channel.name) for channel in self.channels]
+        self.carrier_metrics = [metrics.CHANNEL_CARRIER.labels(channel.name) for channel in self.channels]
+        self.threshold_metrics = [metrics.CHANNEL_THRESHOLD.labels(channel.name) for channel in self.channels]
+        self.floor_metrics = [metrics.NOISE_FLOOR.labels(channel.name) for channel in self.channels]
+        self.revisit_metrics = [metrics.SCAN_REVISIT.labels(channel.name) for channel in self.channels]
+        self.revisit_max_metrics = [metrics.SCAN_REVISIT_MAX.labels(channel.name) for channel in self.channels]
+        self.transition_metrics = [{kind: metrics.ACTIVITY_TRANSITIONS.labels(channel.name, kind)
+                                    for kind in ('onset', 'offset')} for channel in self.channels]
+
+    def revisit_stats(self):
+        """Longest revisit interval seen so far, by channel name"""
+        return {channel.name: interval for channel, interval in zip(self.channels, self.revisit_max)}
+
+    def _send_heartbeat(self, i, trace=None):
+        """Queue a heartbeat for one channel's Uptime Kuma monitor"""
+        channel = self.channels[i]
+        self.dispatcher.submit(channel.url, channel.cooldown, linear_to_db(self.detectors[i].peak_power), trace)
+
+    def stop(self):
+        # A shared dispatcher (e.g. the headless event bus) is stopped by its owner
+        if self.owns_dispatcher:
+            self.dispatcher.stop()
+        return True
+
+
+class scan_chain(gr.hier_block2):
+    """
+    Complex capture in, scanned detection and heartbeats out
+
+    scan_scheduler -> channel filter -> |x|^2 -> IIR smoothing -> scan_monitor,
+    the single-channel power path with every channel at the capture centre.
+    """
+    def __init__(self, channels, samp_rate=2048000, settle=0.15, retune=None, front_end='multistage',
+                 dispatcher=None, event_log=None, upstream=0):
+        gr.hier_block2.__init__(self,
+            "scan_chain",
+            gr.io_signature(1, 1, gr.sizeof_gr_complex),
+            gr.io_signature(0, 0, 0))
+
+        self.scheduler = scan_scheduler(channels, samp_rate, settle, retune, upstream)
+        # Time discarded per retune, including what the source may still hold
+        self.settle = self.scheduler.settle_samples / samp_rate
+        self.low_pass_filter_0 = channel_filter(front_end, samp_rate)
+        self.mag_squared = blocks.complex_to_mag_squared(1)
+        self.smoothing = filter.single_pole_iir_filter_ff(0.01, 1)
+        self.monitor = scan_monitor(channels, samp_rate // DECIMATION, dispatcher, event_log)
+
+        self.connect(self, self.scheduler, self.low_pass_filter_0, self.mag_squared, self.smoothing, self.monitor)
+
+        self._print_schedule(channels)
+
+    def plan_channels(self, channels):
+        """Build everything a new scan list needs without applying it; raises ValueError on a bad setting"""
+        layout = [(channel.freq, channel.dwell, channel.priority) for channel in channels]
+        layout_changed = layout != [(channel.freq, channel.dwell, channel.priority)
+                                    for channel in self.monitor.channels]
+        return (self.monitor.plan_channels(channels),
+                self.scheduler._layout(channels) if layout_changed else None)
+
+    def update_channels(self, channels, plan=None):
+        """
+        Apply a new scan list without stopping the flowgraph
+
+        Threshold, cooldown and URL changes apply from the next buffer; new
+        frequencies, dwells or priorities from the end of the current dwell.
+        """
+        monitor_plan, layout = plan or self.plan_channels(channels)
+        self.monitor.update_channels(channels, layout is not None, monitor_plan)
+        if layout is not None:
+            self.scheduler.update_channels(channels, layout)
+            self._print_schedule(channels)
+
+    def _print_schedule(self, channels):
+        print(f"Scanning {len(channels)} channels, {self.settle * 1e3:.0f} ms discarded per retune:")
+        bounds = revisit_bounds(channels, scan_schedule(channels), self.settle)
+        for channel, bound in zip(channels, bounds):
+            print(f"  {channel.name}: {channel.freq / 1e6:.4f} MHz, dwell {channel.dwell} s, "
+                  f"priority {channel.priority}, revisited at least every {bound:.2f} s")
@@ -2,26 +2,35 @@
 """
 Simplified FM Repeater Uptime Monitor
 GNU Radio QT GUI application to monitor FM repeater activity and send heartbeats to Uptime Kuma
+
+With --connect it is a remote dashboard for repeater_monitor_headless.py
+--telemetry, showing the daemon's live power, carrier state and heartbeat
+results; otherwise it simulates activity for testing without hardware.
 """
 
 import sys
 import time
 import threading
-import requests
+from argparse import ArgumentParser
 from PyQt5 import Qt, QtCore, QtWidgets
 import numpy as np
+from heartbeat_dispatcher import HeartbeatDispatcher
+from telemetry import DEFAULT_ADDRESS, TelemetrySubscriber
 
 
 class SimpleRepeaterMonitor(QtWidgets.QWidget):
-    """Simplified version without GNU Radio integration for testing"""
+    """Simulated monitor for testing, or a dashboard following a headless daemon's telemetry"""
 
-    def __init__(self):
+    def __init__(self, telemetry=None):
         super().__init__()
 
         # Initialize variables
         self.monitoring = False
-        self.last_heartbeat_time = 0
         self.activity_detected = False
+        self.dispatcher = HeartbeatDispatcher(details=True)
+        self.telemetry = telemetry
+        self.channels = {}
+        self.remote_heartbeat_time = 0
 
         # Default values
         self.frequency = 146.52  # MHz
@@ -41,7 +50,10 @@ class SimpleRepeaterMonitor(QtWidgets.QWidget):
         """Setup the QT GUI interface"""
         self.setObjectName("SimpleRepeaterMonitor")
         self.resize(600, 400)
-        self.setWindowTitle("FM Repeater Uptime Monitor (Simple Version)")
+        if self.telemetry:
+            self.setWindowTitle(f"FM Repeater Uptime Monitor (Dashboard, {self.telemetry})")
+        else:
+            self.setWindowTitle("FM Repeater Uptime Monitor (Simple Version)")
 
         # Main layout
         main_layout = QtWidgets.QVBoxLayout(self)
@@ -88,6 +100,12 @@ class SimpleRepeaterMonitor(QtWidgets.QWidget):
         self.start_stop_button.clicked.connect(self.toggle_monitoring)
         control_layout.addWidget(self.start_stop_button, 4, 0, 1, 2)
 
+        # The daemon owns detection settings; a dashboard only watches
+        if self.telemetry:
+            for widget in (self.freq_spinbox, self.cooldown_spinbox, self.threshold_spinbox):
+                widget.setEnabled(False)
+            self.start_stop_button.setText("Connect")
+
         main_layout.addWidget(control_group)
 
         # Status panel
@@ -106,6 +124,9 @@ class SimpleRepeaterMonitor(QtWidgets.QWidget):
         self.signal_level_label = QtWidgets.QLabel("Signal Level: -- dBFS")
         status_layout.addWidget(self.signal_level_label)
 
+        self.channels_label = QtWidgets.QLabel("")
+        status_layout.addWidget(self.channels_label)
+
         main_layout.addWidget(status_group)
 
         # Instructions
@@ -153,19 +174,44 @@ integration requires additional GNU Radio fixes.</i>
     def start_monitoring(self):
         """Start the monitoring process"""
         self.monitoring = True
-        self.start_stop_button.setText("Stop Monitoring")
-        self.status_label.setText("Status: Monitoring (Simulated)")
-
-        # Start simulation thread
-        self.simulation_thread = threading.Thread(target=self.simulation_loop, daemon=True)
+        if self.telemetry:
+            self.start_stop_button.setText("Disconnect")
+            self.status_label.setText(f"Status: Connected to {self.telemetry}")
+            self.simulation_thread = threading.Thread(target=self.telemetry_loop, daemon=True)
+        else:
+            self.start_stop_button.setText("Stop Monitoring")
+            self.status_label.setText("Status: Monitoring (Simulated)")
+            self.simulation_thread = threading.Thread(target=self.simulation_loop, daemon=True)
         self.simulation_thread.start()
 
     def stop_monitoring(self):
         """Stop the monitoring process"""
         self.monitoring = False
-        self.start_stop_button.setText("Start Monitoring")
+        self.start_stop_button.setText("Connect" if self.telemetry else "Start Monitoring")
         self.status_label.setText("Status: Stopped")
 
+    def telemetry_loop(self):
+        """Follow the daemon's telemetry; the GUI timer picks up the latest values"""
+        try:
+            subscriber = TelemetrySubscriber(self.telemetry)
+        except ValueError as e:
+            print(f"Error: {e}")
+            self.monitoring = False
+            return
+        try:
+            while self.monitoring:
+                event = subscriber.recv(0.5)
+                if event is None:
+                    continue
+                if event['type'] == 'power' and event['channels']:
+                    self.channels = event['channels']
+                    self.activity_detected = any(channel['carrier'] for channel in self.channels.values())
+                    self.current_signal_level = max(channel['power_db'] for channel in self.channels.values())
+                elif event['type'] == 'result' and event['ok']:
+                    self.remote_heartbeat_time = event['time']
+        finally:
+            subscriber.close()
+
     def simulation_loop(self):
         """Simulate activity detection for testing"""
         while self.monitoring:
@@ -179,7 +225,7 @@ integration requires additional GNU Radio fixes.</i>
                     signal_level = -15 + np.random.normal(0, 3)
                     if not self.activity_detected:
                         self.activity_detected = True
-                        self.send_heartbeat()
+                        self.send_heartbeat(signal_level)
                 else:
                     self.activity_detected = False
 
@@ -192,29 +238,19 @@ integration requires additional GNU Radio fixes.</i>
                 print(f"Error in simulation: {e}")
                 time.sleep(1)
 
-    def send_heartbeat(self):
-        """Send heartbeat to Uptime Kuma server"""
-        current_time = time.time()
-
-        # Check cooldown
-        if current_time - self.last_heartbeat_time < self.cooldown_time:
-            return
-
-        try:
-            response = requests.get(self.uptime_kuma_url, timeout=5)
-            if response.status_code == 200:
-                self.last_heartbeat_time = current_time
-                print(f"Heartbeat sent successfully at {time.strftime('%H:%M:%S')}")
-            else:
-                print(f"Heartbeat failed with status: {response.status_code}")
-
-        except Exception as e:
-            print(f"Error sending heartbeat: {e}")
+    def send_heartbeat(self, signal_level=None, cooldown_time=None):
+        """Queue a heartbeat for the Uptime Kuma server; the dispatcher applies the cooldown"""
+        if cooldown_time is None:
+            cooldown_time = self.cooldown_time
+        self.dispatcher.submit(self.uptime_kuma_url, cooldown_time, signal_level)
 
     def send_test_heartbeat(self):
         """Send a test heartbeat manually"""
-        self.last_heartbeat_time = 0  # Reset cooldown for testing
-        self.send_heartbeat()
+        self.send_heartbeat(cooldown_time=0)  # Ignore the cooldown for testing
+
+    @property
+    def last_heartbeat_time(self):
+        return max(self.dispatcher.last_heartbeat_time.get(self.uptime_kuma_url, 0), self.remote_heartbeat_time)
 
     def update_gui(self):
         """Update GUI elements"""
@@ -231,6 +267,12 @@ integration requires additional GNU Radio fixes.</i>
             if hasattr(self, 'current_signal_level'):
                 self.signal_level_label.setText(f"Signal Level: {self.current_signal_level:.1f} dBFS")
 
+            # One line per channel the daemon watches
+            if len(self.channels) > 1:
+                self.channels_label.setText('\n'.join(
+                    f"{name}: {channel['power_db']:.1f} dBFS{' ACTIVE' if channel['carrier'] else ''}"
+                    for name, channel in sorted(self.channels.items())))
+
             # Update last heartbeat time
             if self.last_heartbeat_time > 0:
                 heartbeat_time = time.strftime('%H:%M:%S', time.localtime(self.last_heartbeat_time))
@@ -239,15 +281,22 @@ integration requires additional GNU Radio fixes.</i>
     def closeEvent(self, event):
         """Handle application close"""
         self.stop_monitoring()
+        self.dispatcher.stop()
         event.accept()
 
 
 def main():
     """Main application entry point"""
-    app = QtWidgets.QApplication(sys.argv)
+    parser = ArgumentParser(description="FM repeater monitor test GUI and remote dashboard")
+    parser.add_argument(
+        "--connect", nargs='?', const=DEFAULT_ADDRESS, metavar="ADDRESS",
+        help=f"Show the telemetry of a headless monitor instead of simulating (default {DEFAULT_ADDRESS})")
+    options = parser.parse_args()
+
+    app = QtWidgets.QApplication(sys.argv[:1])
 
     # Create and show the main window
-    window = SimpleRepeaterMonitor()
+    window = SimpleRepeaterMonitor(options.connect)
     window.show()
 
     # Run the application
@@ -0,0 +1,119 @@
+"""
+Power squelch gate between channel selection and detection
+
+A quiet channel is the normal case for most repeaters, yet every channel
+sample still goes through |x|^2, the IIR smoothing and the detector. The
+gate measures power in short chunks itself and, while the channel is quiet,
+passes only a keepalive burst every keepalive_period seconds (enough for the
+power gauge and the noise-floor estimate). When a chunk comes within margin
+dB of the detector's release threshold it opens, one chunk early, and passes
+every sample until the channel has been quiet for hang seconds and the
+detector has released, so downstream CPU tracks channel occupancy.
+
+Each gap in the output is tagged with SQUELCH_GAP, the number of samples
+dropped before the tagged one. The detector block skips that many samples,
+so stream times, event log entries and latency traces are unchanged.
+"""
+
+import numpy as np
+import pmt
+from gnuradio import gr
+from activity_detector import db_to_linear
+
+SQUELCH_GAP = pmt.intern('squelch_gap')
+
+
+class squelch_gate(gr.basic_block):
+    """
+    Complex channel samples in, the same samples out while the channel is busy
+
+    detector is the downstream ActivityDetector, whose (possibly adaptive)
+    release threshold sets the opening level.
+    """
+    def __init__(self, detector, samp_rate=256000, margin=3.0, hang=0.5, chunk=256,
+                 keepalive_period=0.1, keepalive_length=512):
+        gr.basic_block.__init__(self,
+            name="squelch_gate",
+            in_sig=[np.complex64],
+            out_sig=[np.complex64])
+        # Input tags would land on the wrong samples once some are dropped
+        self.set_tag_propagation_policy(gr.TPP_DONT)
+
+        self.detector = detector
+        self.margin = margin
+        self.chunk = chunk
+        self.hang_chunks = max(1, int(hang * samp_rate / chunk))
+        self.keepalive_period = max(keepalive_length, int(keepalive_period * samp_rate))
+        self.keepalive_length = keepalive_length
+
+        self.open = False
+        self.quiet_chunks = 0          # chunks below the opening level since the last loud one
+        self.next_index = 0            # input index following the last sample passed on
+        self.history = np.zeros(chunk, dtype=np.complex64)  # pre-roll from the previous call
+
+    def set_margin(self, margin):
+        self.margin = margin
+
+    def general_work(self, input_items, output_items):
+        samples = input_items[0]
+        out = output_items[0]
+        # Whole chunks only, leaving room for a chunk of pre-roll
+        n = min(len(samples), len(out) - self.chunk) // self.chunk * self.chunk
+        if n <= 0:
+            return 0
+        samples = samples[:n]
+        start = self.nitems_read(0)
+
+        # Mean power of each chunk: one pass over the interleaved I/Q floats
+        power = np.square(samples.view(np.float32)).reshape(-1, 2 * self.chunk).sum(axis=1) / self.chunk
+        loud = power > db_to_linear(self.detector.release_threshold - self.margin)
+
+        produced = 0
+        if self.open:
+            produced = self._emit(out, produced, samples, start)
+        elif loud.any():
+            first = int(np.argmax(loud)) * self.chunk
+            if first == 0:
+                produced = self._emit(out, produced, self.history, start - self.chunk)
+                produced = self._emit(out, produced, samples, start)
+            else:
+                produced = self._emit(out, produced, samples[first - self.chunk:], start + first - self.chunk)
+            self.open = True
+        else:
+            produced = self._keepalive(out, produced, samples, start)
+
+        if loud.any():
+            self.quiet_chunks = len(loud) - 1 - int(np.flatnonzero(loud)[-1])
+        else:
+            self.quiet_chunks += len(loud)
+        if self.open and self.quiet_chunks >= self.hang_chunks and not self.detector.carrier:
+            self.open = False
+
+        self.history[:] = samples[-self.chunk:]
+        self.consume(0, n)
+        return produced
+
+    def _keepalive(self, out, produced, samples, start):
+        """Pass the parts of this call's samples that fall in a keepalive burst"""
+        stop = start + len(samples)
+        burst = start - start % self.keepalive_period
+        while burst < stop:
+            lo, hi = max(burst, start), min(burst + self.keepalive_length, stop)
+            if lo < hi:
+                produced = self._emit(out, produced, samples[lo - start:hi - start], lo)
+            burst += self.keepalive_period
+        return produced
+
+    def _emit(self, out, produced, segment, index):
+        """Copy input samples starting at input index to the output, tagging any gap before them"""
+        skip = self.next_index - index
+        if skip > 0:
+            segment, index = segment[skip:], self.next_index  # already passed on
+        if len(segment) == 0:
+            return produced
+        if index > self.next_index:
+            self.add_item_tag(0, self.nitems_written(0) + produced, SQUELCH_GAP,
+                              pmt.from_long(index - self.next_index))
+        out[produced:produced + len(segment)] = segment
+        self.next_index = index + len(segment)
+        return produced + len(segment)
@@ -0,0 +1,84 @@
+"""
+Startup timing report for --profile-startup
+
+Import this module first, before GNU Radio or NumPy. When --profile-startup
+is on the command line it times every top-level module imported from then
+on (including whatever that module imports in turn), so the report can show
+where start-up goes before argparse has even run. Phases are consecutive:
+each mark() ends the phase that began at the previous one.
+
+    profile = StartupProfile()
+    ...
+    profile.mark("open device")
+    ...
+    profile.report()
+"""
+
+import builtins
+import sys
+import threading
+import time
+
+STARTED = time.perf_counter()
+ENABLED = '--profile-startup' in sys.argv
+
+IMPORT_TIMES = {}
+_original_import = builtins.__import__
+_import_depth = threading.local()
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    """builtins.__import__ that records the time of outermost first-time imports"""
+    depth = getattr(_import_depth, 'value', 0)
+    top = name.partition('.')[0]
+    timed = not (level or depth or top in sys.modules)
+    _import_depth.value = depth + 1
+    start = time.perf_counter()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        _import_depth.value = depth
+        if timed:
+            IMPORT_TIMES[top] = IMPORT_TIMES.get(top, 0.0) + time.perf_counter() - start
+
+
+if ENABLED:
+    builtins.__import__ = _timed_import
+
+
+class StartupProfile:
+    """Consecutive named phases of start-up, from the import of this module"""
+
+    def __init__(self, enabled=ENABLED):
+        self.enabled = enabled
+        self.phases = []
+        self.first_sample = None   # perf_counter() time, set by iq_source.first_sample_probe
+        self._last = STARTED
+
+    def mark(self, name):
+        """End the current phase, naming it"""
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    def wait_first_sample(self, timeout=30):
+        """Block until the probe has seen a sample; returns False on timeout"""
+        deadline = time.perf_counter() + timeout
+        while self.first_sample is None and time.perf_counter() < deadline:
+            time.sleep(0.001)
+        return self.first_sample is not None
+
+    def report(self, file=sys.stderr):
+        builtins.__import__ = _original_import
+        print("Startup profile (seconds):", file=file)
+        for name, seconds in self.phases:
+            print(f"  {name:22s} {seconds:7.3f}", file=file)
+            if name == 'imports':
+                for module, module_seconds in sorted(IMPORT_TIMES.items(), key=lambda item: -item[1])[:8]:
+                    print(f"    {module:20s} {module_seconds:7.3f}", file=file)
+        if self.first_sample is not None:
+            print(f"  {'first sample':22s} {self.first_sample - self._last:7.3f}", file=file)
+            print(f"  {'total':22s} {self.first_sample - STARTED:7.3f}", file=file)
+        else:
+            print(f"  {'first sample':22s} not seen", file=file)
+        file.flush()
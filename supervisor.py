@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Supervisor for several RTL-SDR dongles on one host
+
+Each dongle gets its own worker process running the headless monitor, so
+every flowgraph has its own interpreter and GIL and the load spreads across
+cores; a dongle that falls behind or crashes only affects its own worker,
+which is restarted after a delay.
+
+Workers do not send heartbeats or serve metrics themselves. They put
+heartbeat requests and periodic metric snapshots on one multiprocessing
+queue, and the supervisor delivers the heartbeats through a single
+HeartbeatDispatcher (one cooldown table and connection pool for the whole
+host) and serves every worker's metrics, labelled by worker, on one port.
+"""
+
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+from functools import partial
+import metrics
+from heartbeat_dispatcher import HeartbeatDispatcher
+from repeater_monitor_headless import argument_parser as monitor_argument_parser
+from repeater_monitor_headless import main as monitor_main
+from repeater_monitor_headless import repeater_monitor_headless
+
+RESTART_DELAY = 10            # seconds before restarting a worker that exited
+METRICS_PUSH_INTERVAL = 5     # seconds between a worker's metric snapshots
+
+
+class WorkerConfig:
+    """One dongle: its serial number and the headless monitor's command line"""
+
+    def __init__(self, name, serial=None, args=()):
+        self.name = name
+        self.serial = serial
+        self.args = list(args)
+
+    def monitor_args(self):
+        """Command line for the worker, selecting the dongle by serial number"""
+        if self.serial is None:
+            return self.args
+        return self.args + ['--device-args', f"numchan=1 rtl={self.serial}"]
+
+
+def load_workers(path):
+    """Load the metrics port, worker list and heartbeat client settings from a JSON file"""
+    with open(path) as f:
+        data = json.load(f)
+    workers = [WorkerConfig(**entry) for entry in data.get('workers', [])]
+    names = [worker.name for worker in workers]
+    if not workers or len(set(names)) != len(names):
+        raise ValueError("The supervisor config needs a list of 'workers' with unique names")
+    return data.get('metrics_port'), workers, data.get('heartbeat', {})
+
+
+class RemoteDispatcher:
+    """Stands in for HeartbeatDispatcher inside a worker, forwarding to the supervisor"""
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    def submit(self, url, cooldown_time=None, power=None, trace=None):
+        if not url:
+            return False  # heartbeats disabled
+        # Queue.put never blocks on an unbounded queue, so a slow supervisor cannot stall work()
+        self.channel.put(('heartbeat', url, cooldown_time, power, trace))
+        return True
+
+    def stop(self, timeout=5):
+        pass
+
+
+def run_worker(name, args, channel):
+    """Worker process entry point: the headless monitor with a remote dispatcher and metrics"""
+    def push_metrics():
+        while True:
+            channel.put(('metrics', name, metrics.REGISTRY.snapshot()))
+            time.sleep(METRICS_PUSH_INTERVAL)
+
+    print(f"[{name}] Worker started (pid {os.getpid()})", flush=True)
+    threading.Thread(target=push_metrics, name="metrics-push", daemon=True).start()
+    dispatcher = RemoteDispatcher(channel)
+    monitor_main(partial(repeater_monitor_headless, dispatcher=dispatcher), monitor_argument_parser().parse_args(args),
+                 serve_metrics=False)
+
+
+class Supervisor:
+    """Starts, watches and restarts one worker process per dongle"""
+
+    def __init__(self, workers, heartbeat=None):
+        # Spawn rather than fork, so no GNU Radio or HTTP state is shared with the children
+        self.context = multiprocessing.get_context('spawn')
+        self.channel = self.context.Queue()
+        self.workers = workers
+        self.processes = {}
+        self.exited_at = {}
+
+        self.dispatcher = HeartbeatDispatcher(**(heartbeat or {}))
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run_channel, name="supervisor-channel", daemon=True)
+        self._thread.start()
+
+    def start(self, worker):
+        process = self.context.Process(target=run_worker, name=worker.name,
+                                       args=(worker.name, worker.monitor_args(), self.channel))
+        process.start()
+        self.processes[worker.name] = process
+
+    def check(self):
+        """Restart workers that exited, at most once per RESTART_DELAY"""
+        now = time.monotonic()
+        for worker in self.workers:
+            process = self.processes.get(worker.name)
+            if process is None or process.is_alive():
+                continue
+            if worker.name not in self.exited_at:
+                print(f"Worker {worker.name} exited with code {process.exitcode}; "
+                      f"restarting in {RESTART_DELAY} s", file=sys.stderr, flush=True)
+                self.exited_at[worker.name] = now
+                metrics.REGISTRY.remove_remote('worker', worker.name)
+                metrics.WORKER_RESTARTS.labels(worker.name).inc()
+            elif now - self.exited_at[worker.name] >= RESTART_DELAY:
+                del self.exited_at[worker.name]
+                self.start(worker)
+
+    def signal_workers(self, sig):
+        for process in self.processes.values():
+            if process.is_alive():
+                os.kill(process.pid, sig)
+
+    def stop(self, timeout=20):
+        """Stop every worker (SIGTERM, then SIGKILL after timeout) and the dispatcher"""
+        self.signal_workers(signal.SIGTERM)
+        deadline = time.monotonic() + timeout
+        for process in self.processes.values():
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.kill()
+        self._stopping.set()
+        self.dispatcher.stop()
+
+    def _run_channel(self):
+        """Deliver heartbeats and store metric snapshots sent by the workers"""
+        while not self._stopping.is_set():
+            try:
+                message = self.channel.get(timeout=1)
+            except queue.Empty:
+                continue
+            if message[0] == 'heartbeat':
+                self.dispatcher.submit(*message[1:])
+            elif message[0] == 'metrics':
+                metrics.REGISTRY.set_remote('worker', message[1], message[2])
+
+
+def argument_parser():
+    parser = ArgumentParser(description="Run one headless monitor process per RTL-SDR dongle")
+    parser.add_argument(
+        "config",
+        help="JSON file listing the workers: name, dongle serial and monitor arguments")
+    parser.add_argument(
+        "-m", "--metrics-port", dest="metrics_port", type=int,
+        help="Serve every worker's Prometheus metrics on http://127.0.0.1:PORT/metrics")
+    return parser
+
+
+def main():
+    options = argument_parser().parse_args()
+    metrics_port, workers, heartbeat = load_workers(options.config)
+    metrics_port = options.metrics_port or metrics_port
+
+    supervisor = Supervisor(workers, heartbeat)
+    for worker in workers:
+        supervisor.start(worker)
+    if metrics_port:
+        metrics.start_http_server(metrics_port)
+
+    stopping = threading.Event()
+
+    def sig_handler(sig=None, frame=None):
+        stopping.set()
+
+    def hup_handler(sig=None, frame=None):
+        # Each worker re-reads its own config
+        supervisor.signal_workers(signal.SIGHUP)
+
+    signal.signal(signal.SIGINT, sig_handler)
+    signal.signal(signal.SIGTERM, sig_handler)
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, hup_handler)
+
+    print(f"Supervising {len(workers)} workers", flush=True)
+    while not stopping.wait(1):
+        supervisor.check()
+
+    supervisor.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""
+Synthetic repeater traffic for benchmarks and detector regression runs
+
+A scene is a complex noise floor plus FM transmitters, each keyed up and
+down on its own schedule. Every transmitter carries a 1 kHz "voice" tone and
+optionally a CTCSS tone, and can be marked as interference so it is left out
+of the ground truth. Samples are produced in chunks of any size with exact
+phase continuity, since each carrier's phase is a closed-form function of time.
+"""
+
+import numpy as np
+from ctcss import CTCSS_TONES
+from iq_source import sigmf_paths, write_sigmf_meta
+
+
+def key_pattern(duration, rng, mean_on=4.0, mean_off=8.0, min_on=0.5, min_off=0.5):
+    """Random key-up schedule [(start_s, stop_s), ...] covering duration seconds"""
+    keyups = []
+    t = rng.exponential(mean_off)
+    while t < duration:
+        on = max(min_on, rng.exponential(mean_on))
+        keyups.append((t, min(t + on, duration)))
+        t += on + max(min_off, rng.exponential(mean_off))
+    return keyups
+
+
+def gap_pattern(keyups, duration, rng, guard=1.0, min_on=0.5):
+    """One key-up inside every gap of keyups that leaves guard seconds clear on both sides"""
+    pattern = []
+    edges = [0.0] + [t for keyup in keyups for t in keyup] + [duration]
+    for start, stop in zip(edges[::2], edges[1::2]):
+        room = stop - start - 2 * guard
+        if room >= min_on:
+            on = rng.uniform(min_on, room)
+            t = start + guard + rng.uniform(0, room - on)
+            pattern.append((t, t + on))
+    return pattern
+
+
+class Carrier:
+    """One FM transmitter at an offset from the capture centre"""
+
+    def __init__(self, offset, keyups, level_db=-20, deviation=3000, audio_freq=1000,
+                 ctcss=None, ctcss_deviation=500, name=None, interference=False):
+        self.offset = offset
+        self.keyups = list(keyups)
+        self.amplitude = 10 ** (level_db / 20)
+        self.deviation = deviation
+        self.audio_freq = audio_freq
+        self.ctcss = ctcss
+        self.ctcss_deviation = ctcss_deviation
+        self.name = name
+        self.interference = interference
+
+    def render(self, out, t0, samp_rate):
+        """Add this carrier into out, whose first sample is at time t0"""
+        n = len(out)
+        t1 = t0 + n / samp_rate
+        for start, stop in self.keyups:
+            if stop <= t0 or start >= t1:
+                continue
+            lo = max(0, int(np.ceil((start - t0) * samp_rate)))
+            hi = min(n, int(np.ceil((stop - t0) * samp_rate)))
+            t = t0 + np.arange(lo, hi) / samp_rate
+
+            phase = 2 * np.pi * self.offset * t
+            phase -= (self.deviation / self.audio_freq) * np.cos(2 * np.pi * self.audio_freq * t)
+            if self.ctcss:
+                phase -= (self.ctcss_deviation / self.ctcss) * np.cos(2 * np.pi * self.ctcss * t)
+            out[lo:hi] += self.amplitude * np.exp(1j * phase)
+
+
+class SyntheticScene:
+    """Noise floor plus a set of carriers, rendered chunk by chunk"""
+
+    def __init__(self, carriers, samp_rate=2048000, noise_db=-60, seed=0):
+        self.carriers = carriers
+        self.samp_rate = samp_rate
+        self.noise_std = np.sqrt(10 ** (noise_db / 10) / 2)
+        self.rng = np.random.default_rng(seed)
+        self.position = 0
+
+    def next(self, n):
+        """Render the next n samples"""
+        out = np.empty(n, dtype=np.complex64)
+        out.real = self.rng.standard_normal(n, dtype=np.float32)
+        out.imag = self.rng.standard_normal(n, dtype=np.float32)
+        out *= self.noise_std
+
+        t0 = self.position / self.samp_rate
+        for carrier in self.carriers:
+            carrier.render(out, t0, self.samp_rate)
+        self.position += n
+        return out
+
+    def truth(self):
+        """Ground-truth key-ups of every wanted (non-interference) carrier, by name"""
+        return {carrier.name: carrier.keyups for carrier in self.carriers if not carrier.interference}
+
+    def save_sigmf(self, path, duration, center_freq=146.52e6, chunk=1 << 20):
+        """Render duration seconds to a SigMF recording that iq_source can replay"""
+        _, data_path = sigmf_paths(path)
+        remaining = int(duration * self.samp_rate)
+        with open(data_path, 'wb') as f:
+            while remaining > 0:
+                n = min(chunk, remaining)
+                self.next(n).tofile(f)
+                remaining -= n
+        write_sigmf_meta(path, self.samp_rate, [{'core:sample_start': 0, 'core:frequency': center_freq}],
+                         hw="synthetic_iq.SyntheticScene")
+
+
+def repeater_scene(offsets, duration, level_db=-30, noise_db=-60, adjacent_offset=25000,
+                   ctcss=100.0, samp_rate=2048000, seed=0, weak_db=None):
+    """
+    Busy repeaters at the given offsets, each with an interferer adjacent_offset away
+
+    Interferers are keyed independently and excluded from the ground truth, so
+    any detection they cause on a wanted channel counts as a false detection.
+    With weak_db, each channel also carries a weak co-channel signal at that
+    level in the gaps between its key-ups, likewise left out of the truth.
+    """
+    rng = np.random.default_rng(seed)
+    carriers = []
+    for i, offset in enumerate(offsets):
+        keyups = key_pattern(duration, rng)
+        carriers.append(Carrier(offset, keyups, level_db, ctcss=ctcss, name=i))
+        if adjacent_offset:
+            carriers.append(Carrier(offset + adjacent_offset, key_pattern(duration, rng), level_db + 10,
+                                    ctcss=CTCSS_TONES[i % len(CTCSS_TONES)], interference=True))
+        if weak_db is not None:
+            carriers.append(Carrier(offset, gap_pattern(keyups, duration, rng), weak_db, ctcss=ctcss,
+                                    interference=True))
+    return SyntheticScene(carriers, samp_rate, noise_db, seed)
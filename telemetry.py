@@ -0,0 +1,118 @@
+"""
+Live telemetry over a local ZeroMQ PUB socket, for remote dashboards
+
+The headless daemon publishes and any number of viewers subscribe
+(simple_monitor.py --connect), so a dashboard adds no load to the DSP and a
+frozen GUI can never stall sample processing: PUB drops messages for a slow
+subscriber instead of waiting. Each message is two frames, a topic and a
+JSON event:
+
+    power      {'type': 'power', 'time': ..., 'channels': {'146.9400 MHz':
+                {'power_db': -42.5, 'carrier': True, 'threshold_db': -30.0}}}
+    activity   key-up onsets and offsets, as on the event bus
+    heartbeat  pushes the detectors asked for, as on the event bus
+    result     {'type': 'result', 'url': ..., 'ok': True, 'status': '200',
+                'latency': 0.12, 'time': ...}
+
+Needs the optional pyzmq package (pip install pyzmq).
+"""
+
+import json
+import time
+import metrics
+
+DEFAULT_ADDRESS = "tcp://127.0.0.1:5557"
+TOPICS = {'power': b'power', 'activity': b'activity', 'heartbeat': b'heartbeat', 'result': b'result'}
+
+
+def _zmq():
+    try:
+        import zmq
+    except ImportError:
+        raise ValueError("Telemetry needs pyzmq: pip install pyzmq")
+    return zmq
+
+
+def power_event(channel_names=None):
+    """
+    A 'power' event with every channel's current power, carrier state and threshold
+
+    Read from the channel gauges the detectors already keep for /metrics, so
+    it works the same for the single-channel, channelizer and scan chains.
+    channel_names optionally renames series, e.g. {'0': '146.9400 MHz'}.
+    """
+    power = metrics.CHANNEL_POWER.snapshot()
+    carrier = metrics.CHANNEL_CARRIER.snapshot()
+    threshold = metrics.CHANNEL_THRESHOLD.snapshot()
+    channels = {}
+    for key, value in power.items():
+        name = key[0] if key else ''
+        channels[(channel_names or {}).get(name, name)] = {
+            'power_db': round(value, 1),
+            'carrier': bool(carrier.get(key)),
+            'threshold_db': threshold.get(key),
+        }
+    return {'type': 'power', 'time': time.time(), 'channels': channels}
+
+
+class TelemetrySink:
+    """
+    Event bus sink publishing every event on a ZeroMQ PUB socket
+
+    The socket is only touched from the sink's worker thread, as ZeroMQ
+    sockets are not thread-safe. A small send high-water mark bounds what
+    queues up for slow subscribers.
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, name='telemetry', hwm=100, types=None):
+        zmq = _zmq()
+        self.name = name
+        self.address = address
+        self.types = types
+        self.context = zmq.Context.instance()
+        self.socket = self.context.socket(zmq.PUB)
+        self.socket.setsockopt(zmq.SNDHWM, hwm)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.bind(address)
+        self._noblock = zmq.NOBLOCK
+        self._again = zmq.Again
+
+    def send(self, event):
+        topic = TOPICS.get(event['type'], event['type'].encode())
+        try:
+            self.socket.send_multipart([topic, json.dumps(event).encode()], self._noblock)
+        except self._again:
+            pass  # no room for a slow subscriber; telemetry is best-effort
+
+    def close(self):
+        self.socket.close()
+
+
+class TelemetrySubscriber:
+    """
+    Receives telemetry events from a daemon's PUB socket
+
+    Create and use it in one thread. recv() returns the next event, or None
+    if nothing arrived within timeout seconds.
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, topics=None):
+        zmq = _zmq()
+        self.context = zmq.Context.instance()
+        self.socket = self.context.socket(zmq.SUB)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.setsockopt(zmq.RCVHWM, 100)
+        for topic in topics or ('',):
+            self.socket.setsockopt(zmq.SUBSCRIBE, topic.encode())
+        self.socket.connect(address)
+        self.poller = zmq.Poller()
+        self.poller.register(self.socket, zmq.POLLIN)
+
+    def recv(self, timeout=0.5):
+        if not self.poller.poll(timeout * 1000):
+            return None
+        topic, payload = self.socket.recv_multipart()
+        return json.loads(payload)
+
+    def close(self):
+        self.socket.close()
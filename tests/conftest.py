@@ -0,0 +1,48 @@
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+
+# The monitor's modules live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class StubKuma(ThreadingHTTPServer):
+    """Answers push requests with 200, or with status while it is set; records (time, path)"""
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _StubHandler)
+        self.hits = []
+        self.status = 200
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server_address[1]}{path}"
+
+    def wait_for(self, count, timeout=5):
+        deadline = time.monotonic() + timeout
+        while len(self.hits) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return len(self.hits) >= count
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.hits.append((time.monotonic(), self.path))
+        self.send_response(self.server.status)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def kuma():
+    server = StubKuma()
+    yield server
+    server.shutdown()
+    server.server_close()
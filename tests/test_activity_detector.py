@@ -0,0 +1,50 @@
+import numpy as np
+from activity_detector import ActivityDetector, db_to_linear
+
+
+def reference_events(power, attack_db, release_db, min_samples):
+    """One sample at a time, the way the original block classified power"""
+    attack, release = db_to_linear(attack_db), db_to_linear(release_db)
+    events, carrier, start = [], False, 0
+    for i, p in enumerate(power):
+        if not carrier and p > attack:
+            carrier, start = True, i
+        elif carrier and p < release:
+            carrier = False
+            if i - start >= min_samples:
+                events += [('onset', start), ('offset', i)]
+    if carrier and len(power) - start >= min_samples:
+        events.append(('onset', start))
+    return events
+
+
+def piecewise_power(rng, n):
+    """Levels below release, inside the hysteresis band and above attack, held for random runs"""
+    levels = []
+    while len(levels) < n:
+        levels += [rng.choice([-50.0, -31.5, -25.0])] * int(rng.integers(1, 40))
+    return db_to_linear(np.array(levels[:n]))
+
+
+def test_random_buffer_splits_match_the_scalar_reference():
+    rng = np.random.default_rng(1)
+    for _ in range(20):
+        power = piecewise_power(rng, 2000)
+        min_samples = int(rng.integers(0, 30))
+        expected = reference_events(power, -30, -33, min_samples)
+
+        detector = ActivityDetector(-30, -33, min_samples)
+        cuts = np.sort(rng.integers(0, len(power), 15))
+        events = []
+        for buffer in np.split(power, cuts):
+            events += detector.process(buffer)
+        assert events == expected
+
+
+def test_skip_ends_a_carrier_at_the_gap():
+    detector = ActivityDetector(-30, min_samples=5)
+    loud = np.full(10, db_to_linear(-20.0))
+    assert detector.process(loud) == [('onset', 0)]
+    assert detector.skip(100) == [('offset', 10)]
+    assert detector.runs[0][:2] == (0, 10)
+    assert detector.process(loud) == [('onset', 110)]
@@ -0,0 +1,36 @@
+import numpy as np
+from activity_log import ActivityLog
+
+
+def test_ring_wraps_and_keeps_the_newest_events():
+    log = ActivityLog(capacity=8)
+    for t in range(20):
+        log.record(t % 3, float(t), t + 0.5, -40.0)
+    assert log.count == 8
+    assert log.recent(3)['onset'].tolist() == [17.0, 18.0, 19.0]
+    assert log.between(0)['onset'].tolist() == list(map(float, range(12, 20)))
+    # A range straddling the wrap point in storage
+    assert log.between(14, 18)['onset'].tolist() == [14.0, 15.0, 16.0, 17.0]
+    assert log.between(12, 20, channel=0)['onset'].tolist() == [12.0, 15.0, 18.0]
+
+
+def test_late_events_are_kept_in_order():
+    log = ActivityLog(capacity=4)
+    for onset in (1.0, 2.0, 5.0, 3.0, 4.0, 6.0):
+        log.record(0, onset, onset + 0.1, -40.0)
+    assert log.between(0)['onset'].tolist() == [3.0, 4.0, 5.0, 6.0]
+
+
+def test_reopened_file_recovers_the_oldest_event(tmp_path):
+    path = str(tmp_path / 'activity.npy')
+    log = ActivityLog(capacity=8, path=path)
+    for t in range(11):
+        log.record(1, 100.0 + t, 100.5 + t, -40.0)
+    log.flush()
+
+    reopened = ActivityLog(path=path, readonly=True)
+    assert (reopened.count, reopened.start) == (8, 3)
+    assert reopened.between(105, 108)['onset'].tolist() == [105.0, 106.0, 107.0]
+    _, counts, airtime = reopened.counts(103, 111, 4)
+    assert counts.tolist() == [4, 4]
+    assert np.allclose(airtime, [2.0, 2.0])
@@ -0,0 +1,94 @@
+import numpy as np
+from airtime import AirtimeStats
+
+
+class Channel:
+    def __init__(self, name):
+        self.name = name
+
+
+class Monitor:
+    """Stands in for a channel monitor: listeners name channels from the list it is running"""
+
+    def __init__(self, names):
+        self.channels = [Channel(name) for name in names]
+
+
+def airtime_by_channel(stats):
+    totals = {}
+    for record in stats.records('day'):
+        totals[record['channel']] = totals.get(record['channel'], 0) + record['airtime']
+    return totals
+
+
+def keyups_by_channel(stats):
+    totals = {}
+    for record in stats.records('day'):
+        totals[record['channel']] = totals.get(record['channel'], 0) + record['keyups']
+    return totals
+
+
+def test_reload_with_fewer_channels_before_the_monitor_adopts_them():
+    stats = AirtimeStats(['A', 'B', 'C'])
+    monitor = Monitor(['A', 'B', 'C'])
+    listener = stats.listener(lambda i: monitor.channels[i].name)
+    listener(0, 'onset', 0.0, 0.0)
+    listener(2, 'onset', 0.0, 0.0)
+
+    # The reload renames the rows at once; the monitor keeps its old list until its next buffer
+    stats.set_names(['B', 'A'])
+    listener(2, 'offset', 10.0, 10.0)   # old index of 'C', which is gone
+    listener(0, 'offset', 10.0, 10.0)   # old index of 'A'
+    monitor.channels = [Channel('B'), Channel('A')]
+    listener(0, 'onset', 20.0, 20.0)
+    listener(0, 'offset', 25.0, 25.0)
+
+    # C's key-up is dropped rather than credited to a row now owned by someone else
+    assert keyups_by_channel(stats) == {'A': 1, 'B': 1}
+    assert stats.open == {}
+
+
+def test_reordered_channels_keep_their_rows(tmp_path):
+    path = str(tmp_path / 'airtime.npy')
+    stats = AirtimeStats(['A', 'B'], path)
+    stats.onset('B', 1000.0)
+    stats.offset('B', 1010.0)
+    stats.flush()
+
+    reopened = AirtimeStats(['B', 'A'], path)
+    assert airtime_by_channel(reopened) == {'B': 10.0}
+    reopened.set_names(['B', 'D'])   # D takes A's row, cleared first
+    assert reopened.row_names == ['D', 'B']
+
+
+def test_carrier_longer_than_the_minute_ring_keeps_its_newest_minutes():
+    stats = AirtimeStats(['A'])
+    start = 86400.0 * 20000
+    stats.onset('A', start)
+    stats.offset('A', start + 2 * 86400)
+
+    minutes = stats.rollup('minute')
+    assert len(minutes) == 1440
+    assert minutes['start'][0] == start + 86400   # the first day has been overwritten
+    assert np.all(minutes['airtime'] == 60)
+    assert stats.rollup('hour')['airtime'].sum() == 2 * 86400
+    days = stats.rollup('day')
+    assert days['airtime'].tolist() == [86400, 86400]
+    assert days['keyups'].tolist() == [1, 0]
+
+
+def test_a_year_later_reuses_the_slot_and_an_older_edge_is_dropped():
+    stats = AirtimeStats(['A'])
+    day = 86400.0
+    stats.onset('A', 10 * day)
+    stats.offset('A', 10 * day + 30)
+    stats.onset('A', 376 * day)   # same day slot, 366 days on
+    stats.offset('A', 376 * day + 20)
+    # A late edge for the overwritten day must not clear the newer bucket
+    stats.onset('A', 10 * day + 100)
+    stats.offset('A', 10 * day + 110)
+
+    days = stats.rollup('day')
+    assert days['start'].tolist() == [376 * day]
+    assert days['airtime'].tolist() == [20]
+    assert days['keyups'].tolist() == [1]
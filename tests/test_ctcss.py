@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('gnuradio')   # ctcss.py builds its blocks at import
+from ctcss import TONE_RATE, ToneBank
+
+
+def test_clean_tone_is_found_with_most_of_the_power():
+    bank = ToneBank()
+    t = np.arange(TONE_RATE) / TONE_RATE
+    tone, ratio = bank.detect(0.3 * np.sin(2 * np.pi * 100.0 * t) + 0.1)   # DC offset is ignored
+    assert tone == 100.0
+    assert ratio > 0.9
+
+
+def test_neighbouring_tones_are_resolved():
+    bank = ToneBank()
+    t = np.arange(TONE_RATE) / TONE_RATE
+    rng = np.random.default_rng(4)
+    for wanted in (67.0, 71.9, 74.4, 250.3):
+        audio = np.sin(2 * np.pi * wanted * t) + 0.3 * rng.standard_normal(TONE_RATE)
+        tone, ratio = bank.detect(audio)
+        assert tone == wanted
+        assert ratio > 0.5
+
+
+def test_noise_holds_little_power_in_any_tone():
+    bank = ToneBank()
+    _, ratio = bank.detect(np.random.default_rng(5).standard_normal(TONE_RATE))
+    assert ratio < 0.1
@@ -0,0 +1,107 @@
+import threading
+import time
+from event_bus import EventBus, EventSpool, KumaSink
+from heartbeat_dispatcher import HeartbeatDispatcher
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class StubSink:
+    """Records events; raises while down, and waits while the gate is closed"""
+
+    def __init__(self, name='stub'):
+        self.name = name
+        self.events = []
+        self.down = False
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def send(self, event):
+        self.gate.wait()
+        if self.down:
+            raise ConnectionError("broker unreachable")
+        self.events.append(event)
+
+
+def activity(i):
+    return {'type': 'activity', 'channel': 'test', 'kind': 'onset', 'time': float(i), 'power_db': -40.0}
+
+
+def test_overflow_is_spooled_by_the_sink_thread(tmp_path):
+    bus = EventBus()
+    sink = StubSink()
+    worker = bus.add_sink(sink, policy='spool', max_queue=2, spool=str(tmp_path / "sink.db"))
+    sink.gate.clear()                     # the sink is stuck on its first event
+    start = time.perf_counter()
+    for i in range(10):
+        bus.publish(activity(i))
+    assert time.perf_counter() - start < 0.05
+    # One event is being sent and two are queued; the rest wait in the overflow until the thread is free
+    assert worker.spool.count == 0
+    sink.gate.set()
+    assert wait_until(lambda: len(sink.events) == 10)
+    assert sorted(event['time'] for event in sink.events) == [float(i) for i in range(10)]
+    assert worker.spool.count == 0
+    bus.stop()
+
+
+def test_spooled_events_survive_a_failing_sink_and_are_replayed(tmp_path):
+    bus = EventBus()
+    sink = StubSink()
+    sink.down = True
+    worker = bus.add_sink(sink, policy='spool', max_queue=4, spool=str(tmp_path / "sink.db"))
+    worker.retry_base = 0.05
+    for i in range(3):
+        bus.publish(activity(i))
+    assert wait_until(lambda: worker.spool.count == 3)
+    time.sleep(0.3)                       # several retries fail; nothing may be deleted
+    assert worker.spool.count == 3
+    assert sink.events == []
+
+    sink.down = False
+    assert wait_until(lambda: worker.spool.count == 0)
+    assert [event['time'] for event in sink.events] == [0.0, 1.0, 2.0]
+    bus.stop()
+
+
+def test_stop_drains_the_queue():
+    bus = EventBus()
+    sink = StubSink()
+    bus.add_sink(sink, max_queue=100)
+    sink.gate.clear()
+    for i in range(20):
+        bus.publish(activity(i))
+    sink.gate.set()
+    bus.stop()
+    assert len(sink.events) == 20
+
+
+def test_stop_spools_what_a_failing_sink_cannot_take(tmp_path):
+    path = str(tmp_path / "sink.db")
+    bus = EventBus()
+    sink = StubSink()
+    sink.down = True
+    sink.gate.clear()
+    bus.add_sink(sink, policy='spool', max_queue=100, spool=path)
+    for i in range(5):
+        bus.publish(activity(i))
+    sink.gate.set()
+    bus.stop(timeout=1)
+    spool = EventSpool(path)
+    assert spool.count == 5
+    assert [event['time'] for _, event in spool.batch()] == [float(i) for i in range(5)]
+    spool.close()
+
+
+def test_stop_delivers_queued_heartbeats_to_kuma(kuma):
+    bus = EventBus()
+    bus.add_sink(KumaSink(HeartbeatDispatcher(rate=100, burst=10)))
+    for i in range(3):
+        bus.submit(kuma.url(f"/push/{i}"), cooldown_time=0)
+    bus.stop()
+    assert len(kuma.hits) == 3
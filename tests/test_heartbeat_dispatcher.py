@@ -0,0 +1,72 @@
+import time
+from heartbeat_dispatcher import HeartbeatDispatcher
+from heartbeat_spool import HeartbeatSpool
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_rate_limit_spreads_a_burst(kuma):
+    dispatcher = HeartbeatDispatcher(concurrency=4, rate=10, burst=1)
+    try:
+        for i in range(4):
+            assert dispatcher.submit(kuma.url(f"/push/{i}"), cooldown_time=0)
+        assert kuma.wait_for(4)
+        times = sorted(t for t, _ in kuma.hits)
+        # One token up front, then one every 0.1 s
+        assert times[-1] - times[0] >= 0.25
+    finally:
+        dispatcher.stop()
+
+
+def test_repeated_pushes_are_coalesced(kuma):
+    dispatcher = HeartbeatDispatcher(rate=100, burst=10)
+    try:
+        url = kuma.url("/push/a")
+        assert dispatcher.submit(url)
+        assert dispatcher.submit(url)        # still waiting to be sent
+        assert kuma.wait_for(1)
+        assert wait_until(lambda: url in dispatcher.last_heartbeat_time)
+        assert dispatcher.submit(url)        # inside the cooldown
+        time.sleep(0.2)
+        assert len(kuma.hits) == 1
+        assert dispatcher.coalesced == 2
+    finally:
+        dispatcher.stop()
+
+
+def test_failed_heartbeat_is_spooled_and_replayed(kuma, tmp_path):
+    path = str(tmp_path / "spool.db")
+    kuma.status = 500
+    dispatcher = HeartbeatDispatcher(max_retries=1, backoff_base=0.01, rate=100, burst=10,
+                                     spool=path, replay_interval=0.2)
+    try:
+        url = kuma.url("/push/down")
+        assert dispatcher.submit(url)
+        assert wait_until(lambda: dispatcher.spool.depth() == 1)
+        assert len(kuma.hits) >= 2           # the first try and one retry
+
+        kuma.status = 200
+        assert wait_until(lambda: dispatcher.spool.depth() == 0)
+        assert "msg=Activity" in kuma.hits[-1][1]
+    finally:
+        dispatcher.stop()
+    spool = HeartbeatSpool(path)
+    assert spool.depth() == 0
+    spool.close()
+
+
+def test_queue_overflow_is_spooled_off_the_caller(kuma, tmp_path):
+    kuma.status = 500
+    dispatcher = HeartbeatDispatcher(max_queue=1, concurrency=1, max_retries=0, rate=1, burst=1,
+                                     spool=str(tmp_path / "spool.db"), replay_interval=60)
+    try:
+        results = [dispatcher.submit(kuma.url(f"/push/{i}"), cooldown_time=0) for i in range(20)]
+        assert results.count(False) >= 18
+        assert wait_until(lambda: dispatcher.spool.depth() >= 18)
+    finally:
+        dispatcher.stop()
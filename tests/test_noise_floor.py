@@ -0,0 +1,42 @@
+import numpy as np
+from activity_detector import ActivityDetector, db_to_linear
+from noise_floor import AdaptiveThreshold, load_noise_floors, save_noise_floors
+
+RATE = 1000
+
+
+def noise(rng, seconds, level_db=-60.0, sigma_db=1.0):
+    return db_to_linear(rng.normal(level_db, sigma_db, int(seconds * RATE)))
+
+
+def test_floor_converges_on_the_noise_quantile():
+    rng = np.random.default_rng(2)
+    detector = ActivityDetector(-30, -33)
+    tracker = AdaptiveThreshold(detector, margin=10, rate=RATE, time_constant=60, warmup=5)
+
+    tracker.update(noise(rng, 2))
+    assert tracker.floor is None
+    assert detector.attack_threshold == -30
+
+    for _ in range(60):
+        tracker.update(noise(rng, 1))
+    # The 20th percentile of N(-60, 1) dB is -60.84 dB
+    assert abs(tracker.floor - -60.84) < 0.5
+    assert abs(detector.attack_threshold - (tracker.floor + 10)) < tracker.step
+    assert detector.attack_threshold - detector.release_threshold == 3
+
+
+def test_restore_round_trips_through_the_state_file(tmp_path):
+    rng = np.random.default_rng(3)
+    tracker = AdaptiveThreshold(ActivityDetector(-30), margin=10, rate=RATE, warmup=5)
+    tracker.update(noise(rng, 10))
+
+    path = str(tmp_path / 'noise.json')
+    save_noise_floors(path, {'A': tracker})
+    detector = ActivityDetector(-30)
+    restored = AdaptiveThreshold(detector, margin=10, rate=RATE, warmup=5)
+    restored.restore(load_noise_floors(path)['A'])
+
+    assert restored.floor == tracker.floor
+    assert detector.attack_threshold == tracker.detector.attack_threshold
+    assert load_noise_floors(str(tmp_path / 'missing.json')) == {}
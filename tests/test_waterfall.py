@@ -0,0 +1,40 @@
+import numpy as np
+from waterfall import Waterfall, dequantize
+
+
+def fill(waterfall, times):
+    for t in times:
+        waterfall.append(t, 146.52e6, 2.048e6, np.full(waterfall.bins, -80.0 + t % 10))
+
+
+def test_ring_wraps_and_between_spans_the_wrap():
+    waterfall = Waterfall(bins=8, capacity=10)
+    fill(waterfall, range(25))
+    assert (waterfall.count, waterfall.start) == (10, 5)
+    assert waterfall.between()['time'].tolist() == list(map(float, range(15, 25)))
+    rows = waterfall.between(18, 22)
+    assert rows['time'].tolist() == [18.0, 19.0, 20.0, 21.0]
+    assert np.all(dequantize(rows['power'][0]) == -72.0)
+
+
+def test_clock_step_back_keeps_the_ring_sorted():
+    waterfall = Waterfall(bins=8, capacity=4)
+    fill(waterfall, [10, 11, 5, 12])
+    assert waterfall.between()['time'].tolist() == [10.0, 11.0, 11.0, 12.0]
+
+
+def test_reopened_file_recovers_start_and_count(tmp_path):
+    path = str(tmp_path / 'waterfall.npy')
+    waterfall = Waterfall(path, bins=8, capacity=10)
+    fill(waterfall, range(100, 106))
+    waterfall.flush()
+    reopened = Waterfall(path, readonly=True)
+    assert (reopened.bins, reopened.count, reopened.start) == (8, 6, 0)
+
+    for rows in range(1, 13):
+        waterfall = Waterfall(str(tmp_path / f'wrapped{rows}.npy'), bins=8, capacity=10)
+        fill(waterfall, range(1000, 1000 + 10 + rows))
+        waterfall.flush()
+        reopened = Waterfall(str(tmp_path / f'wrapped{rows}.npy'), readonly=True)
+        assert (reopened.count, reopened.start) == (10, rows % 10)
+        assert reopened.between(1000)['time'].tolist() == list(map(float, range(1000 + rows, 1010 + rows)))
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Persistent waterfall: the band's spectrum history in a fixed-size ring file
+
+Each row is the average power spectrum over a few seconds, quantized to
+uint8 in 0.5 dB steps from -127.5 to 0 dBFS, with its Unix time, centre
+frequency and span. The file is a memory-mapped .npy sized when it is
+created (rows = days of history / resolution); the oldest rows are
+overwritten first. Rows are in time order, so finding a time range is a
+binary search that touches a few pages, and a slice reads only its own rows.
+It can be read from another process while the monitor is writing it:
+
+    python3 waterfall.py waterfall.npy info
+    python3 waterfall.py waterfall.npy image --since 12h -o last-night.png
+    python3 waterfall.py waterfall.npy export --since 2h --until 1h > slice.csv
+"""
+
+import csv
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from argparse import ArgumentParser
+import numpy as np
+from activity_log import format_time, parse_duration
+
+DB_MIN = -127.5   # dBFS of quantized value 0
+DB_STEP = 0.5     # dB per quantization step
+
+
+def row_dtype(bins):
+    return np.dtype([
+        ('time', '<f8'),          # Unix time at the end of the row's averaging period, NaN if unused
+        ('center_freq', '<f8'),   # Hz
+        ('span', '<f4'),          # Hz covered by the bins (the sample rate)
+        ('power', 'u1', (bins,)),  # quantized dBFS per bin, lowest frequency first
+    ])
+
+
+def quantize(power_db):
+    """dBFS values to uint8 steps, clipped to the representable range"""
+    return np.clip(np.rint((power_db - DB_MIN) / DB_STEP), 0, 255).astype(np.uint8)
+
+
+def dequantize(values):
+    return DB_MIN + values.astype(np.float32) * DB_STEP
+
+
+class Waterfall:
+    """
+    Ring of spectrum rows, optionally backed by a .npy file
+
+    An existing file is reopened with its own size and bin count; readonly
+    opens it for viewing without taking part in writing.
+    """
+
+    def __init__(self, path=None, bins=256, capacity=86400, readonly=False):
+        if path and (readonly or os.path.exists(path)):
+            self.rows = np.lib.format.open_memmap(path, mode='r' if readonly else 'r+')
+            names = self.rows.dtype.names or ()
+            if self.rows.ndim != 1 or names != ('time', 'center_freq', 'span', 'power'):
+                raise ValueError(f"{path} is not a waterfall file")
+        elif path:
+            self.rows = np.lib.format.open_memmap(path, mode='w+', dtype=row_dtype(bins), shape=(capacity,))
+            self.rows['time'] = np.nan
+        else:
+            self.rows = np.zeros(capacity, dtype=row_dtype(bins))
+            self.rows['time'] = np.nan
+        self.path = path
+        self.capacity = len(self.rows)
+        self.bins = self.rows.dtype['power'].shape[0]
+        self._lock = threading.Lock()
+        self._recover()
+
+    def _time(self, position):
+        """Time of the row at a logical position, oldest first; reads one row"""
+        return float(self.rows[(self.start + position) % self.capacity]['time'])
+
+    def _recover(self):
+        """Find the fill level and the oldest row by binary search, without reading the file"""
+        # Rows are written in order from the first, so unused rows are a suffix until the ring is full
+        self.start = 0
+        lo, hi = 0, self.capacity
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if np.isnan(self.rows[mid]['time']):
+                hi = mid
+            else:
+                lo = mid + 1
+        self.count = lo
+        if self.count == self.capacity:
+            # A full ring is a rotated sorted array: the oldest row is the first older than row 0
+            first = self.rows[0]['time']
+            lo, hi = 1, self.capacity
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self.rows[mid]['time'] < first:
+                    hi = mid
+                else:
+                    lo = mid + 1
+            self.start = lo % self.capacity
+
+    def append(self, t, center_freq, span, power_db):
+        """Add one row of bins (dBFS), overwriting the oldest when full"""
+        with self._lock:
+            if self.count:
+                t = max(t, self._time(self.count - 1))  # keep the ring sorted through clock steps
+            index = (self.start + self.count) % self.capacity
+            if self.count == self.capacity:
+                self.start = (self.start + 1) % self.capacity
+            else:
+                self.count += 1
+            row = self.rows[index:index + 1]
+            row['power'] = quantize(power_db)
+            row['center_freq'] = center_freq
+            row['span'] = span
+            row['time'] = t  # last, so a reader never sees a timed row with stale bins
+
+    def _search(self, t):
+        """Logical position of the first row at or after time t"""
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._time(mid) < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def span(self, start=None, stop=None):
+        """Logical [lo, hi) positions of the rows with time in [start, stop)"""
+        with self._lock:
+            lo = self._search(start) if start is not None else 0
+            hi = self._search(stop) if stop is not None else self.count
+        return lo, max(lo, hi)
+
+    def read(self, lo, hi, step=1):
+        """Copy of rows at logical positions lo, lo + step, ... below hi, oldest first"""
+        positions = (self.start + np.arange(lo, hi, step)) % self.capacity
+        return self.rows[positions]
+
+    def between(self, start=None, stop=None):
+        """Copy of the rows with time in [start, stop), oldest first"""
+        return self.read(*self.span(start, stop))
+
+    def overview(self, start=None, stop=None, height=1000, chunk=4096):
+        """
+        At most height rows for a long range: each is the per-bin maximum of a
+        group of consecutive rows, so short bursts stay visible. Reads the
+        range in chunks, never all at once. Returns (times, power) arrays.
+        """
+        lo, hi = self.span(start, stop)
+        group = max(1, -(-(hi - lo) // height))
+        times, power = [], []
+        for first in range(lo, hi, group * max(1, chunk // group)):
+            last = min(hi, first + group * max(1, chunk // group))
+            rows = self.read(first, last)
+            groups = -(-len(rows) // group)
+            padded = np.zeros((groups * group, self.bins), dtype=np.uint8)
+            padded[:len(rows)] = rows['power']
+            power.append(padded.reshape(groups, group, self.bins).max(axis=1))
+            times.append(rows['time'][::group])
+        if not power:
+            return np.zeros(0), np.zeros((0, self.bins), dtype=np.uint8)
+        return np.concatenate(times), np.concatenate(power)
+
+    def flush(self):
+        """Write a file-backed ring to disk"""
+        if self.path:
+            self.rows.flush()
+
+
+def write_png(path, image):
+    """Write a 2D uint8 array as an 8-bit grayscale PNG, with the standard library only"""
+    height, width = image.shape
+    raw = np.zeros((height, width + 1), dtype=np.uint8)   # filter type 0 per scanline
+    raw[:, 1:] = image
+
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data +
+                struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(raw.tobytes(), 6)))
+        f.write(chunk(b'IEND', b''))
+
+
+def argument_parser():
+    parser = ArgumentParser(description="View or export a persisted repeater band waterfall")
+    parser.add_argument("path", help="Waterfall .npy file written by the monitor")
+    parser.add_argument("--since", type=parse_duration, help="Start this long ago, e.g. 12h (default: oldest row)")
+    parser.add_argument("--until", type=parse_duration, help="End this long ago, e.g. 1h (default: newest row)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("info", help="Size, time range and frequencies covered")
+
+    image = commands.add_parser("image", help="Write the range as a PNG, newest row at the top")
+    image.add_argument("-o", "--output", required=True, help="PNG file to write")
+    image.add_argument("--height", type=int, default=1000,
+                       help="Most rows in the image; longer ranges keep each group's peak (default: 1000)")
+
+    export = commands.add_parser("export", help="Write the rows of the range in dBFS")
+    export.add_argument("--format", choices=('csv', 'npy'), default='csv')
+    export.add_argument("-o", "--output", help="File to write (default: standard output, CSV only)")
+    return parser
+
+
+def main():
+    options = argument_parser().parse_args()
+    waterfall = Waterfall(options.path, readonly=True)
+    now = time.time()
+    start = now - options.since if options.since is not None else None
+    stop = now - options.until if options.until is not None else None
+
+    if options.command == 'info':
+        print(f"{waterfall.count} of {waterfall.capacity} rows used, {waterfall.bins} bins each")
+        if waterfall.count:
+            first, last = waterfall.read(0, 1)[0], waterfall.read(waterfall.count - 1, waterfall.count)[0]
+            print(f"From {format_time(first['time'])} to {format_time(last['time'])}")
+            print(f"Centre {last['center_freq'] / 1e6:.4f} MHz, span {last['span'] / 1e3:.0f} kHz")
+        return
+
+    if options.command == 'image':
+        times, power = waterfall.overview(start, stop, options.height)
+        if not len(times):
+            sys.exit("No rows in that time range")
+        # Stretch the occupied part of the 0.5 dB scale over the grey levels
+        lo, hi = np.percentile(power, [1, 99.9])
+        image = np.clip((power.astype(np.float32) - lo) * 255 / max(hi - lo, 1), 0, 255).astype(np.uint8)
+        write_png(options.output, image[::-1])
+        print(f"{len(times)} rows from {format_time(times[0])} to {format_time(times[-1])}; "
+              f"grey 0-255 is {DB_MIN + lo * DB_STEP:.1f} to {DB_MIN + hi * DB_STEP:.1f} dBFS")
+        return
+
+    rows = waterfall.between(start, stop)
+    if options.format == 'npy':
+        if not options.output:
+            sys.exit("--format npy needs --output")
+        np.save(options.output, rows)
+        return
+    f = open(options.output, 'w', newline='') if options.output else sys.stdout
+    writer = csv.writer(f)
+    span = float(rows['span'][-1]) if len(rows) else 0.0
+    offsets = (np.arange(waterfall.bins) + 0.5) / waterfall.bins * span - span / 2
+    writer.writerow(['time', 'center_freq'] + [f"{offset:+.0f}" for offset in offsets])
+    for row in rows:
+        writer.writerow([format_time(row['time']), f"{row['center_freq']:.0f}"] +
+                        [f"{value:.1f}" for value in dequantize(row['power'])])
+    if options.output:
+        f.close()
+
+
+if __name__ == '__main__':
+    main()
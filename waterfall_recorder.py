@@ -0,0 +1,113 @@
+"""
+Background spectrum recording into a waterfall.Waterfall ring
+
+The recorder taps the raw capture beside the detectors. Before anything
+else it keeps one FFT frame's worth of samples out of every stride frames
+(about 50 frames/s, against 2000/s at 2.048 MS/s), so the FFT, |X|^2 and
+the Python averaging run on a few percent of the samples, whatever else the
+monitor is doing. Frames are averaged over resolution seconds, adjacent
+bins are averaged down to the file's bin count, and the row goes to the
+ring in dBFS. A burst shorter than the gap between frames can be missed;
+the history is an overview of band occupancy, not a detector.
+"""
+
+import time
+import numpy as np
+from gnuradio import gr
+from gnuradio import blocks
+from gnuradio import fft
+from gnuradio.fft import window
+import latency
+
+
+class waterfall_sink(gr.sync_block):
+    """
+    Averages |X|^2 frames into one waterfall row every resolution seconds
+
+    scale normalizes a frame so a full-scale carrier reads 0 dBFS;
+    frame_period is the stream time between the frames it receives.
+    """
+    def __init__(self, waterfall, fft_size, samp_rate, center_freq, resolution=1.0, frame_period=None,
+                 scale=1.0, clock=latency.CLOCK):
+        gr.sync_block.__init__(self,
+            name="waterfall_sink",
+            in_sig=[(np.float32, fft_size)],
+            out_sig=[])
+
+        self.waterfall = waterfall
+        self.fft_size = fft_size
+        self.samp_rate = samp_rate
+        self.center_freq = center_freq
+        self.frame_period = frame_period or fft_size / samp_rate
+        self.frames_per_row = max(1, int(round(resolution / self.frame_period)))
+        self.scale = scale
+        self.clock = clock
+        self.retune_to = None
+
+        self.total = np.zeros(fft_size, dtype=np.float64)
+        self.frames = 0
+
+    def set_center_freq(self, center_freq):
+        """The capture was retuned; the partly averaged row is dropped"""
+        self.retune_to = center_freq
+
+    def work(self, input_items, output_items):
+        frames = input_items[0]
+        n = len(frames)
+        if self.retune_to is not None:
+            self.center_freq, self.retune_to = self.retune_to, None
+            self.total[:] = 0
+            self.frames = 0
+
+        i = 0
+        while i < n:
+            k = min(n - i, self.frames_per_row - self.frames)
+            self.total += frames[i:i + k].sum(axis=0)
+            self.frames += k
+            i += k
+            if self.frames == self.frames_per_row:
+                self._write((self.nitems_read(0) + i) * self.frame_period)
+        return n
+
+    def _write(self, stream_time):
+        power = self.total.reshape(self.waterfall.bins, -1).mean(axis=1) * (self.scale / self.frames)
+        t = self.clock.unix(stream_time)
+        self.waterfall.append(t if t is not None else time.time(), self.center_freq, self.samp_rate,
+                              10 * np.log10(np.maximum(power, 1e-20)))
+        self.total[:] = 0
+        self.frames = 0
+
+
+class spectrum_recorder(gr.hier_block2):
+    """
+    Complex capture in, waterfall rows out to a waterfall.Waterfall
+
+    keep_m_in_n -> stream_to_vector -> windowed FFT -> |X|^2 -> waterfall_sink,
+    normalized like the channelizer's power.
+    """
+    def __init__(self, waterfall, samp_rate=2048000, center_freq=146.52e6, resolution=1.0, frame_rate=50):
+        gr.hier_block2.__init__(self,
+            "spectrum_recorder",
+            gr.io_signature(1, 1, gr.sizeof_gr_complex),
+            gr.io_signature(0, 0, 0))
+
+        # At least 1024 points, a whole number of FFT bins per file bin
+        fft_size = waterfall.bins * max(1, 1024 // waterfall.bins)
+        stride = max(1, int(samp_rate / (fft_size * frame_rate)))
+        taps = window.blackmanharris(fft_size)
+        scale = 1.0 / (fft_size * float(np.sum(np.square(taps))))
+
+        self.keep = blocks.keep_m_in_n(gr.sizeof_gr_complex, fft_size, fft_size * stride, 0)
+        self.stream_to_vector = blocks.stream_to_vector(gr.sizeof_gr_complex, fft_size)
+        self.fft = fft.fft_vcc(fft_size, True, taps, True, 1)
+        self.mag_squared = blocks.complex_to_mag_squared(fft_size)
+        self.sink = waterfall_sink(waterfall, fft_size, samp_rate, center_freq, resolution,
+                                   fft_size * stride / samp_rate, scale)
+
+        self.connect(self, self.keep, self.stream_to_vector, self.fft, self.mag_squared, self.sink)
+        print(f"Waterfall: {waterfall.bins} bins every {resolution:g} s from "
+              f"{samp_rate / (fft_size * stride):.0f} FFT frames/s, {waterfall.capacity * resolution / 86400:.1f} days "
+              f"in {waterfall.rows.nbytes / 1e6:.0f} MB")
+
+    def set_center_freq(self, center_freq):
+        self.sink.set_center_freq(center_freq)